@@ -8,6 +8,8 @@ from django.contrib.auth.views import LoginView
 from django.urls import reverse_lazy
 from django.http import JsonResponse
 
+from permanences.statistiques import totaux_membre
+
 
 def inscription_utilisateur(request):
     """Vue d'inscription pour les nouveaux utilisateurs"""
@@ -28,13 +30,14 @@ def inscription_utilisateur(request):
 def profil_utilisateur(request):
     """Vue du profil utilisateur"""
     user = request.user
-    inscriptions_actives = user.inscriptions.filter(annulee=False).count()
-    inscriptions_totales = user.inscriptions.count()
+    # Statistiques mensuelles précalculées, archives comprises
+    totaux = totaux_membre(user)
     
     context = {
         'user': user,
-        'inscriptions_actives': inscriptions_actives,
-        'inscriptions_totales': inscriptions_totales,
+        'inscriptions_actives': totaux['actives'],
+        'inscriptions_totales': totaux['totales'],
+        'heures_assurees': totaux['minutes'] / 60,
     }
     
     return render(request, 'accounts/profil.html', context)
@@ -54,10 +54,16 @@ INSTALLED_APPS = [
     'accounts', 
 ]
 
+# Mesures de performance par requête (tableau de bord : /permanences/gestion/performance/) ;
+# désactivées par défaut : middleware retiré et backend de gabarits standard
+PERF_MESURE = os.environ.get('PERF_MESURE', 'False') == 'True'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'permanences.perf.MesurePerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'permanences.middleware.RafraichissementSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -79,7 +85,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Avec PERF_MESURE, DjangoTemplates dont le rendu est chronométré (voir permanences.perf)
+        'BACKEND': (
+            'permanences.perf.TemplatesMesures' if PERF_MESURE
+            else 'django.template.backends.django.DjangoTemplates'
+        ),
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -122,6 +132,79 @@ else:
     }
 
 
+# Cache
+# Mémoire locale par défaut ; CACHE_DIR active un cache fichier partagé entre
+# les workers gunicorn, REDIS_URL un serveur Redis (ou compatible)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Durée de conservation d'une semaine du calendrier en cache (secondes)
+CALENDRIER_CACHE_TIMEOUT = int(os.environ.get('CALENDRIER_CACHE_TIMEOUT', 3600))
+
+
+# Envoi des emails (SMTP)
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'False') == 'True'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'permanences@localhost')
+
+# Email au membre de la liste d'attente qui obtient une place libérée
+LISTE_ATTENTE_EMAIL = os.environ.get('LISTE_ATTENTE_EMAIL', 'False') == 'True'
+
+# Rappels de la veille (commande envoyer_rappels) : emails par envoi sur une même connexion SMTP
+RAPPEL_TAILLE_LOT = int(os.environ.get('RAPPEL_TAILLE_LOT', 50))
+# Adresse du site dans les emails (liens absolus)
+SITE_URL = os.environ.get('SITE_URL', 'https://tpl-creil.fr')
+
+# Flux ICS du stand : changer cette valeur révoque l'URL publiée (le jeton est
+# signé avec SECRET_KEY) sans déconnecter les membres ; vide = jeton d'origine
+ICS_STAND_VERSION = os.environ.get('ICS_STAND_VERSION', '')
+
+# Une annulation moins de N heures avant le créneau est comptée comme tardive
+ANNULATION_TARDIVE_HEURES = int(os.environ.get('ANNULATION_TARDIVE_HEURES', 24))
+
+# Archivage des créneaux passés (commande archiver_creneaux)
+ARCHIVE_RETENTION_JOURS = int(os.environ.get('ARCHIVE_RETENTION_JOURS', 365))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', str(BASE_DIR / 'archives'))
+
+# Mesures de performance (PERF_MESURE, plus haut)
+PERF_TAILLE_TAMPON = int(os.environ.get('PERF_TAILLE_TAMPON', 2000))
+# Fichier où journaliser chaque mesure en JSON (une ligne par requête)
+PERF_JOURNAL = os.environ.get('PERF_JOURNAL')
+if PERF_JOURNAL:
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {'brut': {'format': '%(message)s'}},
+        'handlers': {
+            'perf': {'class': 'logging.FileHandler', 'filename': PERF_JOURNAL, 'formatter': 'brut'},
+        },
+        'loggers': {
+            'permanences.perf': {'handlers': ['perf'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -164,9 +247,19 @@ LOGOUT_REDIRECT_URL = '/permanences/'
 LOGIN_URL = '/accounts/login/'
 
 # Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# SESSION_MODE : cached_db (défaut, lecture dans le cache, écriture en base),
+# signed_cookies (aucun stockage serveur) ou db
+SESSION_ENGINES = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('SESSION_MODE', 'cached_db')]
 SESSION_COOKIE_AGE = 86400  # 24 heures
-SESSION_SAVE_EVERY_REQUEST = True
+# L'expiration n'est repoussée que lorsque cette fraction de SESSION_COOKIE_AGE
+# s'est écoulée (voir permanences.middleware.RafraichissementSessionMiddleware)
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_FRACTION_RAFRAICHISSEMENT = float(os.environ.get('SESSION_FRACTION_RAFRAICHISSEMENT', 0.5))
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 # Security settings
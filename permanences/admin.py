@@ -2,9 +2,22 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import CreneauHoraire, Inscription
+from .models import (
+    ArchiveMensuelle, Attente, CreneauHoraire, FermetureExceptionnelle, HoraireRecurrent, Inscription,
+    JOURS_SEMAINE, StatistiqueMensuelle
+)
+from .forms import ChoixMembreForm, InscriptionAdminForm
+from .generation import DUREE_CRENEAU, generer_creneaux
+from . import export, services
+from .statistiques import recalculer_statistiques
 from django import forms
+from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.shortcuts import render, redirect
+from django.utils import timezone
 from django.urls import path
 from datetime import date, datetime, timedelta
 
@@ -13,8 +26,17 @@ class PlageCreneauxForm(forms.Form):
     date_debut = forms.DateField(label="Date de début")
     heure_debut = forms.TimeField(label="Heure de début")
     heure_fin = forms.TimeField(label="Heure de fin")
+    duree = forms.IntegerField(label="Durée d'un créneau (minutes)", initial=60, min_value=60)
+    max_personnes = forms.IntegerField(label="Nombre maximum de personnes", initial=3, min_value=1)
     repeter = forms.BooleanField(label="Répéter chaque semaine", required=False)
     date_fin = forms.DateField(label="Jusqu'au (si répétition)", required=False)
+    jours = forms.TypedMultipleChoiceField(
+        label="Jours de la semaine (si répétition, par défaut celui de la date de début)",
+        choices=JOURS_SEMAINE,
+        coerce=int,
+        required=False,
+        widget=forms.CheckboxSelectMultiple
+    )
    
 
 class CreneauHoraireForm(forms.ModelForm):
@@ -26,6 +48,19 @@ class CreneauHoraireForm(forms.ModelForm):
         fields = "__all__"
 
 
+@admin.register(HoraireRecurrent)
+class HoraireRecurrentAdmin(admin.ModelAdmin):
+    list_display = ['jour_semaine', 'heure_ouverture', 'heure_fermeture', 'max_personnes', 'date_debut', 'date_fin', 'actif']
+    list_filter = ['actif', 'jour_semaine']
+    list_editable = ['actif']
+
+
+@admin.register(FermetureExceptionnelle)
+class FermetureExceptionnelleAdmin(admin.ModelAdmin):
+    list_display = ['date', 'motif']
+    date_hierarchy = 'date'
+
+
 @admin.register(CreneauHoraire)
 class CreneauHoraireAdmin(admin.ModelAdmin):
 
@@ -37,6 +72,7 @@ class CreneauHoraireAdmin(admin.ModelAdmin):
     search_fields = ['date']
     date_hierarchy = 'date'
     ordering = ['-date', 'heure_debut']
+    actions = ['inscrire_membre']
     # inlines = [InscriptionInline]
     
     
@@ -44,7 +80,11 @@ class CreneauHoraireAdmin(admin.ModelAdmin):
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
-            path('ajouter-plage/', self.admin_site.admin_view(self.ajouter_plage))
+            path(
+                'ajouter-plage/',
+                self.admin_site.admin_view(self.ajouter_plage),
+                name='permanences_creneauhoraire_ajouter_plage'
+            )
         ]
         return custom_urls + urls
 
@@ -53,101 +93,114 @@ class CreneauHoraireAdmin(admin.ModelAdmin):
             form = PlageCreneauxForm(request.POST)
             if form.is_valid():
                 date_debut = form.cleaned_data['date_debut']
-                heure_debut = form.cleaned_data['heure_debut']
-                heure_fin = form.cleaned_data['heure_fin']
                 repeter = form.cleaned_data['repeter']
                 date_fin = form.cleaned_data['date_fin'] if form.cleaned_data['date_fin'] else date_debut
+                if repeter:
+                    jours = form.cleaned_data['jours'] or [date_debut.weekday()]
+                else:
+                    date_fin, jours = date_debut, None
 
-                current_date = date_debut
-                while current_date <= date_fin:
-                    h = heure_debut
-                    while (datetime.combine(current_date, h) + timedelta(hours=1)).time() <= heure_fin:
-                        fin = (datetime.combine(current_date, h) + timedelta(hours=1)).time()
-                        CreneauHoraire.objects.create(
-                            date=current_date,
-                            heure_debut=h,
-                            heure_fin=fin,
-                            actif=True
-                        )
-                        h = fin
-                    if repeter:
-                        current_date += timedelta(days=7)
-                    else:
-                        break
-                self.message_user(request, "Créneaux créés avec succès !")
+                crees, ignores = generer_creneaux(
+                    date_debut,
+                    date_fin,
+                    form.cleaned_data['heure_debut'],
+                    form.cleaned_data['heure_fin'],
+                    duree=timedelta(minutes=form.cleaned_data['duree']),
+                    jours=jours,
+                    max_personnes=form.cleaned_data['max_personnes'],
+                )
+                self.message_user(request, f"{crees} créneau(x) créé(s), {ignores} déjà existant(s).")
                 return redirect("..")
         else:
             form = PlageCreneauxForm()
         return render(request, "admin/permanences/ajouter_plage.html", {"form": form})
     
+    def inscrire_membre(self, request, queryset):
+        """Inscrit un membre à tous les créneaux sélectionnés (page intermédiaire de choix du membre)"""
+        if 'appliquer' in request.POST:
+            form = ChoixMembreForm(request.POST)
+            if form.is_valid():
+                resultats = services.inscrire_plusieurs(
+                    form.cleaned_data['utilisateur'],
+                    CreneauHoraire.objects.filter(pk__in=queryset.values('pk')),
+                    form.cleaned_data['commentaire']
+                )
+                inscrits = sum(resultat in (services.INSCRIT, services.REACTIVE) for _, resultat in resultats)
+                self.message_user(request, f"{inscrits} inscription(s) sur {len(resultats)} créneau(x).")
+                for creneau, resultat in resultats:
+                    if resultat not in (services.INSCRIT, services.REACTIVE):
+                        self.message_user(
+                            request, f"{creneau} : {services.LIBELLES_RESULTAT[resultat]}", level='WARNING'
+                        )
+                return None
+        else:
+            form = ChoixMembreForm()
+        return render(request, 'admin/permanences/inscrire_membre.html', {
+            **self.admin_site.each_context(request),
+            'form': form,
+            'creneaux': queryset.order_by('date', 'heure_debut'),
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+            'opts': self.model._meta,
+        })
+    inscrire_membre.short_description = "Inscrire un membre aux créneaux sélectionnés"
+
     def get_queryset(self, request):
-        """Optimise les requêtes en préchargeant les inscriptions"""
-        return super().get_queryset(request).prefetch_related('inscriptions')
+        """Occupation lue dans le compteur dénormalisé : aucune requête par ligne"""
+        return super().get_queryset(request).annotate(
+            places=Greatest(F('max_personnes') - F('nb_inscrits'), 0)
+        )
     
     def nb_inscriptions_actives(self, obj):
-        """Compte le nombre d'inscriptions actives (non annulées)"""
-        try:
-            return obj.inscriptions.filter(annulee=False).count()
-        except Exception as e:
-            return f"Erreur: {e}"
+        """Nombre d'inscriptions actives (non annulées)"""
+        return obj.nb_inscrits
     nb_inscriptions_actives.short_description = 'Inscriptions actives'
+    nb_inscriptions_actives.admin_order_field = 'nb_inscrits'
     
     def places_libres(self, obj):
-        """Calcule le nombre de places libres"""
-        try:
-            inscriptions_actives = obj.inscriptions.filter(annulee=False).count()
-            places_libres = obj.max_personnes - inscriptions_actives
-            if places_libres <= 0:
-                return format_html('<span style="color: red; font-weight: bold;">Complet</span>')
-            elif places_libres == 1:
-                return format_html('<span style="color: orange; font-weight: bold;">1 place</span>')
-            else:
-                return format_html('<span style="color: green;">{} places</span>', places_libres)
-        except Exception as e:
-            return f"Erreur: {e}"
+        """Affiche le nombre de places libres"""
+        places_libres = obj.places
+        if places_libres <= 0:
+            return format_html('<span style="color: red; font-weight: bold;">Complet</span>')
+        elif places_libres == 1:
+            return format_html('<span style="color: orange; font-weight: bold;">1 place</span>')
+        else:
+            return format_html('<span style="color: green;">{} places</span>', places_libres)
     places_libres.short_description = 'Places disponibles'
+    places_libres.admin_order_field = 'places'
     
     def save_model(self, request, obj, form, change):
         
+        if change:
+            # Modification d'un créneau existant : pas de découpage
+            super().save_model(request, obj, form, change)
+            return
+
         repeter = form.cleaned_data.get('repeter')
         date_fin = form.cleaned_data.get('date_fin')
         debut = obj.heure_debut
         fin = obj.heure_fin
         date = obj.date
 
-         # On va créer les créneaux sur toutes les semaines si demandé
+        # On va créer les créneaux sur toutes les semaines si demandé
         if repeter and date_fin and date:
-            current_date = date
-            while current_date <= date_fin:
-                self._creer_creneaux_heure_par_heure(current_date, debut, fin, obj)
-                current_date += timedelta(days=7)
-            return  # On ne sauvegarde pas l'objet original
+            crees, ignores = generer_creneaux(
+                date, date_fin, debut, fin,
+                jours=[date.weekday()],
+                max_personnes=obj.max_personnes,
+                actif=obj.actif
+            )
+        elif datetime.combine(date, fin) - datetime.combine(date, debut) >= 2 * DUREE_CRENEAU:
+            # Cas normal : découpage automatique en créneaux d'une heure
+            crees, ignores = generer_creneaux(
+                date, date, debut, fin,
+                max_personnes=obj.max_personnes,
+                actif=obj.actif
+            )
         else:
-            # Cas normal : découpage automatique si besoin
-            self._creer_creneaux_heure_par_heure(date, debut, fin, obj, save_original=True)
+            if not CreneauHoraire.objects.filter(date=date, heure_debut=debut).exists():
+                super().save_model(request, obj, form, change)
             return
-        
-    def _creer_creneaux_heure_par_heure(self, date, debut, fin, obj, save_original=False):
-        delta = (datetime.combine(date, fin) - datetime.combine(date, debut))
-        heures = int(delta.total_seconds() // 3600)
-        if heures > 1:
-            for i in range(heures):
-                h_debut = (datetime.combine(date, debut) + timedelta(hours=i)).time()
-                h_fin = (datetime.combine(date, debut) + timedelta(hours=i+1)).time()
-                # Vérifie si le créneau existe déjà
-                if not CreneauHoraire.objects.filter(date=date, heure_debut=h_debut).exists():
-                    CreneauHoraire.objects.create(
-                        date=date,
-                        heure_debut=h_debut,
-                        heure_fin=h_fin,
-                        max_personnes=obj.max_personnes,
-                        actif=obj.actif
-                    )
-        else:
-            if save_original:
-                # Vérifie si le créneau existe déjà
-                if not CreneauHoraire.objects.filter(date=date, heure_debut=debut).exists():
-                    super(CreneauHoraireAdmin, self).save_model(None, obj, None, False)
+        self.message_user(request, f"{crees} créneau(x) créé(s), {ignores} déjà existant(s).")
 
 
 
@@ -155,17 +208,30 @@ class CreneauHoraireAdmin(admin.ModelAdmin):
 
 @admin.register(Inscription)
 class InscriptionAdmin(admin.ModelAdmin):
+    form = InscriptionAdminForm
     list_display = ['utilisateur_nom', 'creneau_info', 'date_inscription', 'statut_inscription']
     list_filter = ['annulee', 'creneau__date', 'date_inscription']
     search_fields = ['utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name']
-    readonly_fields = ['date_inscription', 'date_annulation']
-    date_hierarchy = 'date_inscription'
+    readonly_fields = ['date_inscription', 'date_annulation', 'rappel_envoye_le']
+    # Pas de date_hierarchy : sa barre de navigation relit toute la table à
+    # chaque affichage ; le filtre date_inscription couvre le même besoin
     ordering = ['-date_inscription']
+    actions = ['exporter_csv', 'exporter_xlsx']
     
     def get_queryset(self, request):
         """Optimise les requêtes"""
         return super().get_queryset(request).select_related('utilisateur', 'creneau')
     
+    def exporter_csv(self, request, queryset):
+        """Exporte les inscriptions sélectionnées en CSV (envoyé au fil de la lecture)"""
+        return export.reponse_export(queryset, 'inscriptions', 'csv')
+    exporter_csv.short_description = "Exporter en CSV"
+    
+    def exporter_xlsx(self, request, queryset):
+        """Exporte les inscriptions sélectionnées en Excel"""
+        return export.reponse_export(queryset, 'inscriptions', 'xlsx')
+    exporter_xlsx.short_description = "Exporter en Excel (.xlsx)"
+    
     def utilisateur_nom(self, obj):
         """Affiche le nom complet de l'utilisateur"""
         try:
@@ -201,7 +267,7 @@ class InscriptionAdmin(admin.ModelAdmin):
             'fields': ('utilisateur', 'creneau', 'commentaire')
         }),
         ('Statut', {
-            'fields': ('annulee', 'date_inscription', 'date_annulation')
+            'fields': ('annulee', 'date_inscription', 'date_annulation', 'rappel_envoye_le')
         }),
     )
     
@@ -220,15 +286,119 @@ class InscriptionAdmin(admin.ModelAdmin):
         return readonly
     
     def save_model(self, request, obj, form, change):
-        """Validation et gestion de l'annulation"""
+        """
+        Gestion de l'annulation ; les places sont prises et libérées par le
+        service d'inscription. Le formulaire a déjà vérifié la place
+        (InscriptionAdminForm) : un refus ici signifie qu'elle a été prise
+        entre-temps.
+        """
         try:
+            if not change and not obj.annulee:
+                # Nouvelle inscription : même chemin atomique que les vues
+                inscription, _ = services.inscrire(obj.utilisateur, obj.creneau, obj.commentaire)
+                obj.pk = inscription.pk
+                obj.date_inscription = inscription.date_inscription
+                obj._state.adding = False
+                return
+            # Annulation, réactivation ou changement de créneau : les autres
+            # champs sont enregistrés d'abord, puis le service libère la place
+            # (liste d'attente, diffusion) et/ou la réserve (même contrôle de
+            # capacité que les vues)
+            annulation = change and obj.annulee and 'annulee' in form.changed_data
+            reactivation = change and not obj.annulee and 'annulee' in form.changed_data
+            deplacement = change and not obj.annulee and not reactivation and 'creneau' in form.changed_data
+            nouveau_creneau = obj.creneau
+            if deplacement:
+                obj.creneau_id = form.initial['creneau']
+            if annulation:
+                obj.annulee = False
+                obj.date_annulation = None
+            elif reactivation:
+                obj.annulee = True
+                obj.date_annulation = form.initial.get('date_annulation')
             if obj.annulee and not obj.date_annulation:
-                from datetime import datetime
-                obj.date_annulation = datetime.now()
+                obj.date_annulation = timezone.now()
             elif not obj.annulee:
                 obj.date_annulation = None
             
-            obj.full_clean()
-            super().save_model(request, obj, form, change)
-        except Exception as e:
-            self.message_user(request, f"Erreur lors de la sauvegarde: {e}", level='ERROR')
+            with transaction.atomic():
+                super().save_model(request, obj, form, change)
+                # Le statut ou le créneau a pu changer : recalculer les deux compteurs
+                creneaux_ids = {obj.creneau_id}
+                if 'creneau' in form.initial:
+                    creneaux_ids.add(form.initial['creneau'])
+                services.recalculer_compteurs(list(creneaux_ids))
+                utilisateurs_ids = {obj.utilisateur_id}
+                if 'utilisateur' in form.initial:
+                    utilisateurs_ids.add(form.initial['utilisateur'])
+                recalculer_statistiques(list(utilisateurs_ids))
+            if annulation:
+                services.desinscrire(obj)
+            elif deplacement:
+                with transaction.atomic():
+                    services.desinscrire(obj)
+                    inscription, _ = services.inscrire(obj.utilisateur, nouveau_creneau, obj.commentaire)
+                # La page suivante est celle de l'inscription sur le nouveau créneau
+                obj.pk = inscription.pk
+                obj.creneau = inscription.creneau
+                obj.annulee = False
+                obj.date_annulation = None
+                obj.date_inscription = inscription.date_inscription
+            elif reactivation:
+                services.inscrire(obj.utilisateur, obj.creneau, obj.commentaire)
+                obj.refresh_from_db()
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], level=messages.ERROR)
+
+    def log_addition(self, request, obj, message):
+        # Inscription refusée par le service (voir save_model) : rien n'a été ajouté
+        if obj.pk is None:
+            return None
+        return super().log_addition(request, obj, message)
+
+    def response_add(self, request, obj, post_url_continue=None):
+        if obj.pk is None:
+            return redirect(request.path)
+        return super().response_add(request, obj, post_url_continue)
+
+
+@admin.register(ArchiveMensuelle)
+class ArchiveMensuelleAdmin(admin.ModelAdmin):
+    list_display = ['utilisateur', 'mois', 'inscriptions', 'annulations', 'annulations_tardives', 'minutes']
+    list_filter = ['mois']
+    search_fields = ['utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name']
+    list_select_related = ['utilisateur']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StatistiqueMensuelle)
+class StatistiqueMensuelleAdmin(admin.ModelAdmin):
+    list_display = ['utilisateur', 'mois', 'creneaux', 'heures', 'annulations', 'annulations_tardives']
+    list_filter = ['mois']
+    search_fields = ['utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name']
+    list_select_related = ['utilisateur']
+
+    def heures(self, obj):
+        return f"{obj.heures:.1f}"
+    heures.short_description = 'Heures'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Attente)
+class AttenteAdmin(admin.ModelAdmin):
+    list_display = ['creneau', 'utilisateur', 'date_demande']
+    list_filter = ['creneau__date']
+    search_fields = ['utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name']
+    list_select_related = ['utilisateur', 'creneau']
+    raw_id_fields = ['creneau']
+    ordering = ['creneau__date', 'creneau__heure_debut', 'date_demande', 'id']
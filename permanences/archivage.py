@@ -0,0 +1,160 @@
+"""
+Archivage des créneaux passés.
+
+Les créneaux antérieurs à la fenêtre de conservation sont écrits, avec leurs
+inscriptions (annulées comprises), dans un fichier CSV compressé, puis
+supprimés des tables principales, mois par mois et chacun dans sa transaction.
+Les compteurs de chaque membre sont conservés par mois dans ArchiveMensuelle :
+les statistiques mensuelles, qui ne sont pas modifiées par l'archivage,
+restent ainsi recalculables (voir statistiques.recalculer_statistiques).
+"""
+import csv
+import gzip
+import io
+import os
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import ArchiveMensuelle, CreneauHoraire, CreneauMaterialise, Inscription
+from .signals import compteurs_suspendus
+from .statistiques import duree_minutes, est_tardive
+
+
+COLONNES = [
+    'date', 'heure_debut', 'heure_fin', 'max_personnes', 'actif',
+    'utilisateur', 'date_inscription', 'annulee', 'date_annulation', 'commentaire',
+]
+
+CHAMPS_ARCHIVE = ['inscriptions', 'annulations', 'annulations_tardives', 'minutes']
+
+
+class _FichierArchive:
+    """CSV compressé ; chaque tranche est écrite sur disque avant d'être supprimée de la base"""
+
+    def __init__(self, chemin):
+        self.brut = open(chemin, 'wb')
+        self.compresse = gzip.GzipFile(fileobj=self.brut, mode='wb')
+        self.texte = io.TextIOWrapper(self.compresse, encoding='utf-8', newline='')
+        self.ecrivain = csv.writer(self.texte)
+        self.ecrivain.writerow(COLONNES)
+
+    def synchroniser(self):
+        self.texte.flush()
+        self.compresse.flush()
+        self.brut.flush()
+        os.fsync(self.brut.fileno())
+
+    def fermer(self):
+        self.texte.close()
+        self.brut.close()
+
+
+def _cumuler(mois, par_membre):
+    """Ajoute les compteurs {utilisateur_id: {champ: valeur}} aux archives du mois"""
+    existantes = {
+        archive.utilisateur_id: archive
+        for archive in ArchiveMensuelle.objects.filter(mois=mois, utilisateur_id__in=par_membre)
+    }
+    nouvelles = []
+    for utilisateur_id, compteurs in par_membre.items():
+        archive = existantes.get(utilisateur_id)
+        if archive is None:
+            nouvelles.append(ArchiveMensuelle(utilisateur_id=utilisateur_id, mois=mois, **compteurs))
+        else:
+            for champ, valeur in compteurs.items():
+                setattr(archive, champ, getattr(archive, champ) + valeur)
+    ArchiveMensuelle.objects.bulk_update(existantes.values(), CHAMPS_ARCHIVE)
+    ArchiveMensuelle.objects.bulk_create(nouvelles)
+
+
+def _archiver_tranche(debut, fin, archive):
+    """
+    Archive les créneaux de [debut, fin[ (un même mois) ; retourne (créneaux, inscriptions).
+
+    Sans `archive` (dry-run), compte seulement.
+    """
+    with transaction.atomic():
+        creneaux = CreneauHoraire.objects.filter(date__gte=debut, date__lt=fin)
+        inscriptions = Inscription.objects.filter(creneau__date__gte=debut, creneau__date__lt=fin)
+
+        par_creneau = {}
+        for ligne in inscriptions.values_list(
+            'creneau_id', 'utilisateur_id', 'utilisateur__username',
+            'date_inscription', 'annulee', 'date_annulation', 'commentaire'
+        ):
+            par_creneau.setdefault(ligne[0], []).append(ligne[1:])
+
+        nb_creneaux = 0
+        nb_inscriptions = 0
+        par_membre = defaultdict(lambda: dict.fromkeys(CHAMPS_ARCHIVE, 0))
+        for pk, *creneau in creneaux.order_by('date', 'heure_debut').values_list(
+            'pk', 'date', 'heure_debut', 'heure_fin', 'max_personnes', 'actif'
+        ):
+            nb_creneaux += 1
+            date, heure_debut, heure_fin = creneau[:3]
+            lignes = par_creneau.get(pk) or [(None, '', None, '', None, '')]
+            for utilisateur_id, username, date_inscription, annulee, date_annulation, commentaire in lignes:
+                if utilisateur_id is not None:
+                    nb_inscriptions += 1
+                    compteurs = par_membre[utilisateur_id]
+                    compteurs['inscriptions'] += 1
+                    if annulee:
+                        compteurs['annulations'] += 1
+                        compteurs['annulations_tardives'] += est_tardive(date, heure_debut, date_annulation)
+                    else:
+                        compteurs['minutes'] += duree_minutes(heure_debut, heure_fin)
+                if archive:
+                    archive.ecrivain.writerow(creneau + [
+                        username, date_inscription or '', annulee,
+                        date_annulation or '', commentaire
+                    ])
+
+        if not archive or not nb_creneaux:
+            return nb_creneaux, nb_inscriptions
+
+        # Le fichier doit être sur disque avant que les lignes ne quittent la base
+        archive.synchroniser()
+        _cumuler(debut.replace(day=1), par_membre)
+        with compteurs_suspendus():
+            inscriptions.delete()
+        creneaux.delete()
+        CreneauMaterialise.objects.filter(date__gte=debut, date__lt=fin).delete()
+    return nb_creneaux, nb_inscriptions
+
+
+def archiver(date_limite, dossier, dry_run=False):
+    """
+    Archive les créneaux antérieurs à `date_limite` dans `dossier`.
+
+    Retourne un dict : creneaux, inscriptions et fichier (None si rien n'a
+    été archivé ou en dry_run).
+    """
+    premier = CreneauHoraire.objects.filter(date__lt=date_limite).aggregate(premier=Min('date'))['premier']
+    resultat = {'creneaux': 0, 'inscriptions': 0, 'fichier': None}
+    if premier is None:
+        return resultat
+
+    chemin = archive = None
+    if not dry_run:
+        Path(dossier).mkdir(parents=True, exist_ok=True)
+        chemin = Path(dossier) / f'archive_{date_limite:%Y%m%d}_{timezone.now():%Y%m%d%H%M%S}.csv.gz'
+        archive = _FichierArchive(chemin)
+
+    try:
+        mois = premier.replace(day=1)
+        while mois < date_limite:
+            suivant = (mois + timedelta(days=32)).replace(day=1)
+            nb_creneaux, nb_inscriptions = _archiver_tranche(mois, min(suivant, date_limite), archive)
+            resultat['creneaux'] += nb_creneaux
+            resultat['inscriptions'] += nb_inscriptions
+            mois = suivant
+    finally:
+        if archive:
+            archive.fermer()
+    resultat['fichier'] = chemin
+    return resultat
@@ -0,0 +1,113 @@
+"""
+Banc de mesure des vues.
+
+Chaque vue est appelée par le client de test de Django : nombre de requêtes
+SQL, latence (p50/p95) et taille de la réponse. Les résultats sont comparés
+à un budget par vue ; la commande benchmark_vues les écrit en JSON pour
+suivre les régressions d'un commit à l'autre.
+"""
+from datetime import timedelta
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import ics
+from .models import JetonCalendrier
+from .perf import percentile
+
+
+# Budgets par vue : requêtes SQL par appel (session et utilisateur compris) et
+# latence p95 en millisecondes sur un poste de développement ; sur la Pi,
+# utiliser --facteur-latence
+BUDGETS = {
+    'calendrier_permanences': {'requetes': 4, 'p95_ms': 150},
+    'calendrier_mois': {'requetes': 4, 'p95_ms': 150},
+    'calendrier_jour': {'requetes': 4, 'p95_ms': 50},
+    'gestion_inscriptions': {'requetes': 7, 'p95_ms': 250},
+    'mes_inscriptions': {'requetes': 5, 'p95_ms': 100},
+    'ajax_places_disponibles': {'requetes': 2, 'p95_ms': 20},
+    'profil_utilisateur': {'requetes': 4, 'p95_ms': 50},
+    'classement_membres': {'requetes': 3, 'p95_ms': 100},
+    'ics_membre': {'requetes': 2, 'p95_ms': 20},
+    'ics_stand': {'requetes': 1, 'p95_ms': 30},
+    'admin_creneaux': {'requetes': 9, 'p95_ms': 500},
+    'admin_inscriptions': {'requetes': 6, 'p95_ms': 300},
+}
+
+
+def mesurer(client, url, iterations):
+    """Appelle `url` une fois pour chauffer les caches, puis `iterations` fois"""
+    client.get(url)
+    durees = []
+    requetes = 0
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            debut = perf_counter()
+            reponse = client.get(url)
+            durees.append((perf_counter() - debut) * 1000)
+        requetes = max(requetes, len(ctx.captured_queries))
+    durees.sort()
+    return {
+        'url': url,
+        'statut': reponse.status_code,
+        'requetes': requetes,
+        'p50_ms': round(percentile(durees, 50), 2),
+        'p95_ms': round(percentile(durees, 95), 2),
+        'octets': len(reponse.content),
+    }
+
+
+def pages(membre, gestionnaire, creneau=None):
+    """Vues mesurées : {nom: (utilisateur connecté, url)}"""
+    lundi = timezone.localdate() - timedelta(days=timezone.localdate().weekday())
+    jeton, _ = JetonCalendrier.objects.get_or_create(utilisateur=membre)
+    semaine = f'?week={lundi.isoformat()}'
+    urls = {
+        'calendrier_permanences': (membre, reverse('permanences:calendrier') + semaine),
+        'calendrier_mois': (membre, reverse('permanences:calendrier') + f'?mois={lundi:%Y-%m}'),
+        'calendrier_jour': (membre, reverse('permanences:calendrier_jour', args=[lundi.isoformat()])),
+        'gestion_inscriptions': (gestionnaire, reverse('permanences:gestion') + semaine),
+        'mes_inscriptions': (membre, reverse('permanences:mes_inscriptions')),
+        'profil_utilisateur': (membre, reverse('accounts:profil')),
+        'classement_membres': (gestionnaire, reverse('permanences:classement') + f'?annee={lundi.year}'),
+        'ics_membre': (membre, reverse('permanences:ics_membre', args=[jeton.jeton])),
+        'ics_stand': (membre, reverse('permanences:ics_stand', args=[ics.jeton_stand()])),
+        'admin_creneaux': (gestionnaire, reverse('admin:permanences_creneauhoraire_changelist')),
+        'admin_inscriptions': (gestionnaire, reverse('admin:permanences_inscription_changelist')),
+    }
+    if creneau is not None:
+        urls['ajax_places_disponibles'] = (membre, reverse('permanences:ajax_places', args=[creneau.pk]))
+    return urls
+
+
+def executer(membre, gestionnaire, creneau=None, iterations=20):
+    """Mesure chaque vue ; retourne {nom: résultat de mesurer}"""
+    clients = {}
+    resultats = {}
+    for nom, (utilisateur, url) in pages(membre, gestionnaire, creneau).items():
+        if utilisateur.pk not in clients:
+            clients[utilisateur.pk] = Client()
+            clients[utilisateur.pk].force_login(utilisateur)
+        resultats[nom] = mesurer(clients[utilisateur.pk], url, iterations)
+    return resultats
+
+
+def depassements(resultats, budgets=BUDGETS, facteur_latence=1.0):
+    """Liste des budgets dépassés (messages lisibles)"""
+    erreurs = []
+    for nom, mesure in resultats.items():
+        if mesure['statut'] != 200:
+            erreurs.append(f"{nom} : statut HTTP {mesure['statut']}")
+        budget = budgets.get(nom)
+        if not budget:
+            continue
+        if mesure['requetes'] > budget['requetes']:
+            erreurs.append(f"{nom} : {mesure['requetes']} requêtes (budget {budget['requetes']})")
+        limite = budget['p95_ms'] * facteur_latence
+        if mesure['p95_ms'] > limite:
+            erreurs.append(f"{nom} : p95 {mesure['p95_ms']} ms (budget {limite:g} ms)")
+    return erreurs
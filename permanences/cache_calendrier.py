@@ -0,0 +1,99 @@
+"""
+Cache des semaines du calendrier.
+
+La partie commune d'une semaine (créneaux, occupation, noms des inscrits) est
+identique pour tous les membres : elle est mise en cache, et seule
+l'inscription de l'utilisateur courant est recalculée à chaque affichage.
+
+La clé contient la version de la semaine, tirée de la base : la date de
+dernière modification des créneaux actifs (`modifie_le`, mise à jour par le
+service d'inscription, les annulations, les enregistrements de l'admin et la
+modification d'un membre inscrit, voir signals.membre_modifie) et leur nombre.
+Une inscription ou une annulation change donc la clé, quel que soit le worker
+qui l'a traitée, y compris avec le cache en mémoire locale.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Prefetch, Q
+from django.utils import timezone
+
+from .models import CreneauHoraire, Inscription
+
+
+CLE_SUCCES = 'calendrier:succes'
+CLE_ECHECS = 'calendrier:echecs'
+
+
+def _creneaux_actifs(date_debut, date_fin):
+    """Créneaux affichés : la version et le contenu mis en cache portent sur les mêmes"""
+    return CreneauHoraire.objects.filter(date__range=[date_debut, date_fin], actif=True)
+
+
+def version_periode(date_debut, date_fin):
+    """
+    Version des créneaux actifs d'une période, en une requête.
+
+    Retourne un dict : `derniere` (dernière modification ou None), `total`
+    (nombre de créneaux) et `passes` (créneaux déjà terminés, qui changent
+    l'affichage sans modifier la base).
+    """
+    maintenant = timezone.localtime()
+    return _creneaux_actifs(date_debut, date_fin).aggregate(
+        derniere=Max('modifie_le'),
+        total=Count('id'),
+        passes=Count('id', filter=(
+            Q(date__lt=maintenant.date()) |
+            Q(date=maintenant.date(), heure_fin__lte=maintenant.time())
+        ))
+    )
+
+
+def _compter(cle):
+    try:
+        cache.incr(cle)
+    except ValueError:
+        cache.set(cle, 1, None)
+
+
+def statistiques_cache():
+    """Compteurs de succès et d'échecs du cache depuis le démarrage du cache"""
+    valeurs = cache.get_many([CLE_SUCCES, CLE_ECHECS])
+    return {
+        'succes': valeurs.get(CLE_SUCCES, 0),
+        'echecs': valeurs.get(CLE_ECHECS, 0),
+    }
+
+
+def _charger_creneaux(date_debut, date_fin):
+    # Seuls les champs affichés de l'utilisateur sont chargés (et mis en cache)
+    inscriptions = Inscription.objects.select_related('utilisateur').only(
+        'id', 'creneau_id', 'annulee', 'utilisateur__id',
+        'utilisateur__username', 'utilisateur__first_name'
+    )
+    return list(
+        _creneaux_actifs(date_debut, date_fin)
+        .prefetch_related(Prefetch('inscriptions', queryset=inscriptions))
+        .annotate(nb_attente=Count('attentes'))
+        .order_by('date', 'heure_debut')
+    )
+
+
+def creneaux_periode(date_debut, date_fin, version=None):
+    """
+    Créneaux actifs de la période avec leurs inscriptions préchargées.
+
+    `version` (résultat de version_periode) peut être fournie par l'appelant
+    s'il l'a déjà calculée.
+    """
+    version = version or version_periode(date_debut, date_fin)
+    horodatage = version['derniere'].timestamp() if version['derniere'] else 0
+    cle = f'calendrier:{date_debut.isoformat()}:{date_fin.isoformat()}:{horodatage}:{version["total"]}'
+
+    creneaux = cache.get(cle)
+    if creneaux is None:
+        _compter(CLE_ECHECS)
+        creneaux = _charger_creneaux(date_debut, date_fin)
+        cache.set(cle, creneaux, settings.CALENDRIER_CACHE_TIMEOUT)
+    else:
+        _compter(CLE_SUCCES)
+    return creneaux
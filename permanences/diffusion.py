@@ -0,0 +1,55 @@
+"""
+Diffusion en direct des changements d'occupation (Server-Sent Events).
+
+Le service d'inscription publie la date du créneau modifié après chaque
+validation ; chaque flux SSE ouvert dans ce processus est réveillé aussitôt.
+Les changements faits par d'autres workers sont rattrapés par une relecture
+périodique de la base (voir views.flux_places).
+"""
+import asyncio
+import threading
+
+
+_abonnements = set()
+_verrou = threading.Lock()
+
+
+class Abonnement:
+    """File d'attente d'un flux SSE, liée à sa boucle asyncio"""
+
+    def __init__(self):
+        self.boucle = asyncio.get_running_loop()
+        self.file = asyncio.Queue()
+
+    def _deposer(self, date):
+        try:
+            self.boucle.call_soon_threadsafe(self.file.put_nowait, date)
+        except RuntimeError:
+            # Boucle déjà fermée : le flux est terminé
+            pass
+
+    async def attendre(self, delai):
+        """Date publiée (ou None si inconnue), ou False si rien n'est arrivé pendant `delai` secondes"""
+        try:
+            return await asyncio.wait_for(self.file.get(), delai)
+        except asyncio.TimeoutError:
+            return False
+
+    def fermer(self):
+        with _verrou:
+            _abonnements.discard(self)
+
+
+def abonner():
+    abonnement = Abonnement()
+    with _verrou:
+        _abonnements.add(abonnement)
+    return abonnement
+
+
+def publier(date=None):
+    """Signale un changement d'occupation d'un créneau du jour `date` (None si inconnu)"""
+    with _verrou:
+        abonnements = list(_abonnements)
+    for abonnement in abonnements:
+        abonnement._deposer(date)
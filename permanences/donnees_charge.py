@@ -0,0 +1,137 @@
+"""
+Jeu de données synthétique pour les mesures de performance.
+
+Crée des membres, plusieurs années de créneaux (lundi au samedi, 9h-19h) et
+des inscriptions, uniquement par bulk_create. La répartition imite l'usage
+réel : quelques membres très actifs et beaucoup d'occasionnels, des soirées
+et des samedis plus demandés, des semaines à venir encore peu remplies, et
+une part d'inscriptions annulées. Les membres générés ont un identifiant
+préfixé par PREFIXE et un mot de passe inutilisable.
+"""
+import itertools
+import random
+from datetime import datetime, time, timedelta
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .generation import generer_creneaux
+from .models import CreneauHoraire, Inscription
+from .services import recalculer_compteurs
+from .statistiques import recalculer_statistiques
+
+
+PREFIXE = 'charge'
+
+TAILLE_LOT = 2000
+
+# Demande relative selon le jour (0 = lundi) et l'heure de début
+POPULARITE_JOUR = {0: 0.8, 1: 0.8, 2: 0.9, 3: 0.9, 4: 1.0, 5: 1.3}
+POPULARITE_HEURE = {9: 0.7, 10: 0.9, 11: 1.0, 12: 0.8, 13: 0.7, 14: 0.9, 15: 1.0, 16: 1.1, 17: 1.3, 18: 1.3}
+
+
+def _remplissage(jour, heure, aujourd_hui, taux_remplissage):
+    """Probabilité qu'une place du créneau soit prise"""
+    taux = taux_remplissage * POPULARITE_JOUR.get(jour.weekday(), 1) * POPULARITE_HEURE.get(heure.hour, 1)
+    semaines = (jour - aujourd_hui).days / 7
+    if semaines > 0:
+        # Les semaines lointaines se remplissent au fil du temps
+        taux *= max(0.1, 1 - semaines / 6)
+    return min(taux, 0.95)
+
+
+def _tirer_membres(alea, membres, poids_cumules, nombre):
+    """`nombre` membres distincts, tirés selon leur activité"""
+    choisis = []
+    while len(choisis) < nombre:
+        for membre in alea.choices(membres, cum_weights=poids_cumules, k=nombre - len(choisis)):
+            if membre not in choisis:
+                choisis.append(membre)
+    return choisis
+
+
+def generer_donnees(nb_membres=200, annees=3, semaines_a_venir=8, max_personnes=3,
+                    taux_remplissage=0.6, taux_annulation=0.1, graine=0):
+    """
+    Génère le jeu de données ; la même `graine` produit les mêmes inscriptions.
+
+    Les créneaux existants sont conservés et ceux qui ont déjà des inscrits ne
+    sont pas remplis : relancer la génération ne crée pas de doublons.
+    Retourne un dict : membres, creneaux, inscriptions, date_debut, date_fin
+    et durees (secondes par étape).
+    """
+    alea = random.Random(graine)
+    durees = {}
+    aujourd_hui = timezone.localdate()
+    date_debut = aujourd_hui - timedelta(weeks=52 * annees)
+    date_debut -= timedelta(days=date_debut.weekday())
+    date_fin = aujourd_hui + timedelta(weeks=semaines_a_venir)
+
+    debut = perf_counter()
+    mot_de_passe = make_password(None)
+    User.objects.bulk_create(
+        [
+            User(username=f'{PREFIXE}{numero:06d}', first_name=f'Membre {numero}', password=mot_de_passe)
+            for numero in range(nb_membres)
+        ],
+        batch_size=TAILLE_LOT,
+        ignore_conflicts=True
+    )
+    membres = list(
+        User.objects.filter(username__startswith=PREFIXE)
+        .order_by('username')
+        .values_list('pk', flat=True)[:nb_membres]
+    )
+    # Activité de type Zipf : le premier membre est le plus assidu
+    poids_cumules = list(itertools.accumulate(1 / (rang + 1) ** 0.8 for rang in range(len(membres))))
+    durees['membres'] = perf_counter() - debut
+
+    debut = perf_counter()
+    generer_creneaux(date_debut, date_fin, time(9), time(19), jours=range(6), max_personnes=max_personnes)
+    creneaux = CreneauHoraire.objects.filter(date__range=[date_debut, date_fin])
+    durees['créneaux'] = perf_counter() - debut
+
+    debut = perf_counter()
+    inscriptions = []
+    lignes = (creneaux.filter(nb_inscrits=0)
+        .order_by('date', 'heure_debut')
+        .values_list('pk', 'date', 'heure_debut', 'max_personnes'))
+    for pk, jour, heure, capacite in lignes:
+        if not membres:
+            break
+        taux = _remplissage(jour, heure, aujourd_hui, taux_remplissage)
+        actifs = sum(alea.random() < taux for _ in range(capacite))
+        annules = sum(alea.random() < taux_annulation for _ in range(actifs))
+        choisis = _tirer_membres(alea, membres, poids_cumules, min(actifs + annules, len(membres)))
+        ouverture = timezone.make_aware(datetime.combine(jour, heure))
+        for rang, membre in enumerate(choisis):
+            annulee = rang >= actifs
+            inscriptions.append(Inscription(
+                utilisateur_id=membre,
+                creneau_id=pk,
+                annulee=annulee,
+                date_annulation=ouverture - timedelta(hours=alea.randint(1, 240)) if annulee else None
+            ))
+    durees['tirage'] = perf_counter() - debut
+
+    debut = perf_counter()
+    with transaction.atomic():
+        Inscription.objects.bulk_create(inscriptions, batch_size=TAILLE_LOT, ignore_conflicts=True)
+        recalculer_compteurs(creneaux)
+    durees['inscriptions'] = perf_counter() - debut
+
+    debut = perf_counter()
+    recalculer_statistiques()
+    durees['statistiques'] = perf_counter() - debut
+
+    return {
+        'membres': len(membres),
+        'creneaux': creneaux.count(),
+        'inscriptions': len(inscriptions),
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'durees': durees,
+    }
@@ -0,0 +1,111 @@
+"""
+Export des inscriptions en CSV ou XLSX pour les coordinateurs.
+
+Les inscriptions sont lues par lots (`iterator(chunk_size=...)`) avec leur
+membre et leur créneau : la mémoire reste constante quelle que soit la
+période. Le CSV est envoyé au fil de la lecture (StreamingHttpResponse) ;
+le XLSX est écrit ligne à ligne par openpyxl en mode write-only dans un
+fichier temporaire, puis envoyé par blocs.
+"""
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Inscription
+
+
+TAILLE_LOT = 2000
+
+ENTETES = [
+    'Date', 'Début', 'Fin', 'Identifiant', 'Prénom', 'Nom', 'Email',
+    'Inscrit le', 'Statut', 'Annulée le', 'Commentaire',
+]
+
+
+def inscriptions_periode(debut, fin, annulees=False):
+    """Inscriptions des créneaux de [debut, fin], dans l'ordre du planning"""
+    inscriptions = Inscription.objects.filter(creneau__date__range=(debut, fin))
+    if not annulees:
+        inscriptions = inscriptions.filter(annulee=False)
+    return inscriptions
+
+
+def _heure_locale(moment):
+    """Date et heure locales sans fuseau (Excel n'accepte pas les dates avec fuseau)"""
+    if moment is None:
+        return None
+    return timezone.localtime(moment).replace(tzinfo=None, microsecond=0)
+
+
+def _lignes(inscriptions):
+    """Une liste de valeurs par inscription, lue par lots"""
+    inscriptions = (inscriptions
+        .select_related('utilisateur', 'creneau')
+        .only(
+            'date_inscription', 'annulee', 'date_annulation', 'commentaire',
+            'utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name', 'utilisateur__email',
+            'creneau__date', 'creneau__heure_debut', 'creneau__heure_fin',
+        )
+        .order_by('creneau__date', 'creneau__heure_debut', 'utilisateur__username'))
+    for inscription in inscriptions.iterator(chunk_size=TAILLE_LOT):
+        membre = inscription.utilisateur
+        creneau = inscription.creneau
+        yield [
+            creneau.date, creneau.heure_debut, creneau.heure_fin,
+            membre.username, membre.first_name, membre.last_name, membre.email,
+            _heure_locale(inscription.date_inscription),
+            'Annulée' if inscription.annulee else 'Active',
+            _heure_locale(inscription.date_annulation),
+            inscription.commentaire,
+        ]
+
+
+class _Tampon:
+    """Pseudo-fichier : csv.writer retourne directement la ligne formatée"""
+
+    def write(self, valeur):
+        return valeur
+
+
+def _flux_csv(inscriptions):
+    ecrivain = csv.writer(_Tampon(), delimiter=';')
+    # BOM : Excel reconnaît l'UTF-8
+    yield '\ufeff' + ecrivain.writerow(ENTETES)
+    for ligne in _lignes(inscriptions):
+        yield ecrivain.writerow(['' if valeur is None else valeur for valeur in ligne])
+
+
+def reponse_csv(inscriptions, nom):
+    response = StreamingHttpResponse(_flux_csv(inscriptions), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nom}.csv"'
+    return response
+
+
+def reponse_xlsx(inscriptions, nom):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportError("openpyxl est nécessaire pour écrire un fichier .xlsx (pip install openpyxl)")
+    classeur = Workbook(write_only=True)
+    feuille = classeur.create_sheet('Inscriptions')
+    feuille.append(ENTETES)
+    for ligne in _lignes(inscriptions):
+        feuille.append(ligne)
+    fichier = tempfile.TemporaryFile()
+    classeur.save(fichier)
+    fichier.seek(0)
+    return FileResponse(
+        fichier,
+        as_attachment=True,
+        filename=f'{nom}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
+def reponse_export(inscriptions, nom, format='csv'):
+    """Réponse HTTP d'export des `inscriptions` au format 'csv' ou 'xlsx'"""
+    if format == 'xlsx':
+        return reponse_xlsx(inscriptions, nom)
+    return reponse_csv(inscriptions, nom)
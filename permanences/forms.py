@@ -0,0 +1,72 @@
+from django import forms
+from django.contrib.auth.models import User
+
+from . import services
+from .generation import HORIZON_MATERIALISATION
+from .models import JOURS_SEMAINE, Inscription
+
+
+class InscriptionSerieForm(forms.Form):
+    """Inscription d'un membre à des créneaux réguliers (ex. : chaque samedi de 9 h à 11 h)"""
+    utilisateur = forms.ModelChoiceField(
+        label="Membre",
+        queryset=User.objects.filter(is_active=True).order_by('username')
+    )
+    jours = forms.TypedMultipleChoiceField(
+        label="Jours de la semaine",
+        choices=JOURS_SEMAINE,
+        coerce=int,
+        widget=forms.CheckboxSelectMultiple
+    )
+    heure_debut = forms.TimeField(label="De", widget=forms.TimeInput(attrs={'type': 'time'}))
+    heure_fin = forms.TimeField(label="À", widget=forms.TimeInput(attrs={'type': 'time'}))
+    date_debut = forms.DateField(label="Du", widget=forms.DateInput(attrs={'type': 'date'}))
+    date_fin = forms.DateField(label="Au", widget=forms.DateInput(attrs={'type': 'date'}))
+    commentaire = forms.CharField(label="Commentaire", required=False)
+
+    def clean(self):
+        donnees = super().clean()
+        heure_debut, heure_fin = donnees.get('heure_debut'), donnees.get('heure_fin')
+        if heure_debut and heure_fin and heure_fin <= heure_debut:
+            self.add_error('heure_fin', "L'heure de fin doit suivre l'heure de début.")
+        date_debut, date_fin = donnees.get('date_debut'), donnees.get('date_fin')
+        if date_debut and date_fin:
+            if date_fin < date_debut:
+                self.add_error('date_fin', "La date de fin doit suivre la date de début.")
+            elif date_fin - date_debut > HORIZON_MATERIALISATION:
+                self.add_error('date_fin', f"Période limitée à {HORIZON_MATERIALISATION.days // 7} semaines.")
+        return donnees
+
+
+class ChoixMembreForm(forms.Form):
+    """Membre à inscrire aux créneaux sélectionnés dans l'admin"""
+    utilisateur = forms.ModelChoiceField(
+        label="Membre",
+        queryset=User.objects.filter(is_active=True).order_by('username')
+    )
+    commentaire = forms.CharField(label="Commentaire", required=False)
+
+
+class InscriptionAdminForm(forms.ModelForm):
+    """Inscription saisie dans l'admin : une place prise est d'abord vérifiée par le service d'inscription"""
+
+    class Meta:
+        model = Inscription
+        fields = '__all__'
+
+    def clean(self):
+        donnees = super().clean()
+        deplacement = not self.instance._state.adding and 'creneau' in self.changed_data
+        if donnees.get('annulee', self.instance.annulee):
+            if deplacement and not self.initial.get('annulee'):
+                raise forms.ValidationError("Annulez l'inscription ou changez son créneau, pas les deux à la fois.")
+            return donnees
+        if not self.instance._state.adding and not self.initial.get('annulee') and not deplacement:
+            # Inscription déjà active sur le même créneau : aucune place à prendre
+            return donnees
+        # Champs en lecture seule (créneau passé) : valeurs de l'inscription
+        utilisateur = donnees.get('utilisateur') if 'utilisateur' in self.fields else self.instance.utilisateur
+        creneau = donnees.get('creneau') if 'creneau' in self.fields else self.instance.creneau
+        if utilisateur and creneau:
+            services.verifier_inscription(utilisateur, creneau)
+        return donnees
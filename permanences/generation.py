@@ -0,0 +1,179 @@
+"""
+Génération de créneaux en masse.
+
+L'ensemble des couples (date, heure_debut) est calculé en mémoire, les
+créneaux déjà présents sont retirés grâce à une seule requête sur la plage
+de dates, et le reste est inséré par bulk_create dans une transaction.
+
+Les horaires récurrents ne sont matérialisés en créneaux qu'à la demande :
+à la première consultation d'une semaine, ou par la commande
+materialiser_creneaux pour un horizon glissant. Chaque créneau matérialisé
+est noté (CreneauMaterialise) : supprimé ensuite, il n'est pas recréé.
+"""
+import time
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import CreneauHoraire, CreneauMaterialise, FermetureExceptionnelle, HoraireRecurrent
+
+
+DUREE_CRENEAU = timedelta(hours=1)
+
+# Les semaines consultées au-delà de cet horizon ne sont pas matérialisées
+HORIZON_MATERIALISATION = timedelta(weeks=52)
+
+CLE_VERSION_PLANNING = 'planning:version'
+
+
+def dates_plage(date_debut, date_fin, jours=None):
+    """Dates de date_debut à date_fin incluses, limitées aux jours de la semaine `jours` (0 = lundi)"""
+    jours = set(range(7)) if jours is None else {int(jour) for jour in jours}
+    courante = date_debut
+    while courante <= date_fin:
+        if courante.weekday() in jours:
+            yield courante
+        courante += timedelta(days=1)
+
+
+def horaires_journee(heure_debut, heure_fin, duree=DUREE_CRENEAU):
+    """Découpe [heure_debut, heure_fin] en couples (début, fin) de `duree` ; le reliquat est ignoré"""
+    jour = datetime.min
+    debut = datetime.combine(jour, heure_debut)
+    limite = datetime.combine(jour, heure_fin)
+    while debut + duree <= limite:
+        yield debut.time(), (debut + duree).time()
+        debut += duree
+
+
+def _inserer_manquants(voulus, date_debut, date_fin):
+    """Insère les créneaux de `voulus` absents de la base ; retourne (crees, ignores)"""
+    if not voulus:
+        return 0, 0
+
+    existants = set(
+        CreneauHoraire.objects
+        .filter(date__range=[date_debut, date_fin])
+        .values_list('date', 'heure_debut')
+    )
+    a_creer = [
+        creneau for creneau in voulus
+        if (creneau.date, creneau.heure_debut) not in existants
+    ]
+
+    with transaction.atomic():
+        CreneauHoraire.objects.bulk_create(a_creer, batch_size=500, ignore_conflicts=True)
+
+    return len(a_creer), len(voulus) - len(a_creer)
+
+
+def generer_creneaux(date_debut, date_fin, heure_debut, heure_fin,
+                     duree=DUREE_CRENEAU, jours=None, max_personnes=3, actif=True):
+    """
+    Crée tous les créneaux manquants de la plage.
+
+    Retourne un tuple (crees, ignores) : nombre de créneaux insérés et nombre
+    de créneaux qui existaient déjà.
+    """
+    horaires = list(horaires_journee(heure_debut, heure_fin, duree))
+    voulus = [
+        CreneauHoraire(
+            date=jour,
+            heure_debut=debut,
+            heure_fin=fin,
+            max_personnes=max_personnes,
+            actif=actif
+        )
+        for jour in dates_plage(date_debut, date_fin, jours)
+        for debut, fin in horaires
+    ]
+    return _inserer_manquants(voulus, date_debut, date_fin)
+
+
+def materialiser_creneaux(date_debut, date_fin):
+    """
+    Crée les créneaux des horaires récurrents actifs entre deux dates.
+
+    Les jours passés, les fermetures exceptionnelles, les dates au-delà de
+    HORIZON_MATERIALISATION et les créneaux déjà matérialisés une fois (même
+    supprimés depuis) sont ignorés. Retourne (crees, ignores).
+    """
+    aujourd_hui = timezone.localdate()
+    date_debut = max(date_debut, aujourd_hui)
+    date_fin = min(date_fin, aujourd_hui + HORIZON_MATERIALISATION)
+    if date_debut > date_fin:
+        return 0, 0
+
+    horaires = list(
+        HoraireRecurrent.objects
+        .filter(actif=True, date_debut__lte=date_fin)
+        .filter(Q(date_fin__isnull=True) | Q(date_fin__gte=date_debut))
+    )
+    if not horaires:
+        return 0, 0
+    fermetures = set(
+        FermetureExceptionnelle.objects
+        .filter(date__range=[date_debut, date_fin])
+        .values_list('date', flat=True)
+    )
+
+    voulus = []
+    for horaire in horaires:
+        debut_validite = max(date_debut, horaire.date_debut)
+        fin_validite = min(date_fin, horaire.date_fin or date_fin)
+        tranches = list(horaires_journee(horaire.heure_ouverture, horaire.heure_fermeture))
+        for jour in dates_plage(debut_validite, fin_validite, [horaire.jour_semaine]):
+            if jour in fermetures:
+                continue
+            voulus.extend(
+                CreneauHoraire(
+                    date=jour,
+                    heure_debut=debut,
+                    heure_fin=fin,
+                    max_personnes=horaire.max_personnes
+                )
+                for debut, fin in tranches
+            )
+
+    deja_materialises = set(
+        CreneauMaterialise.objects
+        .filter(date__range=[date_debut, date_fin])
+        .values_list('date', 'heure_debut')
+    )
+    nouveaux = [
+        creneau for creneau in voulus
+        if (creneau.date, creneau.heure_debut) not in deja_materialises
+    ]
+    with transaction.atomic():
+        crees, _ = _inserer_manquants(nouveaux, date_debut, date_fin)
+        CreneauMaterialise.objects.bulk_create([
+            CreneauMaterialise(date=creneau.date, heure_debut=creneau.heure_debut)
+            for creneau in nouveaux
+        ], batch_size=500, ignore_conflicts=True)
+    return crees, len(voulus) - crees
+
+
+def _version_planning():
+    # Une version initiale horodatée évite de retomber sur d'anciennes clés
+    # si le compteur a été évincé du cache
+    return cache.get_or_set(CLE_VERSION_PLANNING, lambda: int(time.time()), None)
+
+
+def invalider_planning():
+    """À appeler quand un horaire récurrent ou une fermeture change"""
+    try:
+        cache.incr(CLE_VERSION_PLANNING)
+    except ValueError:
+        cache.set(CLE_VERSION_PLANNING, int(time.time()), None)
+
+
+def materialiser_semaine(week_start):
+    """Matérialise une semaine à sa première consultation ; les suivantes ne coûtent aucune requête"""
+    cle = f'planning:{_version_planning()}:{week_start.isoformat()}'
+    if cache.get(cle):
+        return
+    materialiser_creneaux(week_start, week_start + timedelta(days=6))
+    cache.set(cle, True, 24 * 3600)
@@ -0,0 +1,168 @@
+"""
+Flux iCalendar (ICS) des permanences, pour les agendas des téléphones.
+
+Deux flux, accessibles sans connexion grâce à un jeton dans l'URL : celui d'un
+membre (ses inscriptions actives) et celui du stand (les créneaux ayant au
+moins un inscrit). Chaque flux est produit en une requête, mis en cache sous
+une clé contenant sa version (dernière modification des créneaux, comme le
+calendrier) et servi avec un ETag : une interrogation sans changement ne
+coûte qu'une requête de version et une réponse 304.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from .models import Inscription
+
+
+# Période publiée : les créneaux passés récents et l'année à venir
+JOURS_PASSES = 30
+JOURS_A_VENIR = 365
+
+_signataire = Signer(salt='permanences.ics.stand')
+
+
+def periode():
+    aujourd_hui = timezone.localdate()
+    return aujourd_hui - timedelta(days=JOURS_PASSES), aujourd_hui + timedelta(days=JOURS_A_VENIR)
+
+
+def jeton_stand():
+    """Jeton du flux du stand (dérivé de SECRET_KEY et de ICS_STAND_VERSION)"""
+    version = settings.ICS_STAND_VERSION
+    return _signataire.sign(f'stand:{version}' if version else 'stand').rsplit(':', 1)[1]
+
+
+def jeton_stand_valide(jeton):
+    return constant_time_compare(jeton, jeton_stand())
+
+
+def inscriptions_membre(utilisateur_id):
+    debut, fin = periode()
+    return Inscription.objects.filter(
+        utilisateur_id=utilisateur_id,
+        annulee=False,
+        creneau__date__range=(debut, fin),
+        creneau__actif=True
+    )
+
+
+def inscriptions_stand():
+    debut, fin = periode()
+    return Inscription.objects.filter(annulee=False, creneau__date__range=(debut, fin), creneau__actif=True)
+
+
+def version(inscriptions):
+    """Version d'un flux : toute inscription ou annulation modifie le créneau concerné"""
+    return inscriptions.aggregate(total=Count('id'), derniere=Max('creneau__modifie_le'))
+
+
+def _echapper(texte):
+    return (str(texte).replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _plier(ligne):
+    """Lignes de 75 octets au plus (RFC 5545), les suites commencent par une espace"""
+    morceaux = []
+    courant = ''
+    for caractere in ligne:
+        if len((courant + caractere).encode('utf-8')) > 75:
+            morceaux.append(courant)
+            courant = ' '
+        courant += caractere
+    morceaux.append(courant)
+    return '\r\n'.join(morceaux)
+
+
+def _utc(jour, heure):
+    moment = timezone.make_aware(datetime.combine(jour, heure)).astimezone(dt_timezone.utc)
+    return moment.strftime('%Y%m%dT%H%M%SZ')
+
+
+def generer(nom, evenements):
+    """Calendrier ICS ; `evenements` : dicts creneau, resume, description"""
+    horodatage = timezone.now().astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lignes = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Permanences//Inscriptions//FR',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_echapper(nom)}',
+        f'X-WR-TIMEZONE:{settings.TIME_ZONE}',
+        # Intervalle de rafraîchissement conseillé aux clients
+        'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+        'X-PUBLISHED-TTL:PT1H',
+    ]
+    for evenement in evenements:
+        creneau = evenement['creneau']
+        lignes += [
+            'BEGIN:VEVENT',
+            f'UID:creneau-{creneau.pk}@permanences',
+            f'DTSTAMP:{horodatage}',
+            f'DTSTART:{_utc(creneau.date, creneau.heure_debut)}',
+            f'DTEND:{_utc(creneau.date, creneau.heure_fin)}',
+            f'LAST-MODIFIED:{creneau.modifie_le.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}',
+            f'SUMMARY:{_echapper(evenement["resume"])}',
+        ]
+        if evenement.get('description'):
+            lignes.append(f'DESCRIPTION:{_echapper(evenement["description"])}')
+        lignes.append('END:VEVENT')
+    lignes.append('END:VCALENDAR')
+    return '\r\n'.join(_plier(ligne) for ligne in lignes) + '\r\n'
+
+
+def _evenements_membre(inscriptions):
+    for inscription in inscriptions.select_related('creneau').order_by('creneau__date', 'creneau__heure_debut'):
+        yield {
+            'creneau': inscription.creneau,
+            'resume': 'Permanence',
+            'description': inscription.commentaire,
+        }
+
+
+def _evenements_stand(inscriptions):
+    par_creneau = {}
+    noms = defaultdict(list)
+    for inscription in (inscriptions.select_related('creneau', 'utilisateur')
+                        .order_by('creneau__date', 'creneau__heure_debut', 'utilisateur__username')):
+        par_creneau[inscription.creneau_id] = inscription.creneau
+        membre = inscription.utilisateur
+        noms[inscription.creneau_id].append(membre.first_name or membre.username)
+    for pk, creneau in par_creneau.items():
+        yield {
+            'creneau': creneau,
+            'resume': f'Permanence ({len(noms[pk])}/{creneau.max_personnes})',
+            'description': ', '.join(noms[pk]),
+        }
+
+
+def _en_cache(cle, version_flux, produire):
+    """Texte du flux, depuis le cache tant que sa version n'a pas changé"""
+    horodatage = version_flux['derniere'].timestamp() if version_flux['derniere'] else 0
+    cle = f'ics:{cle}:{periode()[0].isoformat()}:{horodatage}:{version_flux["total"]}'
+    texte = cache.get(cle)
+    if texte is None:
+        texte = produire()
+        cache.set(cle, texte, settings.CALENDRIER_CACHE_TIMEOUT)
+    return texte
+
+
+def flux_membre(utilisateur, version_flux):
+    return _en_cache(f'membre:{utilisateur.pk}', version_flux, lambda: generer(
+        f'Mes permanences ({utilisateur.first_name or utilisateur.username})',
+        _evenements_membre(inscriptions_membre(utilisateur.pk))
+    ))
+
+
+def flux_stand(version_flux):
+    return _en_cache('stand', version_flux, lambda: generer(
+        'Permanences du stand', _evenements_stand(inscriptions_stand())
+    ))
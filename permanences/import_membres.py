@@ -0,0 +1,251 @@
+"""
+Import en masse des membres depuis un fichier Excel (.xlsx) ou CSV.
+
+Les lignes sont lues en flux (openpyxl en lecture seule ou module csv), les
+identifiants déjà présents sont chargés en une seule requête, les mots de
+passe des nouveaux membres sont hachés dans un pool de processus (PBKDF2 est
+coûteux et n'occupe qu'un cœur) et les comptes sont créés par bulk_create,
+lot par lot. Les noms et emails des membres existants sont mis à jour par
+bulk_update ; leur mot de passe n'est jamais modifié.
+"""
+import csv
+import os
+import time
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+
+TAILLE_LOT = 500
+
+# En-têtes reconnus (normalisés : minuscules, sans accents ni séparateurs)
+COLONNES = {
+    'id': 'username',
+    'identifiant': 'username',
+    'username': 'username',
+    'password': 'password',
+    'motdepasse': 'password',
+    'nomprenom': 'nom_prenom',
+    'nom': 'last_name',
+    'prenom': 'first_name',
+    'email': 'email',
+    'mail': 'email',
+}
+
+CHAMPS_MIS_A_JOUR = ('first_name', 'last_name', 'email')
+
+
+def _normaliser_entete(valeur):
+    texte = unicodedata.normalize('NFKD', str(valeur or '')).encode('ascii', 'ignore').decode()
+    return ''.join(caractere for caractere in texte.lower() if caractere.isalnum())
+
+
+def _texte(valeur):
+    if valeur is None:
+        return ''
+    if isinstance(valeur, float) and valeur.is_integer():
+        valeur = int(valeur)
+    return str(valeur).strip()
+
+
+def separer_nom_prenom(texte):
+    """« DUPONT DE LA TOUR Jean Marc » -> ('DUPONT DE LA TOUR', 'Jean Marc')"""
+    mots = texte.split()
+    nb_nom = 0
+    while nb_nom < len(mots) and mots[nb_nom].isupper():
+        nb_nom += 1
+    return ' '.join(mots[:nb_nom]), ' '.join(mots[nb_nom:])
+
+
+def _lignes_xlsx(chemin):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("openpyxl est nécessaire pour lire un fichier .xlsx (pip install openpyxl)")
+    classeur = load_workbook(chemin, read_only=True, data_only=True)
+    try:
+        yield from classeur.active.iter_rows(values_only=True)
+    finally:
+        classeur.close()
+
+
+def _lignes_csv(chemin):
+    with open(chemin, newline='', encoding='utf-8-sig') as fichier:
+        echantillon = fichier.read(4096)
+        fichier.seek(0)
+        try:
+            dialecte = csv.Sniffer().sniff(echantillon, delimiters=',;\t')
+        except csv.Error:
+            dialecte = csv.excel
+        yield from csv.reader(fichier, dialecte)
+
+
+def lire_membres(chemin):
+    """
+    Itère sur les lignes du fichier sous forme de dicts.
+
+    Clés : `ligne` (numéro dans le fichier) et, selon les colonnes présentes,
+    username, password, first_name, last_name, email. Une colonne NomPrenom
+    est découpée en nom (mots en majuscules) et prénom.
+    """
+    if Path(chemin).suffix.lower() in ('.xlsx', '.xlsm'):
+        lignes = _lignes_xlsx(chemin)
+    else:
+        lignes = _lignes_csv(chemin)
+
+    entete = next(lignes, None)
+    if entete is None:
+        return
+    champs = [COLONNES.get(_normaliser_entete(valeur)) for valeur in entete]
+    if 'username' not in champs:
+        raise ValueError("Colonne d'identifiant introuvable (ID, Identifiant ou Username)")
+
+    for numero, ligne in enumerate(lignes, start=2):
+        membre = {
+            champ: _texte(valeur)
+            for champ, valeur in zip(champs, ligne)
+            if champ
+        }
+        if not any(membre.values()):
+            continue
+        nom_prenom = membre.pop('nom_prenom', '')
+        if nom_prenom and not (membre.get('first_name') or membre.get('last_name')):
+            membre['last_name'], membre['first_name'] = separer_nom_prenom(nom_prenom)
+        membre['ligne'] = numero
+        yield membre
+
+
+def _mesurer(iterable, durees, etape):
+    """Itère sur `iterable` en cumulant le temps passé à produire chaque élément"""
+    iterateur = iter(iterable)
+    while True:
+        debut = time.perf_counter()
+        try:
+            element = next(iterateur)
+        except StopIteration:
+            return
+        finally:
+            durees[etape] += time.perf_counter() - debut
+        yield element
+
+
+def _preparer_processus():
+    # Nécessaire quand les processus sont démarrés par « spawn » (macOS, Windows)
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def importer_membres(chemin, processus=None, taille_lot=TAILLE_LOT,
+                     dry_run=False, mettre_a_jour=True):
+    """
+    Importe les membres du fichier `chemin`.
+
+    `processus` : nombre de processus de hachage (par défaut un par cœur ;
+    1 pour hacher dans le processus courant). En `dry_run`, rien n'est haché
+    ni écrit. Retourne un rapport : listes `crees`, `mis_a_jour`, `inchanges`,
+    `avertissements` et `durees` (secondes par étape).
+    """
+    User = get_user_model()
+    durees = defaultdict(float)
+    rapport = {'crees': [], 'mis_a_jour': [], 'inchanges': [], 'avertissements': []}
+    processus = processus or os.cpu_count() or 1
+
+    debut = time.perf_counter()
+    existants = {
+        username: (pk, {'first_name': prenom, 'last_name': nom, 'email': email})
+        for pk, username, prenom, nom, email in User.objects.values_list(
+            'pk', 'username', 'first_name', 'last_name', 'email'
+        )
+    }
+    durees['utilisateurs existants'] = time.perf_counter() - debut
+
+    pool = None
+    if processus > 1 and not dry_run:
+        pool = ProcessPoolExecutor(max_workers=processus, initializer=_preparer_processus)
+
+    a_creer = []
+    a_modifier = []
+
+    def creer_lot():
+        if not a_creer:
+            return
+        debut = time.perf_counter()
+        mots_de_passe = [membre.pop('password') for membre in a_creer]
+        if pool:
+            morceau = max(1, len(mots_de_passe) // (processus * 4))
+            empreintes = list(pool.map(make_password, mots_de_passe, chunksize=morceau))
+        else:
+            empreintes = [make_password(mot_de_passe) for mot_de_passe in mots_de_passe]
+        durees['hachage'] += time.perf_counter() - debut
+
+        debut = time.perf_counter()
+        with transaction.atomic():
+            User.objects.bulk_create(
+                [User(password=empreinte, **membre) for membre, empreinte in zip(a_creer, empreintes)],
+                batch_size=taille_lot
+            )
+        durees['création'] += time.perf_counter() - debut
+        a_creer.clear()
+
+    def modifier_lot():
+        if not a_modifier:
+            return
+        debut = time.perf_counter()
+        with transaction.atomic():
+            User.objects.bulk_update(a_modifier, CHAMPS_MIS_A_JOUR, batch_size=taille_lot)
+        durees['mise à jour'] += time.perf_counter() - debut
+        a_modifier.clear()
+
+    vus = set()
+    try:
+        for membre in _mesurer(lire_membres(chemin), durees, 'lecture'):
+            numero = membre.pop('ligne')
+            username = membre.get('username', '')
+            if not username:
+                rapport['avertissements'].append(f'Ligne {numero} : identifiant manquant, ignorée')
+                continue
+            if username in vus:
+                rapport['avertissements'].append(f'Ligne {numero} : {username} en double, ignorée')
+                continue
+            vus.add(username)
+
+            if username in existants:
+                pk, actuels = existants[username]
+                nouveaux = {
+                    champ: membre[champ] for champ in CHAMPS_MIS_A_JOUR
+                    if membre.get(champ) and membre[champ] != actuels[champ]
+                }
+                if not (nouveaux and mettre_a_jour):
+                    rapport['inchanges'].append(username)
+                    continue
+                rapport['mis_a_jour'].append(username)
+                if not dry_run:
+                    a_modifier.append(User(pk=pk, **{**actuels, **nouveaux}))
+                    if len(a_modifier) >= taille_lot:
+                        modifier_lot()
+                continue
+
+            if not membre.get('password'):
+                rapport['avertissements'].append(f'Ligne {numero} : {username} sans mot de passe, ignoré')
+                continue
+            rapport['crees'].append(username)
+            if not dry_run:
+                a_creer.append({champ: membre.get(champ, '') for champ in ('username', 'password', *CHAMPS_MIS_A_JOUR)})
+                if len(a_creer) >= taille_lot:
+                    creer_lot()
+
+        creer_lot()
+        modifier_lot()
+    finally:
+        if pool:
+            pool.shutdown()
+
+    rapport['durees'] = dict(durees)
+    return rapport
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from permanences.archivage import archiver
+
+
+class Command(BaseCommand):
+    help = "Archive les créneaux passés (et leurs inscriptions) dans un CSV compressé et les retire de la base"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours', type=int, default=settings.ARCHIVE_RETENTION_JOURS,
+            help='Créneaux conservés dans la base : les N derniers jours'
+        )
+        parser.add_argument('--dossier', default=settings.ARCHIVE_DIR, help='Dossier des fichiers d\'archive')
+        parser.add_argument('--dry-run', action='store_true', help='Compte sans rien archiver')
+
+    def handle(self, *args, **options):
+        date_limite = timezone.localdate() - timedelta(days=options['jours'])
+        resultat = archiver(date_limite, options['dossier'], dry_run=options['dry_run'])
+
+        prefixe = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefixe}Avant le {date_limite} : {resultat['creneaux']} créneau(x) et "
+            f"{resultat['inscriptions']} inscription(s) archivé(s)."
+        ))
+        if resultat['fichier']:
+            self.stdout.write(f"Fichier : {resultat['fichier']}")
@@ -0,0 +1,108 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test import override_settings
+from django.utils import timezone
+
+from permanences import benchmark
+from permanences.donnees_charge import PREFIXE, generer_donnees
+from permanences.models import CreneauHoraire
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure chaque vue (requêtes SQL, latence p50/p95, taille) sur un jeu de données généré, "
+        "écrit les résultats en JSON et échoue si un budget est dépassé. Les données générées "
+        "sont annulées à la fin (transaction)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Appels mesurés par vue')
+        parser.add_argument('--membres', type=int, default=500, help='Membres générés')
+        parser.add_argument('--annees', type=int, default=3, help='Années de créneaux générées')
+        parser.add_argument('--sans-donnees', action='store_true', help='Mesure sur les données existantes')
+        parser.add_argument('--sortie', help='Fichier JSON des résultats')
+        parser.add_argument('--comparer', help='Fichier JSON d\'une exécution précédente à comparer')
+        parser.add_argument(
+            '--facteur-latence', type=float, default=1.0,
+            help='Multiplie les budgets de latence (machine plus lente que la référence)'
+        )
+
+    def handle(self, *args, **options):
+        # Cache privé : les pages des données générées ne polluent pas le cache réel
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+        ):
+            with transaction.atomic():
+                rapport = self._mesurer(options)
+                transaction.set_rollback(True)
+
+        if options['comparer']:
+            with open(options['comparer'], encoding='utf-8') as fichier:
+                self._comparer(json.load(fichier), rapport)
+        if options['sortie']:
+            with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+                json.dump(rapport, fichier, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Résultats écrits dans {options['sortie']}")
+
+        erreurs = benchmark.depassements(rapport['vues'], facteur_latence=options['facteur_latence'])
+        if erreurs:
+            raise CommandError('Budgets dépassés :\n  ' + '\n  '.join(erreurs))
+        self.stdout.write(self.style.SUCCESS('Tous les budgets sont respectés.'))
+
+    def _mesurer(self, options):
+        donnees = None
+        if not options['sans_donnees']:
+            donnees = generer_donnees(nb_membres=options['membres'], annees=options['annees'])
+        membre = (
+            User.objects.annotate(actives=Count('inscriptions', filter=Q(inscriptions__annulee=False)))
+            .order_by('-actives')
+            .first()
+        ) or User.objects.create(username=f'{PREFIXE}membre')
+        gestionnaire = User.objects.create(username=f'{PREFIXE}admin', is_staff=True, is_superuser=True)
+        creneau = CreneauHoraire.objects.filter(date__gte=timezone.localdate()).first()
+
+        vues = benchmark.executer(membre, gestionnaire, creneau, options['iterations'])
+
+        self.stdout.write(f"{'vue':<26}{'requêtes':>9}{'p50 ms':>10}{'p95 ms':>10}{'octets':>10}")
+        for nom, mesure in vues.items():
+            self.stdout.write(
+                f"{nom:<26}{mesure['requetes']:>9}{mesure['p50_ms']:>10}{mesure['p95_ms']:>10}{mesure['octets']:>10}"
+            )
+        return {
+            'date': timezone.now().isoformat(),
+            'commit': self._commit(),
+            'base': connection.vendor,
+            'iterations': options['iterations'],
+            'donnees': donnees and {
+                cle: valeur for cle, valeur in donnees.items() if cle in ('membres', 'creneaux', 'inscriptions')
+            },
+            'vues': vues,
+        }
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _comparer(self, precedent, rapport):
+        self.stdout.write(f"Comparaison avec {precedent.get('commit') or precedent.get('date')} :")
+        for nom, mesure in rapport['vues'].items():
+            ancien = precedent.get('vues', {}).get(nom)
+            if not ancien:
+                continue
+            self.stdout.write(
+                f"  {nom:<26} requêtes {ancien['requetes']} -> {mesure['requetes']}, "
+                f"p95 {ancien['p95_ms']} -> {mesure['p95_ms']} ms, "
+                f"octets {ancien['octets']} -> {mesure['octets']}"
+            )
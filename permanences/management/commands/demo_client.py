@@ -1,7 +1,10 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from permanences.models import HoraireOuverture, CreneauHoraire, Inscription
-from datetime import datetime, time, date, timedelta
+from django.core.exceptions import ValidationError
+from permanences.models import HoraireRecurrent, CreneauHoraire, Inscription
+from permanences.generation import materialiser_creneaux
+from permanences import services
+from datetime import time, date, timedelta
 
 class Command(BaseCommand):
     help = 'Crée des données de démonstration complètes pour la présentation client'
@@ -22,11 +25,12 @@ class Command(BaseCommand):
         ]
         
         for jour, ouverture, fermeture in horaires:
-            HoraireOuverture.objects.update_or_create(
+            HoraireRecurrent.objects.update_or_create(
                 jour_semaine=jour,
                 defaults={
                     'heure_ouverture': ouverture,
                     'heure_fermeture': fermeture,
+                    'date_debut': date.today(),
                     'actif': True
                 }
             )
@@ -61,35 +65,7 @@ class Command(BaseCommand):
         # 3. Créer des créneaux pour les 2 prochaines semaines
         self.stdout.write('⏰ Génération des créneaux...')
         today = date.today()
-        
-        for i in range(14):  # 2 semaines
-            current_date = today + timedelta(days=i)
-            jour_semaine = current_date.weekday()
-            
-            try:
-                horaire = HoraireOuverture.objects.get(jour_semaine=jour_semaine, actif=True)
-                
-                # Créer des créneaux d'1 heure
-                heure_courante = horaire.heure_ouverture
-                while heure_courante < horaire.heure_fermeture:
-                    heure_fin = datetime.combine(date.today(), heure_courante)
-                    heure_fin = (heure_fin + timedelta(hours=1)).time()
-                    
-                    if heure_fin <= horaire.heure_fermeture:
-                        creneau, created = CreneauHoraire.objects.get_or_create(
-                            date=current_date,
-                            heure_debut=heure_courante,
-                            defaults={
-                                'heure_fin': heure_fin,
-                                'max_personnes': 3,
-                                'actif': True
-                            }
-                        )
-                    
-                    # Passer à l'heure suivante
-                    heure_courante = heure_fin
-            except HoraireOuverture.DoesNotExist:
-                pass
+        materialiser_creneaux(today, today + timedelta(days=13))
         
         # 4. Créer des inscriptions réalistes
         self.stdout.write('📝 Génération des inscriptions...')
@@ -103,15 +79,11 @@ class Command(BaseCommand):
                 utilisateurs_sample = random.sample(users, nb_inscriptions)
                 
                 for user in utilisateurs_sample:
-                    # Éviter les doublons
-                    if not Inscription.objects.filter(
-                        utilisateur=user, 
-                        creneau=creneau, 
-                        annulee=False
-                    ).exists():
-                        Inscription.objects.create(
-                            utilisateur=user,
-                            creneau=creneau,
+                    # Les doublons et créneaux complets sont refusés par le service
+                    try:
+                        services.inscrire(
+                            user,
+                            creneau,
                             commentaire=random.choice([
                                 '', 
                                 'Première permanence', 
@@ -119,6 +91,8 @@ class Command(BaseCommand):
                                 'Expérience en vente'
                             ])
                         )
+                    except ValidationError:
+                        pass
         
         # 5. Statistiques
         self.stdout.write('\n📊 RÉSUMÉ :')
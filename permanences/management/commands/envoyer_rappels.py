@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from permanences.rappels import envoyer_rappels, inscriptions_a_rappeler
+
+
+class Command(BaseCommand):
+    help = "Envoie par email le rappel des permanences du lendemain (une seule connexion SMTP, envoi par lots)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date', type=date.fromisoformat,
+            help='Jour des permanences à rappeler (AAAA-MM-JJ, défaut : demain)'
+        )
+        parser.add_argument(
+            '--taille-lot', type=int, default=settings.RAPPEL_TAILLE_LOT,
+            help='Emails envoyés par appel à send_messages'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Compte les rappels sans rien envoyer')
+
+    def handle(self, *args, **options):
+        jour = options['date'] or timezone.localdate() + timedelta(days=1)
+        if options['dry_run']:
+            nombre = inscriptions_a_rappeler(jour).count()
+            self.stdout.write(f"[dry-run] {nombre} rappel(s) à envoyer pour le {jour:%d/%m/%Y}.")
+            return
+
+        resultat = envoyer_rappels(jour, taille_lot=options['taille_lot'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultat['envoyes']} rappel(s) envoyé(s) pour le {jour:%d/%m/%Y} en {resultat['lots']} lot(s)."
+        ))
@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from permanences import views
+from permanences.donnees_charge import PREFIXE, generer_donnees
+from permanences.models import CreneauHoraire, Inscription
+
+
+# Index ajoutés par le projet (Meta.indexes), comparés à leur absence
+MODELES_INDEXES = [Inscription]
+
+LIGNES_PLAN = 12
+
+
+class Command(BaseCommand):
+    help = (
+        "Affiche les plans d'exécution (EXPLAIN) des requêtes de chaque vue, sans puis avec "
+        "les index du projet, sur un jeu de données synthétique. Tout est annulé à la fin "
+        "(transaction) ; sous PostgreSQL, à lancer sur une copie de la base : la suppression "
+        "temporaire des index verrouille les tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--annees', type=int, default=3, help='Années de créneaux générées')
+        parser.add_argument('--membres', type=int, default=200, help='Nombre de membres générés')
+        parser.add_argument(
+            '--sans-donnees', action='store_true',
+            help='Utilise les données existantes au lieu du jeu synthétique'
+        )
+
+    def handle(self, *args, **options):
+        # Cache factice : aucune page servie depuis le cache, rien n'y est écrit
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'],
+        ):
+            with transaction.atomic():
+                self._comparer(options)
+                transaction.set_rollback(True)
+
+    def _comparer(self, options):
+        if not options['sans_donnees']:
+            donnees = generer_donnees(nb_membres=options['membres'], annees=options['annees'])
+            self.stdout.write(
+                f"Jeu synthétique : {donnees['membres']} membres, {donnees['creneaux']} créneaux, "
+                f"{donnees['inscriptions']} inscriptions ({connection.vendor})"
+            )
+        membre = (
+            User.objects.filter(inscriptions__annulee=False)
+            .order_by('-inscriptions__creneau__date')
+            .first()
+        ) or User.objects.create(username=f'{PREFIXE}membre')
+        gestionnaire = User.objects.create(username=f'{PREFIXE}admin', is_staff=True, is_superuser=True)
+
+        self._analyser()
+        apres = self._plans(membre, gestionnaire)
+        self._supprimer_index()
+        self._analyser()
+        avant = self._plans(membre, gestionnaire)
+
+        for nom, requetes in apres.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {nom} ({len(requetes)} requête(s) de lecture) =='))
+            for numero, ((sql, plan), (_, plan_avant)) in enumerate(zip(requetes, avant[nom]), start=1):
+                self.stdout.write(f'[{numero}] {sql[:200]}')
+                self.stdout.write('  avant :')
+                self._afficher(plan_avant)
+                self.stdout.write(self.style.SUCCESS('  après :'))
+                self._afficher(plan)
+
+    def _afficher(self, plan):
+        for ligne in plan[:LIGNES_PLAN]:
+            self.stdout.write(f'    {ligne}')
+        if len(plan) > LIGNES_PLAN:
+            self.stdout.write(f'    … ({len(plan) - LIGNES_PLAN} ligne(s) de plus)')
+
+    def _scenarios(self, membre, gestionnaire):
+        lundi = timezone.localdate() - timedelta(days=timezone.localdate().weekday())
+        fabrique = RequestFactory()
+
+        def vue(fonction, utilisateur, parametres=None, **kwargs):
+            def appeler():
+                requete = fabrique.get('/', {'week': lundi.isoformat()} if parametres is None else parametres)
+                requete.user = utilisateur
+                reponse = fonction(requete, **kwargs)
+                if hasattr(reponse, 'render'):
+                    reponse.render()
+            return appeler
+
+        def changelist(modele):
+            return vue(admin.site._registry[modele].changelist_view, gestionnaire, {})
+
+        creneau = CreneauHoraire.objects.filter(date__gte=lundi).order_by('date', 'heure_debut').first()
+        scenarios = {
+            'calendrier_permanences': vue(views.calendrier_permanences, membre),
+            'mes_inscriptions': vue(views.mes_inscriptions, membre),
+            'gestion_inscriptions': vue(views.gestion_inscriptions, gestionnaire),
+            'ajax_places_lot': vue(views.ajax_places_lot, membre),
+            'admin créneaux': changelist(CreneauHoraire),
+            'admin inscriptions': changelist(Inscription),
+        }
+        if creneau:
+            scenarios['ajax_places_disponibles'] = vue(
+                views.ajax_places_disponibles, membre, creneau_id=creneau.pk
+            )
+        return scenarios
+
+    def _plans(self, membre, gestionnaire):
+        """Plan de chaque requête de lecture, par vue : {vue: [(sql, [lignes]), ...]}"""
+        resultats = {}
+        for nom, scenario in self._scenarios(membre, gestionnaire).items():
+            with CaptureQueriesContext(connection) as ctx:
+                scenario()
+            # Les requêtes sont comparées par position : leur texte contient l'heure courante
+            resultats[nom] = [
+                (requete['sql'], self._expliquer(requete['sql']))
+                for requete in ctx.captured_queries
+                if requete['sql'].startswith('SELECT')
+            ]
+        return resultats
+
+    def _expliquer(self, sql):
+        prefixe = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefixe + sql)
+            lignes = cursor.fetchall()
+        # SQLite : (id, parent, inutilisé, détail) ; PostgreSQL : une colonne de texte
+        return [ligne[-1] for ligne in lignes]
+
+    def _analyser(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _supprimer_index(self):
+        with connection.cursor() as cursor:
+            for modele in MODELES_INDEXES:
+                for index in modele._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
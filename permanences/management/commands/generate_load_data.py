@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from permanences.donnees_charge import PREFIXE, generer_donnees
+
+
+class Command(BaseCommand):
+    help = "Génère un jeu de données volumineux (membres, créneaux, inscriptions) pour les tests de charge"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--membres', type=int, default=500, help='Nombre de membres')
+        parser.add_argument('--annees', type=int, default=3, help='Années de créneaux passés')
+        parser.add_argument('--semaines-a-venir', type=int, default=8, help='Semaines de créneaux à venir')
+        parser.add_argument('--max-personnes', type=int, default=3, help='Places par créneau')
+        parser.add_argument('--remplissage', type=float, default=0.6, help='Taux de remplissage moyen (0 à 1)')
+        parser.add_argument('--annulation', type=float, default=0.1, help="Part d'inscriptions annulées (0 à 1)")
+        parser.add_argument('--graine', type=int, default=0, help='Graine du générateur aléatoire')
+        parser.add_argument('--force', action='store_true', help='Autorise la génération avec DEBUG=False')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('DEBUG=False : base de production ? Relancez avec --force pour confirmer.')
+
+        resultat = generer_donnees(
+            nb_membres=options['membres'],
+            annees=options['annees'],
+            semaines_a_venir=options['semaines_a_venir'],
+            max_personnes=options['max_personnes'],
+            taux_remplissage=options['remplissage'],
+            taux_annulation=options['annulation'],
+            graine=options['graine'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Du {resultat['date_debut']} au {resultat['date_fin']} : {resultat['membres']} membres "
+            f"({PREFIXE}...), {resultat['creneaux']} créneaux, {resultat['inscriptions']} inscriptions créées."
+        ))
+        for etape, duree in resultat['durees'].items():
+            self.stdout.write(f'  {etape:<14} {duree:8.2f} s')
@@ -1,19 +1,51 @@
-import pandas as pd
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from permanences.import_membres import TAILLE_LOT, importer_membres
+
 
 class Command(BaseCommand):
-    help = "Importe des utilisateurs depuis users_extraits.xlsx"
+    help = "Importe des utilisateurs depuis users_extraits.xlsx (ou un autre fichier .xlsx / .csv)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'fichier', nargs='?', default='users_extraits.xlsx',
+            help='Fichier .xlsx ou .csv avec les colonnes ID, Password et éventuellement NomPrenom, Nom, Prenom, Email'
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Affiche ce qui serait fait sans rien écrire")
+        parser.add_argument(
+            '--creer-seulement', action='store_true',
+            help='Ne met pas à jour les noms et emails des utilisateurs existants'
+        )
+        parser.add_argument(
+            '--processus', type=int, default=None,
+            help='Processus de hachage des mots de passe (défaut : un par cœur, 1 = sans pool)'
+        )
+        parser.add_argument('--lot', type=int, default=TAILLE_LOT, help='Taille des lots d\'insertion')
 
     def handle(self, *args, **options):
-        User = get_user_model()
-        # Charge le fichier Excel
-        df = pd.read_excel('users_extraits.xlsx')
-        for _, row in df.iterrows():
-            username = str(row['ID']).strip()
-            password = str(row['Password']).strip()
-            if not User.objects.filter(username=username).exists():
-                User.objects.create_user(username=username, password=password)
+        try:
+            rapport = importer_membres(
+                options['fichier'],
+                processus=options['processus'],
+                taille_lot=options['lot'],
+                dry_run=options['dry_run'],
+                mettre_a_jour=not options['creer_seulement'],
+            )
+        except (OSError, ImportError, ValueError) as erreur:
+            raise CommandError(str(erreur))
+
+        for avertissement in rapport['avertissements']:
+            self.stdout.write(self.style.WARNING(avertissement))
+        if options['verbosity'] >= 2:
+            for username in rapport['crees']:
                 self.stdout.write(self.style.SUCCESS(f"Utilisateur {username} créé"))
-            else:
-                self.stdout.write(self.style.WARNING(f"{username} existe déjà"))
+            for username in rapport['mis_a_jour']:
+                self.stdout.write(f"Utilisateur {username} mis à jour")
+
+        prefixe = '[dry-run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefixe}{len(rapport['crees'])} créé(s), {len(rapport['mis_a_jour'])} mis à jour, "
+            f"{len(rapport['inchanges'])} inchangé(s), {len(rapport['avertissements'])} ligne(s) ignorée(s)."
+        ))
+        for etape, duree in rapport['durees'].items():
+            self.stdout.write(f'  {etape:<24} {duree:8.2f} s')
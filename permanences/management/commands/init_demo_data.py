@@ -1,7 +1,10 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from permanences.models import HoraireOuverture, CreneauHoraire, Inscription
-from datetime import datetime, time, date, timedelta
+from django.core.exceptions import ValidationError
+from permanences.models import HoraireRecurrent, CreneauHoraire
+from permanences.generation import materialiser_creneaux
+from permanences import services
+from datetime import time, date, timedelta
 
 
 class Command(BaseCommand):
@@ -31,11 +34,12 @@ class Command(BaseCommand):
         ]
         
         for jour, ouverture, fermeture in horaires_defaults:
-            horaire, created = HoraireOuverture.objects.get_or_create(
+            horaire, created = HoraireRecurrent.objects.get_or_create(
                 jour_semaine=jour,
+                heure_ouverture=ouverture,
                 defaults={
-                    'heure_ouverture': ouverture,
                     'heure_fermeture': fermeture,
+                    'date_debut': date.today(),
                     'actif': True
                 }
             )
@@ -75,41 +79,9 @@ class Command(BaseCommand):
         """Créer des créneaux de test pour les 2 prochaines semaines"""
         today = date.today()
         
-        # Créer des créneaux pour les 14 prochains jours
-        for i in range(14):
-            current_date = today + timedelta(days=i)
-            day_of_week = current_date.weekday()
-            
-            # Vérifier s'il y a des horaires pour ce jour
-            try:
-                horaire = HoraireOuverture.objects.get(jour_semaine=day_of_week, actif=True)
-            except HoraireOuverture.DoesNotExist:
-                continue
-            
-            # Créer des créneaux d'une heure
-            current_time = horaire.heure_ouverture
-            while current_time < horaire.heure_fermeture:
-                # Calculer l'heure de fin (1 heure plus tard)
-                end_time = datetime.combine(current_date, current_time)
-                end_time += timedelta(hours=1)
-                end_time = end_time.time()
-                
-                # Vérifier que l'heure de fin ne dépasse pas l'heure de fermeture
-                if end_time <= horaire.heure_fermeture:
-                    creneau, created = CreneauHoraire.objects.get_or_create(
-                        date=current_date,
-                        heure_debut=current_time,
-                        defaults={
-                            'heure_fin': end_time,
-                            'max_personnes': 3,
-                            'actif': True
-                        }
-                    )
-                    if created:
-                        self.stdout.write(f'Créneau créé: {current_date} {current_time}-{end_time}')
-                
-                # Passer à l'heure suivante
-                current_time = end_time
+        # Générer les créneaux des 14 prochains jours à partir des horaires
+        crees, ignores = materialiser_creneaux(today, today + timedelta(days=13))
+        self.stdout.write(f'Créneaux créés: {crees} ({ignores} existaient déjà)')
 
         # Créer quelques inscriptions de test pour les créneaux futurs
         self.create_test_inscriptions()
@@ -125,12 +97,8 @@ class Command(BaseCommand):
         for i, creneau in enumerate(creneaux):
             if users.exists() and i < len(users):
                 user = users[i]
-                inscription, created = Inscription.objects.get_or_create(
-                    utilisateur=user,
-                    creneau=creneau,
-                    defaults={
-                        'commentaire': f'Inscription de test pour {user.first_name}'
-                    }
-                )
-                if created:
+                try:
+                    services.inscrire(user, creneau, commentaire=f'Inscription de test pour {user.first_name}')
                     self.stdout.write(f'Inscription créée: {user.username} -> {creneau}')
+                except ValidationError:
+                    pass
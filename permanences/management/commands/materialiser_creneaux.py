@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from permanences.generation import materialiser_creneaux
+
+
+class Command(BaseCommand):
+    help = 'Crée les créneaux des horaires récurrents pour les prochaines semaines (horizon glissant)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semaines', type=int, default=8, help='Nombre de semaines à matérialiser')
+
+    def handle(self, *args, **options):
+        debut = timezone.localdate()
+        fin = debut + timedelta(weeks=options['semaines'])
+        crees, ignores = materialiser_creneaux(debut, fin)
+        self.stdout.write(self.style.SUCCESS(
+            f'Du {debut} au {fin} : {crees} créneau(x) créé(s), {ignores} déjà existant(s).'
+        ))
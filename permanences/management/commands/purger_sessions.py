@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Supprime les sessions expirées par lots, pour ne pas bloquer la base longtemps"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot', type=int, default=1000, help='Sessions supprimées par transaction')
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE.endswith('signed_cookies'):
+            self.stdout.write('Sessions en cookies signés : rien à purger côté serveur.')
+            return
+
+        maintenant = timezone.now()
+        total = 0
+        while True:
+            cles = list(
+                Session.objects
+                .filter(expire_date__lt=maintenant)
+                .values_list('session_key', flat=True)[:options['lot']]
+            )
+            if not cles:
+                break
+            with transaction.atomic():
+                total += Session.objects.filter(session_key__in=cles).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'{total} session(s) expirée(s) supprimée(s).'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+
+from permanences.models import CreneauHoraire
+from permanences import services
+
+
+class Command(BaseCommand):
+    help = "Vérifie et reconstruit le compteur d'inscriptions actives (nb_inscrits) des créneaux"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verifier', action='store_true',
+            help='Liste les écarts sans les corriger (code de sortie non nul si écart)'
+        )
+
+    def handle(self, *args, **options):
+        ecarts = list(
+            CreneauHoraire.objects
+            .annotate(nb_reel=Count('inscriptions', filter=Q(inscriptions__annulee=False)))
+            .exclude(nb_inscrits=F('nb_reel'))
+            .order_by('date', 'heure_debut')
+        )
+
+        for creneau in ecarts:
+            self.stdout.write(
+                f'{creneau} : compteur {creneau.nb_inscrits}, réel {creneau.nb_reel}'
+            )
+
+        if not ecarts:
+            self.stdout.write(self.style.SUCCESS('Tous les compteurs sont à jour.'))
+            return
+
+        if options['verifier']:
+            raise CommandError(f'{len(ecarts)} créneau(x) avec un compteur incorrect')
+
+        corriges = services.recalculer_compteurs([creneau.pk for creneau in ecarts])
+        self.stdout.write(self.style.SUCCESS(f'{corriges} compteur(s) corrigé(s).'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from permanences.models import StatistiqueMensuelle
+from permanences.statistiques import CHAMPS, calculer_statistiques, recalculer_statistiques
+
+
+class Command(BaseCommand):
+    help = "Vérifie et reconstruit les statistiques mensuelles des membres (inscriptions et archives)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verifier', action='store_true',
+            help='Liste les écarts sans les corriger (code de sortie non nul si écart)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['verifier']:
+            lignes = recalculer_statistiques()
+            self.stdout.write(self.style.SUCCESS(f'{lignes} ligne(s) de statistiques reconstruite(s).'))
+            return
+
+        attendues = calculer_statistiques()
+        vide = dict.fromkeys(CHAMPS, 0)
+        ecarts = 0
+        for ligne in StatistiqueMensuelle.objects.select_related('utilisateur'):
+            attendu = attendues.pop((ligne.utilisateur_id, ligne.mois), vide)
+            enregistre = {champ: getattr(ligne, champ) for champ in CHAMPS}
+            if enregistre != attendu:
+                ecarts += 1
+                self.stdout.write(f'{ligne.utilisateur.username} {ligne.mois:%m/%Y} : {enregistre}, réel {attendu}')
+        for (utilisateur_id, mois), attendu in attendues.items():
+            if attendu != vide:
+                ecarts += 1
+                self.stdout.write(f'utilisateur {utilisateur_id} {mois:%m/%Y} : absent, réel {attendu}')
+
+        if ecarts:
+            raise CommandError(f'{ecarts} ligne(s) de statistiques incorrecte(s)')
+        self.stdout.write(self.style.SUCCESS('Toutes les statistiques sont à jour.'))
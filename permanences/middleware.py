@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+
+
+CLE_RAFRAICHISSEMENT = '_rafraichie_le'
+
+
+def marquer_session(session):
+    session[CLE_RAFRAICHISSEMENT] = int(time.time())
+
+
+class RafraichissementSessionMiddleware:
+    """
+    Prolonge la session seulement quand c'est utile.
+
+    Remplace SESSION_SAVE_EVERY_REQUEST : la session n'est réenregistrée (et son
+    expiration repoussée) que lorsque plus de SESSION_FRACTION_RAFRAICHISSEMENT
+    de SESSION_COOKIE_AGE s'est écoulée depuis le dernier enregistrement. Les
+    requêtes en lecture seule n'écrivent donc plus dans la table des sessions.
+    L'horodatage est posé à la connexion (signal user_logged_in, voir
+    signals.py). À placer après SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.intervalle = settings.SESSION_COOKIE_AGE * settings.SESSION_FRACTION_RAFRAICHISSEMENT
+
+    def __call__(self, request):
+        session = request.session
+        # Une session vide (visiteur anonyme) n'est jamais créée ici
+        if not session.is_empty():
+            if time.time() - session.get(CLE_RAFRAICHISSEMENT, 0) >= self.intervalle:
+                marquer_session(session)
+        return self.get_response(request)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+def initialiser_nb_inscrits(apps, schema_editor):
+    """Calcule le compteur à partir des inscriptions existantes"""
+    CreneauHoraire = apps.get_model('permanences', 'CreneauHoraire')
+    creneaux = CreneauHoraire.objects.annotate(
+        nb_actifs=models.Count('inscriptions', filter=models.Q(inscriptions__annulee=False))
+    ).filter(nb_actifs__gt=0)
+    for creneau in creneaux:
+        CreneauHoraire.objects.filter(pk=creneau.pk).update(nb_inscrits=creneau.nb_actifs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0002_delete_horaireouverture'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creneauhoraire',
+            name='nb_inscrits',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text="Nombre d'inscriptions actives (compteur dénormalisé)"),
+        ),
+        migrations.RunPython(initialiser_nb_inscrits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0003_creneauhoraire_nb_inscrits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FermetureExceptionnelle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Date de fermeture', unique=True)),
+                ('motif', models.CharField(blank=True, help_text='Motif (ex : jour férié)', max_length=100)),
+            ],
+            options={
+                'verbose_name': 'Fermeture exceptionnelle',
+                'verbose_name_plural': 'Fermetures exceptionnelles',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HoraireRecurrent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour_semaine', models.IntegerField(choices=[(0, 'Lundi'), (1, 'Mardi'), (2, 'Mercredi'), (3, 'Jeudi'), (4, 'Vendredi'), (5, 'Samedi'), (6, 'Dimanche')], help_text='Jour de la semaine (0=Lundi, 6=Dimanche)')),
+                ('heure_ouverture', models.TimeField(help_text="Heure d'ouverture")),
+                ('heure_fermeture', models.TimeField(help_text='Heure de fermeture')),
+                ('max_personnes', models.PositiveIntegerField(default=3, help_text='Nombre maximum de personnes par créneau généré')),
+                ('date_debut', models.DateField(help_text='Premier jour de validité')),
+                ('date_fin', models.DateField(blank=True, help_text='Dernier jour de validité (vide = sans limite)', null=True)),
+                ('actif', models.BooleanField(default=True, help_text='Horaire utilisé pour générer les créneaux')),
+            ],
+            options={
+                'verbose_name': 'Horaire récurrent',
+                'verbose_name_plural': 'Horaires récurrents',
+                'ordering': ['jour_semaine', 'heure_ouverture'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0004_horairerecurrent_fermetureexceptionnelle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creneauhoraire',
+            name='modifie_le',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Dernière modification du créneau ou de ses inscriptions'),
+            preserve_default=False,
+        ),
+    ]
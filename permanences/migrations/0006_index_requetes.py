@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0005_creneauhoraire_modifie_le'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='creneauhoraire',
+            index=models.Index(condition=models.Q(('actif', True)), fields=['date', 'heure_debut'], name='creneau_actif_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(condition=models.Q(('annulee', False)), fields=['creneau'], name='inscription_active_creneau_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(condition=models.Q(('annulee', False)), fields=['utilisateur', 'creneau'], name='inscription_active_membre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(fields=['-date_inscription'], name='inscription_date_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0006_index_requetes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveMensuelle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mois', models.DateField(help_text='Premier jour du mois des créneaux archivés')),
+                ('inscriptions', models.PositiveIntegerField(default=0, help_text='Inscriptions archivées, annulées comprises')),
+                ('annulations', models.PositiveIntegerField(default=0, help_text='Inscriptions archivées annulées')),
+                ('utilisateur', models.ForeignKey(help_text='Membre', on_delete=django.db.models.deletion.CASCADE, related_name='archives_mensuelles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archive mensuelle',
+                'verbose_name_plural': 'Archives mensuelles',
+                'ordering': ['-mois'],
+                'unique_together': {('utilisateur', 'mois')},
+            },
+        ),
+    ]
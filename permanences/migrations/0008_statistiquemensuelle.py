@@ -0,0 +1,83 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:24
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def initialiser_statistiques(apps, schema_editor):
+    """Calcule les statistiques à partir des inscriptions et archives existantes"""
+    Inscription = apps.get_model('permanences', 'Inscription')
+    ArchiveMensuelle = apps.get_model('permanences', 'ArchiveMensuelle')
+    StatistiqueMensuelle = apps.get_model('permanences', 'StatistiqueMensuelle')
+    delai = timedelta(hours=settings.ANNULATION_TARDIVE_HEURES)
+
+    totaux = defaultdict(lambda: defaultdict(int))
+    for utilisateur_id, date, debut, fin, annulee, date_annulation in Inscription.objects.values_list(
+        'utilisateur_id', 'creneau__date', 'creneau__heure_debut', 'creneau__heure_fin',
+        'annulee', 'date_annulation'
+    ).iterator():
+        ligne = totaux[utilisateur_id, date.replace(day=1)]
+        if annulee:
+            ligne['annulations'] += 1
+            if date_annulation and timezone.make_aware(datetime.combine(date, debut)) - date_annulation < delai:
+                ligne['annulations_tardives'] += 1
+        else:
+            ligne['creneaux'] += 1
+            ligne['minutes'] += int((datetime.combine(date, fin) - datetime.combine(date, debut)).total_seconds() // 60)
+    for archive in ArchiveMensuelle.objects.all():
+        ligne = totaux[archive.utilisateur_id, archive.mois]
+        ligne['creneaux'] += archive.inscriptions - archive.annulations
+        ligne['annulations'] += archive.annulations
+    StatistiqueMensuelle.objects.bulk_create(
+        [
+            StatistiqueMensuelle(utilisateur_id=utilisateur_id, mois=mois, **compteurs)
+            for (utilisateur_id, mois), compteurs in totaux.items()
+        ],
+        batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0007_archivemensuelle'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivemensuelle',
+            name='annulations_tardives',
+            field=models.PositiveIntegerField(default=0, help_text='Annulations archivées faites peu avant le créneau'),
+        ),
+        migrations.AddField(
+            model_name='archivemensuelle',
+            name='minutes',
+            field=models.PositiveIntegerField(default=0, help_text='Durée cumulée des créneaux archivés assurés (minutes)'),
+        ),
+        migrations.CreateModel(
+            name='StatistiqueMensuelle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mois', models.DateField(help_text='Premier jour du mois')),
+                ('creneaux', models.PositiveIntegerField(default=0, help_text='Créneaux assurés (inscriptions actives)')),
+                ('minutes', models.PositiveIntegerField(default=0, help_text='Durée cumulée des créneaux assurés (minutes)')),
+                ('annulations', models.PositiveIntegerField(default=0, help_text='Inscriptions annulées')),
+                ('annulations_tardives', models.PositiveIntegerField(default=0, help_text='Annulations faites peu avant le créneau')),
+                ('utilisateur', models.ForeignKey(help_text='Membre', on_delete=django.db.models.deletion.CASCADE, related_name='statistiques_mensuelles', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Statistique mensuelle',
+                'verbose_name_plural': 'Statistiques mensuelles',
+                'ordering': ['-mois'],
+                'indexes': [models.Index(fields=['mois'], name='statistique_mois_idx')],
+                'unique_together': {('utilisateur', 'mois')},
+            },
+        ),
+        migrations.RunPython(initialiser_statistiques, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:30
+
+import django.db.models.deletion
+import permanences.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0008_statistiquemensuelle'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JetonCalendrier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jeton', models.CharField(default=permanences.models._nouveau_jeton, help_text="Jeton de l'URL du flux", max_length=64, unique=True)),
+                ('cree_le', models.DateTimeField(auto_now=True, help_text='Date de création ou de renouvellement')),
+                ('utilisateur', models.OneToOneField(help_text='Membre', on_delete=django.db.models.deletion.CASCADE, related_name='jeton_calendrier', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Jeton de calendrier',
+                'verbose_name_plural': 'Jetons de calendrier',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0009_jetoncalendrier'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_demande', models.DateTimeField(auto_now_add=True, help_text='Date et heure de la demande (rang dans la file)')),
+                ('creneau', models.ForeignKey(help_text='Créneau demandé', on_delete=django.db.models.deletion.CASCADE, related_name='attentes', to='permanences.creneauhoraire')),
+                ('utilisateur', models.ForeignKey(help_text='Membre en attente', on_delete=django.db.models.deletion.CASCADE, related_name='attentes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Liste d'attente",
+                'verbose_name_plural': "Listes d'attente",
+                'ordering': ['date_demande', 'id'],
+                'indexes': [models.Index(fields=['creneau', 'date_demande', 'id'], name='attente_file_idx')],
+                'unique_together': {('utilisateur', 'creneau')},
+            },
+        ),
+    ]
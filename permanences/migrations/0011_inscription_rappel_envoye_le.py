@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0010_liste_attente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inscription',
+            name='rappel_envoye_le',
+            field=models.DateTimeField(blank=True, help_text="Date d'envoi de l'email de rappel", null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0011_inscription_rappel_envoye_le'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='creneauhoraire',
+            name='creneau_actif_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='inscription',
+            name='inscription_active_creneau_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='inscription',
+            name='inscription_active_membre_idx',
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(fields=['utilisateur', 'annulee', 'creneau'], name='inscription_membre_statut_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:08
+
+import datetime
+
+from django.db import migrations, models
+
+
+def initialiser_creneaux_materialises(apps, schema_editor):
+    """Les créneaux à venir existants ne seront pas recréés s'ils sont supprimés"""
+    CreneauHoraire = apps.get_model('permanences', 'CreneauHoraire')
+    CreneauMaterialise = apps.get_model('permanences', 'CreneauMaterialise')
+    CreneauMaterialise.objects.bulk_create([
+        CreneauMaterialise(date=date, heure_debut=heure_debut)
+        for date, heure_debut in CreneauHoraire.objects
+        .filter(date__gte=datetime.date.today())
+        .values_list('date', 'heure_debut')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0012_index_utilises'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreneauMaterialise',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Date du créneau')),
+                ('heure_debut', models.TimeField(help_text='Heure de début du créneau')),
+            ],
+            options={
+                'verbose_name': 'Créneau matérialisé',
+                'verbose_name_plural': 'Créneaux matérialisés',
+                'unique_together': {('date', 'heure_debut')},
+            },
+        ),
+        migrations.RunPython(initialiser_creneaux_materialises, migrations.RunPython.noop),
+    ]
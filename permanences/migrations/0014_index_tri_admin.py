@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permanences', '0013_creneaumaterialise'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='inscription',
+            name='inscription_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(fields=['-date_inscription', '-id'], name='inscription_tri_admin_idx'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
@@ -5,6 +7,78 @@ from datetime import datetime, time, timedelta
 from django.utils import timezone
 
 
+JOURS_SEMAINE = [
+    (0, 'Lundi'), (1, 'Mardi'), (2, 'Mercredi'), (3, 'Jeudi'),
+    (4, 'Vendredi'), (5, 'Samedi'), (6, 'Dimanche'),
+]
+
+
+class HoraireRecurrent(models.Model):
+    """Horaire d'ouverture hebdomadaire à partir duquel les créneaux sont générés à la demande"""
+    jour_semaine = models.IntegerField(
+        choices=JOURS_SEMAINE,
+        help_text="Jour de la semaine (0=Lundi, 6=Dimanche)"
+    )
+    heure_ouverture = models.TimeField(help_text="Heure d'ouverture")
+    heure_fermeture = models.TimeField(help_text="Heure de fermeture")
+    max_personnes = models.PositiveIntegerField(
+        default=3,
+        help_text="Nombre maximum de personnes par créneau généré"
+    )
+    date_debut = models.DateField(help_text="Premier jour de validité")
+    date_fin = models.DateField(
+        null=True,
+        blank=True,
+        help_text="Dernier jour de validité (vide = sans limite)"
+    )
+    actif = models.BooleanField(default=True, help_text="Horaire utilisé pour générer les créneaux")
+
+    class Meta:
+        verbose_name = "Horaire récurrent"
+        verbose_name_plural = "Horaires récurrents"
+        ordering = ['jour_semaine', 'heure_ouverture']
+
+    def __str__(self):
+        return f"{self.get_jour_semaine_display()} {self.heure_ouverture} - {self.heure_fermeture}"
+
+    def clean(self):
+        if self.heure_ouverture is not None and self.heure_fermeture is not None:
+            if self.heure_ouverture >= self.heure_fermeture:
+                raise ValidationError("L'heure d'ouverture doit être strictement inférieure à l'heure de fermeture.")
+        if self.date_debut and self.date_fin and self.date_fin < self.date_debut:
+            raise ValidationError("La fin de validité doit suivre le début de validité.")
+
+
+class FermetureExceptionnelle(models.Model):
+    """Jour sans permanence (jour férié, congés...) : aucun créneau n'y est généré"""
+    date = models.DateField(unique=True, help_text="Date de fermeture")
+    motif = models.CharField(max_length=100, blank=True, help_text="Motif (ex : jour férié)")
+
+    class Meta:
+        verbose_name = "Fermeture exceptionnelle"
+        verbose_name_plural = "Fermetures exceptionnelles"
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.date} {self.motif}".strip()
+
+
+class CreneauMaterialise(models.Model):
+    """
+    Créneau déjà créé depuis un horaire récurrent : s'il est supprimé ensuite
+    (dans l'admin par exemple), il n'est pas recréé à la consultation suivante
+    """
+    date = models.DateField(help_text="Date du créneau")
+    heure_debut = models.TimeField(help_text="Heure de début du créneau")
+
+    class Meta:
+        verbose_name = "Créneau matérialisé"
+        verbose_name_plural = "Créneaux matérialisés"
+        unique_together = ['date', 'heure_debut']
+
+    def __str__(self):
+        return f"{self.date} {self.heure_debut}"
+
 
 class CreneauHoraire(models.Model):
     """Représente un créneau horaire d'une heure pour les permanences"""
@@ -16,6 +90,15 @@ class CreneauHoraire(models.Model):
         help_text="Nombre maximum de personnes autorisées pour ce créneau"
     )
     actif = models.BooleanField(default=True, help_text="Créneau disponible pour inscription")
+    nb_inscrits = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Nombre d'inscriptions actives (compteur dénormalisé)"
+    )
+    modifie_le = models.DateTimeField(
+        auto_now=True,
+        help_text="Dernière modification du créneau ou de ses inscriptions"
+    )
     
     class Meta:
         verbose_name = "Créneau horaire"
@@ -26,12 +109,28 @@ class CreneauHoraire(models.Model):
     def __str__(self):
         return f"{self.date} {self.heure_debut} - {self.heure_fin}"
     
+    def _inscriptions_prefetchees(self):
+        """Retourne les inscriptions chargées par prefetch_related('inscriptions'), sinon None"""
+        return getattr(self, '_prefetched_objects_cache', {}).get('inscriptions')
+
+    @property
+    def liste_inscriptions_actives(self):
+        """Inscriptions non annulées, lues depuis le prefetch si disponible"""
+        prefetch = self._inscriptions_prefetchees()
+        if prefetch is not None:
+            return [inscription for inscription in prefetch if not inscription.annulee]
+        return list(self.inscriptions_actives)
+
+    @property
+    def nb_inscrits_actifs(self):
+        """Nombre d'inscriptions non annulées, lu dans le compteur dénormalisé (sans requête)"""
+        return self.nb_inscrits
+
     @property
     def places_disponibles(self):
         """Retourne le nombre de places disponibles"""
         try:
-            inscriptions_count = self.inscriptions.filter(annulee=False).count()
-            return max(0, self.max_personnes - inscriptions_count)
+            return max(0, self.max_personnes - self.nb_inscrits_actifs)
         except Exception:
             return self.max_personnes
     
@@ -76,9 +175,15 @@ class CreneauHoraire(models.Model):
 
     def get_user_inscription(self, user):
         """Retourne l'inscription active (non annulée) de l'utilisateur pour ce créneau."""
-        if user.is_authenticated:
-            return self.inscriptions.filter(utilisateur=user, annulee=False).first()
-        return None
+        if not user.is_authenticated:
+            return None
+        prefetch = self._inscriptions_prefetchees()
+        if prefetch is not None:
+            for inscription in prefetch:
+                if inscription.utilisateur_id == user.id and not inscription.annulee:
+                    return inscription
+            return None
+        return self.inscriptions.filter(utilisateur=user, annulee=False).first()
 
 class Inscription(models.Model):
     """Inscription d'un utilisateur à un créneau horaire"""
@@ -108,12 +213,25 @@ class Inscription(models.Model):
         blank=True,
         help_text="Commentaire optionnel"
     )
+    rappel_envoye_le = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Date d'envoi de l'email de rappel"
+    )
     
     class Meta:
         verbose_name = "Inscription"
         verbose_name_plural = "Inscriptions"
         unique_together = ['utilisateur', 'creneau']
         ordering = ['-date_inscription']
+        indexes = [
+            # Version de « mes inscriptions » (nombre et dernière modification des
+            # inscriptions actives d'un membre) lue dans l'index, sans la table
+            models.Index(fields=['utilisateur', 'annulee', 'creneau'], name='inscription_membre_statut_idx'),
+            # Page de la liste de l'admin : même ordre que son ORDER BY complet
+            # (tri par défaut puis pk), lue dans l'index jusqu'au LIMIT, sans tri
+            models.Index(fields=['-date_inscription', '-id'], name='inscription_tri_admin_idx'),
+        ]
     
     def __str__(self):
         status = " (Annulée)" if self.annulee else ""
@@ -145,8 +263,126 @@ class Inscription(models.Model):
             pass
     
     def annuler(self):
-        """Annule l'inscription (timestamps aware)"""
+        """Annule l'inscription et libère la place (timestamps aware)"""
+        from .services import desinscrire
         if not self.annulee:
-            self.annulee = True
-            self.date_annulation = timezone.now()
-            self.save()
+            desinscrire(self)
+
+
+class ArchiveMensuelle(models.Model):
+    """Inscriptions archivées d'un membre pour un mois (créneaux retirés des tables principales)"""
+    utilisateur = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archives_mensuelles',
+        help_text="Membre"
+    )
+    mois = models.DateField(help_text="Premier jour du mois des créneaux archivés")
+    inscriptions = models.PositiveIntegerField(default=0, help_text="Inscriptions archivées, annulées comprises")
+    annulations = models.PositiveIntegerField(default=0, help_text="Inscriptions archivées annulées")
+    annulations_tardives = models.PositiveIntegerField(default=0, help_text="Annulations archivées faites peu avant le créneau")
+    minutes = models.PositiveIntegerField(default=0, help_text="Durée cumulée des créneaux archivés assurés (minutes)")
+
+    class Meta:
+        verbose_name = "Archive mensuelle"
+        verbose_name_plural = "Archives mensuelles"
+        unique_together = ['utilisateur', 'mois']
+        ordering = ['-mois']
+
+    def __str__(self):
+        return f"{self.utilisateur.username} - {self.mois:%m/%Y} : {self.inscriptions} inscription(s)"
+
+
+class StatistiqueMensuelle(models.Model):
+    """
+    Activité d'un membre sur un mois (mois du créneau), archives comprises.
+
+    Tenue à jour par le service d'inscription (voir statistiques.py) ;
+    recalculable par la commande recalculer_statistiques.
+    """
+    utilisateur = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='statistiques_mensuelles',
+        help_text="Membre"
+    )
+    mois = models.DateField(help_text="Premier jour du mois")
+    creneaux = models.PositiveIntegerField(default=0, help_text="Créneaux assurés (inscriptions actives)")
+    minutes = models.PositiveIntegerField(default=0, help_text="Durée cumulée des créneaux assurés (minutes)")
+    annulations = models.PositiveIntegerField(default=0, help_text="Inscriptions annulées")
+    annulations_tardives = models.PositiveIntegerField(default=0, help_text="Annulations faites peu avant le créneau")
+
+    class Meta:
+        verbose_name = "Statistique mensuelle"
+        verbose_name_plural = "Statistiques mensuelles"
+        unique_together = ['utilisateur', 'mois']
+        ordering = ['-mois']
+        indexes = [
+            # Classement des membres sur une période
+            models.Index(fields=['mois'], name='statistique_mois_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.utilisateur.username} - {self.mois:%m/%Y} : {self.creneaux} créneau(x)"
+
+    @property
+    def heures(self):
+        return self.minutes / 60
+
+
+def _nouveau_jeton():
+    return secrets.token_urlsafe(24)
+
+
+class JetonCalendrier(models.Model):
+    """Jeton secret de l'abonnement iCalendar d'un membre (flux accessible sans connexion)"""
+    utilisateur = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jeton_calendrier',
+        help_text="Membre"
+    )
+    jeton = models.CharField(max_length=64, unique=True, default=_nouveau_jeton, help_text="Jeton de l'URL du flux")
+    cree_le = models.DateTimeField(auto_now=True, help_text="Date de création ou de renouvellement")
+
+    class Meta:
+        verbose_name = "Jeton de calendrier"
+        verbose_name_plural = "Jetons de calendrier"
+
+    def __str__(self):
+        return f"Calendrier de {self.utilisateur.username}"
+
+    def renouveler(self):
+        """Invalide l'ancienne URL du flux"""
+        self.jeton = _nouveau_jeton()
+        self.save()
+
+
+class Attente(models.Model):
+    """Demande d'un membre en liste d'attente d'un créneau complet"""
+    utilisateur = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='attentes',
+        help_text="Membre en attente"
+    )
+    creneau = models.ForeignKey(
+        CreneauHoraire,
+        on_delete=models.CASCADE,
+        related_name='attentes',
+        help_text="Créneau demandé"
+    )
+    date_demande = models.DateTimeField(auto_now_add=True, help_text="Date et heure de la demande (rang dans la file)")
+
+    class Meta:
+        verbose_name = "Liste d'attente"
+        verbose_name_plural = "Listes d'attente"
+        unique_together = ['utilisateur', 'creneau']
+        ordering = ['date_demande', 'id']
+        indexes = [
+            # Prochain de la file d'un créneau
+            models.Index(fields=['creneau', 'date_demande', 'id'], name='attente_file_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.utilisateur.username} en attente - {self.creneau}"
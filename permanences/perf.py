@@ -0,0 +1,182 @@
+"""
+Mesure des performances de chaque requête HTTP.
+
+MesurePerformanceMiddleware relève, par nom d'URL : durée totale, nombre et
+durée des requêtes SQL (connection.execute_wrapper), durée du rendu des
+gabarits (backend TemplatesMesures) et taille de la réponse. Les mesures sont
+conservées en mémoire dans un tampon circulaire propre à chaque processus,
+et peuvent être journalisées en JSON (logger `permanences.perf`).
+"""
+import heapq
+import json
+import logging
+import math
+import threading
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.backends.django import DjangoTemplates
+
+
+NB_PIRES_REQUETES = 20
+
+journal = logging.getLogger('permanences.perf')
+
+_mesures = deque(maxlen=settings.PERF_TAILLE_TAMPON)
+_pires_requetes = []
+_verrou = threading.Lock()
+
+# Durée de rendu des gabarits de la requête en cours (liste à un élément)
+_duree_gabarits = ContextVar('duree_gabarits', default=None)
+
+
+def _ajouter_requete_lente(duree, sql, vue):
+    with _verrou:
+        element = (duree, sql[:1000], vue)
+        if len(_pires_requetes) < NB_PIRES_REQUETES:
+            heapq.heappush(_pires_requetes, element)
+        else:
+            heapq.heappushpop(_pires_requetes, element)
+
+
+class _CompteurSQL:
+    """execute_wrapper : compte et chronomètre les requêtes SQL"""
+
+    def __init__(self):
+        self.nombre = 0
+        self.duree = 0.0
+        self.lentes = []
+        # Seules les requêtes plus lentes que la 20e pire sont conservées
+        with _verrou:
+            self.seuil = _pires_requetes[0][0] if len(_pires_requetes) >= NB_PIRES_REQUETES else 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duree = perf_counter() - debut
+            self.nombre += 1
+            self.duree += duree
+            if duree > self.seuil:
+                self.lentes.append((duree, sql))
+
+
+class _GabaritMesure:
+    """Enveloppe d'un gabarit qui cumule sa durée de rendu"""
+
+    def __init__(self, gabarit):
+        self.gabarit = gabarit
+
+    def __getattr__(self, nom):
+        return getattr(self.gabarit, nom)
+
+    def render(self, context=None, request=None):
+        cumul = _duree_gabarits.get()
+        if cumul is None:
+            return self.gabarit.render(context, request)
+        debut = perf_counter()
+        try:
+            return self.gabarit.render(context, request)
+        finally:
+            cumul[0] += perf_counter() - debut
+
+
+class TemplatesMesures(DjangoTemplates):
+    """Backend DjangoTemplates dont le rendu est chronométré par le middleware"""
+
+    def from_string(self, template_code):
+        return _GabaritMesure(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _GabaritMesure(super().get_template(template_name))
+
+
+class MesurePerformanceMiddleware:
+    """Enregistre les mesures de chaque requête (désactivé si PERF_MESURE est faux)"""
+
+    def __init__(self, get_response):
+        if not settings.PERF_MESURE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        compteur = _CompteurSQL()
+        gabarits = [0.0]
+        jeton = _duree_gabarits.set(gabarits)
+        debut = perf_counter()
+        try:
+            with connection.execute_wrapper(compteur):
+                response = self.get_response(request)
+        finally:
+            _duree_gabarits.reset(jeton)
+        duree = perf_counter() - debut
+
+        correspondance = request.resolver_match
+        vue = correspondance.view_name if correspondance else '(non résolue)'
+        mesure = {
+            'vue': vue,
+            'methode': request.method,
+            'statut': response.status_code,
+            'duree_ms': round(duree * 1000, 2),
+            'sql_nombre': compteur.nombre,
+            'sql_ms': round(compteur.duree * 1000, 2),
+            'gabarits_ms': round(gabarits[0] * 1000, 2),
+            'octets': None if response.streaming else len(response.content),
+        }
+        _mesures.append(mesure)
+        for duree_sql, sql in compteur.lentes:
+            _ajouter_requete_lente(duree_sql, sql, vue)
+        if settings.PERF_JOURNAL:
+            journal.info(json.dumps(mesure))
+        return response
+
+
+def percentile(valeurs, rang):
+    """Percentile `rang` (0-100) d'une liste triée, par la méthode du rang le plus proche"""
+    return valeurs[max(0, math.ceil(rang / 100 * len(valeurs)) - 1)]
+
+
+def statistiques():
+    """Synthèse par vue, de la plus lente à la plus rapide (p95)"""
+    par_vue = {}
+    for mesure in list(_mesures):
+        par_vue.setdefault(mesure['vue'], []).append(mesure)
+
+    lignes = []
+    for vue, mesures in par_vue.items():
+        durees = sorted(mesure['duree_ms'] for mesure in mesures)
+        tailles = [mesure['octets'] for mesure in mesures if mesure['octets'] is not None]
+        nombre = len(mesures)
+        lignes.append({
+            'vue': vue,
+            'appels': nombre,
+            'p50_ms': percentile(durees, 50),
+            'p95_ms': percentile(durees, 95),
+            'max_ms': durees[-1],
+            'sql_nombre': round(sum(mesure['sql_nombre'] for mesure in mesures) / nombre, 1),
+            'sql_ms': round(sum(mesure['sql_ms'] for mesure in mesures) / nombre, 2),
+            'gabarits_ms': round(sum(mesure['gabarits_ms'] for mesure in mesures) / nombre, 2),
+            'octets': round(sum(tailles) / len(tailles)) if tailles else None,
+        })
+    return sorted(lignes, key=lambda ligne: ligne['p95_ms'], reverse=True)
+
+
+def pires_requetes():
+    """Requêtes SQL les plus lentes observées : [{duree_ms, sql, vue}], de la plus lente"""
+    with _verrou:
+        elements = sorted(_pires_requetes, reverse=True)
+    return [
+        {'duree_ms': round(duree * 1000, 2), 'sql': sql, 'vue': vue}
+        for duree, sql, vue in elements
+    ]
+
+
+def vider():
+    _mesures.clear()
+    with _verrou:
+        _pires_requetes.clear()
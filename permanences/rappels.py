@@ -0,0 +1,77 @@
+"""
+Emails de rappel envoyés la veille des permanences.
+
+Les inscriptions à rappeler sont lues en une requête, les messages rendus à
+partir d'un même gabarit et envoyés par lots de RAPPEL_TAILLE_LOT sur une
+seule connexion SMTP (send_messages). Chaque lot envoyé est marqué
+(Inscription.rappel_envoye_le) : relancer l'envoi ne renvoie rien, et une
+interruption ne fait renvoyer au plus qu'un lot.
+"""
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Inscription
+
+
+GABARIT = 'permanences/email/rappel.txt'
+
+
+def inscriptions_a_rappeler(jour):
+    """Inscriptions actives aux créneaux ouverts de `jour`, sans rappel envoyé, des membres ayant un email"""
+    return (Inscription.objects
+        .filter(creneau__date=jour, creneau__actif=True, annulee=False, rappel_envoye_le__isnull=True)
+        .exclude(utilisateur__email='')
+        .select_related('utilisateur', 'creneau')
+        .only(
+            'commentaire', 'utilisateur__username', 'utilisateur__first_name', 'utilisateur__email',
+            'creneau__date', 'creneau__heure_debut', 'creneau__heure_fin'
+        )
+        .order_by('creneau__heure_debut', 'pk'))
+
+
+def message_rappel(inscription, gabarit=None):
+    """EmailMessage de rappel d'une inscription (utilisateur et creneau chargés)"""
+    gabarit = gabarit or get_template(GABARIT)
+    creneau = inscription.creneau
+    corps = gabarit.render({
+        'membre': inscription.utilisateur,
+        'creneau': creneau,
+        'inscription': inscription,
+        'lien': settings.SITE_URL.rstrip('/') + reverse('permanences:mes_inscriptions'),
+    })
+    return EmailMessage(
+        f"Rappel : permanence du {creneau.date:%d/%m/%Y} à {creneau.heure_debut:%H:%M}",
+        corps,
+        None,
+        [inscription.utilisateur.email]
+    )
+
+
+def envoyer_rappels(jour, taille_lot=None, connexion=None):
+    """
+    Envoie les rappels des permanences de `jour` ; retourne {'envoyes', 'lots'}.
+
+    Une seule connexion est ouverte pour tous les lots ; une erreur d'envoi
+    interrompt l'opération, les lots déjà envoyés restant marqués.
+    """
+    taille_lot = taille_lot or settings.RAPPEL_TAILLE_LOT
+    inscriptions = list(inscriptions_a_rappeler(jour))
+    resultat = {'envoyes': 0, 'lots': 0}
+    if not inscriptions:
+        return resultat
+
+    gabarit = get_template(GABARIT)
+    connexion = connexion or get_connection()
+    with connexion:
+        for debut in range(0, len(inscriptions), taille_lot):
+            lot = inscriptions[debut:debut + taille_lot]
+            connexion.send_messages([message_rappel(inscription, gabarit) for inscription in lot])
+            Inscription.objects.filter(pk__in=[inscription.pk for inscription in lot]).update(
+                rappel_envoye_le=timezone.now()
+            )
+            resultat['envoyes'] += len(lot)
+            resultat['lots'] += 1
+    return resultat
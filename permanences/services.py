@@ -0,0 +1,368 @@
+"""
+Service d'inscription aux créneaux.
+
+Toutes les inscriptions, réactivations et annulations passent par ce module
+afin que la vérification de capacité et l'écriture soient atomiques, et que
+le compteur dénormalisé `CreneauHoraire.nb_inscrits` et les statistiques
+mensuelles des membres restent exacts. Une place libérée par une annulation
+est attribuée, dans la même transaction, au premier de la liste d'attente.
+"""
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import diffusion
+from .generation import materialiser_creneaux
+from .statistiques import enregistrer_changement, enregistrer_changements
+from .models import Attente, CreneauHoraire, Inscription
+
+
+# SQLite ignore select_for_update : les écritures concurrentes d'un même
+# processus sont donc sérialisées par ce verrou. Entre processus, la mise à
+# jour conditionnelle du compteur suffit (SQLite n'a qu'un seul écrivain).
+_verrou_sqlite = threading.Lock()
+
+# Envoyé après la validation de la transaction quand une place libérée est
+# attribuée au premier de la liste d'attente (argument : inscription)
+place_attribuee = Signal()
+
+
+@contextmanager
+def _section_critique():
+    if connection.vendor == 'sqlite':
+        with _verrou_sqlite:
+            yield
+    else:
+        yield
+
+
+def _reserver_place(creneau_id):
+    """Incrémente le compteur si une place est libre. Retourne False si le créneau est complet."""
+    return CreneauHoraire.objects.filter(
+        pk=creneau_id,
+        nb_inscrits__lt=F('max_personnes')
+    ).update(nb_inscrits=F('nb_inscrits') + 1, modifie_le=timezone.now()) == 1
+
+
+def _liberer_place(creneau_id):
+    CreneauHoraire.objects.filter(
+        pk=creneau_id,
+        nb_inscrits__gt=0
+    ).update(nb_inscrits=F('nb_inscrits') - 1, modifie_le=timezone.now())
+
+
+def recalculer_compteurs(creneaux=None):
+    """
+    Recalcule `nb_inscrits` depuis la table des inscriptions, en une requête.
+
+    `creneaux` est un queryset ou une liste d'IDs ; par défaut tous les créneaux.
+    Retourne le nombre de créneaux mis à jour.
+    """
+    actives = (Inscription.objects
+        .filter(creneau=OuterRef('pk'), annulee=False)
+        .order_by()
+        .values('creneau')
+        .annotate(total=Count('pk'))
+        .values('total'))
+    if creneaux is None:
+        cibles = CreneauHoraire.objects.all()
+    elif isinstance(creneaux, (list, tuple, set)):
+        cibles = CreneauHoraire.objects.filter(pk__in=creneaux)
+    else:
+        cibles = creneaux
+    return cibles.update(
+        nb_inscrits=Coalesce(Subquery(actives), 0),
+        modifie_le=timezone.now()
+    )
+
+
+def _controler(utilisateur, creneau):
+    """Contrôles d'une inscription hors capacité ; retourne l'inscription annulée existante ou None"""
+    if not creneau.actif:
+        raise ValidationError("Ce créneau n'est pas ouvert aux inscriptions")
+    if creneau.est_passe:
+        raise ValidationError("Impossible de s'inscrire à un créneau passé")
+
+    inscription = Inscription.objects.filter(
+        utilisateur=utilisateur,
+        creneau=creneau
+    ).first()
+    if inscription and not inscription.annulee:
+        raise ValidationError(f"{utilisateur.username} est déjà inscrit à ce créneau")
+    return inscription
+
+
+def verifier_inscription(utilisateur, creneau):
+    """
+    Contrôles de inscrire() sans rien réserver, pour valider un formulaire.
+
+    La place peut encore être prise avant l'enregistrement : seul inscrire()
+    la réserve. Lève ValidationError avec les mêmes messages.
+    """
+    _controler(utilisateur, creneau)
+    if creneau.nb_inscrits >= creneau.max_personnes:
+        raise ValidationError("Ce créneau est complet")
+
+
+def _inscrire(utilisateur, creneau, commentaire=''):
+    """Corps de inscrire(), dans la section critique et la transaction de l'appelant"""
+    creneau = CreneauHoraire.objects.select_for_update().get(pk=creneau.pk)
+    inscription = _controler(utilisateur, creneau)
+
+    if not _reserver_place(creneau.pk):
+        raise ValidationError("Ce créneau est complet")
+    transaction.on_commit(partial(diffusion.publier, creneau.date))
+
+    if inscription:
+        enregistrer_changement(
+            utilisateur.pk, creneau, (True, inscription.date_annulation), (False, None)
+        )
+        inscription.annulee = False
+        inscription.date_annulation = None
+        # Nouvelle inscription : le rappel envoyé avant l'annulation ne compte plus
+        inscription.rappel_envoye_le = None
+        if commentaire:
+            inscription.commentaire = commentaire
+        inscription.save()
+        return inscription, False
+
+    inscription = Inscription.objects.create(
+        utilisateur=utilisateur,
+        creneau=creneau,
+        commentaire=commentaire
+    )
+    enregistrer_changement(utilisateur.pk, creneau, apres=(False, None))
+    return inscription, True
+
+
+def inscrire(utilisateur, creneau, commentaire=''):
+    """
+    Inscrit (ou réinscrit) un utilisateur à un créneau.
+
+    Retourne un tuple (inscription, creee) ; `creee` vaut False quand une
+    inscription annulée a été réactivée. Lève ValidationError si le créneau
+    est inactif, passé, complet ou si l'utilisateur y est déjà inscrit.
+    """
+    with _section_critique(), transaction.atomic():
+        return _inscrire(utilisateur, creneau, commentaire)
+
+
+# Résultats d'une inscription en série, par créneau
+INSCRIT = 'inscrit'
+REACTIVE = 'reactive'
+DEJA_INSCRIT = 'deja_inscrit'
+COMPLET = 'complet'
+PASSE = 'passe'
+INACTIF = 'inactif'
+
+LIBELLES_RESULTAT = {
+    INSCRIT: "Inscrit",
+    REACTIVE: "Inscription réactivée",
+    DEJA_INSCRIT: "Déjà inscrit",
+    COMPLET: "Complet",
+    PASSE: "Créneau passé",
+    INACTIF: "Créneau fermé",
+}
+
+
+def inscrire_plusieurs(utilisateur, creneaux, commentaire=''):
+    """
+    Inscrit un utilisateur à tous les créneaux du queryset `creneaux`, en une transaction.
+
+    Les créneaux sont vérifiés en une requête (avec l'éventuelle inscription
+    existante de l'utilisateur), les nouvelles inscriptions sont créées par
+    bulk_create et les compteurs mis à jour par une seule requête. Un créneau
+    refusé n'empêche pas les autres. Retourne [(creneau, résultat)] dans l'ordre
+    du planning, le résultat étant l'une des constantes INSCRIT, REACTIVE, ...
+    """
+    existante = Inscription.objects.filter(utilisateur=utilisateur, creneau=OuterRef('pk'))
+    maintenant = timezone.now()
+    with _section_critique(), transaction.atomic():
+        creneaux = list(creneaux
+            .select_for_update()
+            .annotate(
+                inscription_id=Subquery(existante.values('pk')[:1]),
+                inscription_annulee=Subquery(existante.values('annulee')[:1]),
+                inscription_date_annulation=Subquery(existante.values('date_annulation')[:1]),
+            )
+            .order_by('date', 'heure_debut'))
+
+        resultats = []
+        for creneau in creneaux:
+            if not creneau.actif:
+                resultat = INACTIF
+            elif creneau.est_passe:
+                resultat = PASSE
+            elif creneau.inscription_id and not creneau.inscription_annulee:
+                resultat = DEJA_INSCRIT
+            elif creneau.complet:
+                resultat = COMPLET
+            else:
+                resultat = REACTIVE if creneau.inscription_id else INSCRIT
+            resultats.append((creneau, resultat))
+
+        reserves = [creneau for creneau, resultat in resultats if resultat in (INSCRIT, REACTIVE)]
+        if not reserves:
+            return resultats
+
+        # Mise à jour conditionnelle, comme _reserver_place : le verrou ne vaut
+        # que dans ce processus. Si un autre worker a pris une place entre la
+        # lecture et la mise à jour, les créneaux sont repris un par un
+        point = transaction.savepoint()
+        reservees = CreneauHoraire.objects.filter(
+            pk__in=[creneau.pk for creneau in reserves],
+            nb_inscrits__lt=F('max_personnes')
+        ).update(nb_inscrits=F('nb_inscrits') + 1, modifie_le=maintenant)
+        if reservees == len(reserves):
+            transaction.savepoint_commit(point)
+        else:
+            transaction.savepoint_rollback(point)
+            perdus = {creneau.pk for creneau in reserves if not _reserver_place(creneau.pk)}
+            resultats = [
+                (creneau, COMPLET if creneau.pk in perdus else resultat)
+                for creneau, resultat in resultats
+            ]
+            reserves = [creneau for creneau in reserves if creneau.pk not in perdus]
+            if not reserves:
+                return resultats
+
+        Inscription.objects.bulk_create([
+            Inscription(utilisateur=utilisateur, creneau=creneau, commentaire=commentaire)
+            for creneau, resultat in resultats if resultat == INSCRIT
+        ])
+        reactivees = [creneau.inscription_id for creneau, resultat in resultats if resultat == REACTIVE]
+        if reactivees:
+            champs = {'annulee': False, 'date_annulation': None, 'rappel_envoye_le': None}
+            if commentaire:
+                champs['commentaire'] = commentaire
+            Inscription.objects.filter(pk__in=reactivees).update(**champs)
+
+        enregistrer_changements(utilisateur.pk, [
+            (creneau, (True, creneau.inscription_date_annulation) if creneau.inscription_id else None, (False, None))
+            for creneau in reserves
+        ])
+        for date in sorted({creneau.date for creneau in reserves}):
+            transaction.on_commit(partial(diffusion.publier, date))
+    return resultats
+
+
+def inscrire_en_serie(utilisateur, date_debut, date_fin, jours, heure_debut, heure_fin, commentaire=''):
+    """
+    Inscrit un utilisateur à tous les créneaux compris entre `heure_debut` et
+    `heure_fin`, les `jours` de la semaine (0 = lundi) de date_debut à date_fin.
+
+    Les créneaux des horaires récurrents sont d'abord matérialisés.
+    Retourne le rapport de inscrire_plusieurs.
+    """
+    materialiser_creneaux(date_debut, date_fin)
+    creneaux = CreneauHoraire.objects.filter(
+        date__range=(date_debut, date_fin),
+        date__iso_week_day__in=[jour + 1 for jour in jours],
+        heure_debut__gte=heure_debut,
+        heure_fin__lte=heure_fin
+    )
+    return inscrire_plusieurs(utilisateur, creneaux, commentaire)
+
+
+def _promouvoir(creneau_id):
+    """Attribue la place libérée au premier de la liste d'attente ; retourne l'inscription ou None"""
+    file = (Attente.objects
+        .select_for_update(of=('self',))
+        .select_related('utilisateur', 'creneau')
+        .filter(creneau_id=creneau_id)
+        .order_by('date_demande', 'id'))
+    while True:
+        attente = file.first()
+        if attente is None:
+            return None
+        try:
+            inscription, _ = _inscrire(attente.utilisateur, attente.creneau)
+        except ValidationError:
+            creneau = CreneauHoraire.objects.get(pk=creneau_id)
+            if creneau.complet or creneau.est_passe or not creneau.actif:
+                # Pas de place à attribuer : la file reste en l'état
+                return None
+            # Membre déjà inscrit entre-temps : il sort de la file
+            attente.delete()
+            continue
+        attente.delete()
+        transaction.on_commit(partial(place_attribuee.send, sender=Inscription, inscription=inscription))
+        return inscription
+
+
+def desinscrire(inscription):
+    """Annule une inscription active et libère sa place. Sans effet si elle est déjà annulée."""
+    maintenant = timezone.now()
+    with _section_critique(), transaction.atomic():
+        annulee = Inscription.objects.filter(
+            pk=inscription.pk,
+            annulee=False
+        ).update(annulee=True, date_annulation=maintenant)
+        if annulee:
+            _liberer_place(inscription.creneau_id)
+            enregistrer_changement(
+                inscription.utilisateur_id, inscription.creneau, (False, None), (True, maintenant)
+            )
+            _promouvoir(inscription.creneau_id)
+            transaction.on_commit(partial(diffusion.publier, inscription.creneau.date))
+    if annulee:
+        inscription.annulee = True
+        inscription.date_annulation = maintenant
+    return inscription
+
+
+def _marquer_modifie(creneau_id):
+    """La liste d'attente fait partie de l'affichage du créneau (version du calendrier)"""
+    CreneauHoraire.objects.filter(pk=creneau_id).update(modifie_le=timezone.now())
+
+
+def rejoindre_attente(utilisateur, creneau):
+    """
+    Inscrit un membre sur la liste d'attente d'un créneau complet.
+
+    Retourne sa position dans la file. Lève ValidationError si le créneau est
+    inactif, passé, s'il reste des places ou si le membre y est déjà inscrit.
+    """
+    with _section_critique(), transaction.atomic():
+        creneau = CreneauHoraire.objects.select_for_update().get(pk=creneau.pk)
+        if not creneau.actif or creneau.est_passe:
+            raise ValidationError("Ce créneau n'est pas ouvert aux inscriptions")
+        if Inscription.objects.filter(utilisateur=utilisateur, creneau=creneau, annulee=False).exists():
+            raise ValidationError(f"{utilisateur.username} est déjà inscrit à ce créneau")
+        if not creneau.complet:
+            raise ValidationError("Il reste des places : inscrivez-vous directement")
+        attente, creee = Attente.objects.get_or_create(utilisateur=utilisateur, creneau=creneau)
+        if creee:
+            _marquer_modifie(creneau.pk)
+        return avec_position(Attente.objects.filter(pk=attente.pk)).get().position
+
+
+def quitter_attente(utilisateur, creneau):
+    """Retire un membre de la liste d'attente d'un créneau. Retourne False s'il n'y était pas."""
+    with transaction.atomic():
+        supprimees, _ = Attente.objects.filter(utilisateur=utilisateur, creneau=creneau).delete()
+        if supprimees:
+            _marquer_modifie(creneau.pk)
+    return bool(supprimees)
+
+
+def avec_position(attentes):
+    """Annote chaque demande de sa position dans la file de son créneau (1 = la prochaine servie)"""
+    devant = (Attente.objects
+        .filter(creneau=OuterRef('creneau'))
+        .filter(
+            Q(date_demande__lt=OuterRef('date_demande')) |
+            Q(date_demande=OuterRef('date_demande'), pk__lt=OuterRef('pk'))
+        )
+        .order_by()
+        .values('creneau')
+        .annotate(total=Count('pk'))
+        .values('total'))
+    return attentes.annotate(position=Coalesce(Subquery(devant), 0) + 1)
@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import diffusion
+from .generation import invalider_planning
+from .middleware import marquer_session
+from .statistiques import enregistrer_changement
+from .models import CreneauHoraire, FermetureExceptionnelle, HoraireRecurrent, Inscription
+from .services import _promouvoir, place_attribuee
+
+
+_compteurs_suspendus = ContextVar('compteurs_suspendus', default=False)
+
+# Champs du membre affichés dans le calendrier (mis en cache avec les créneaux)
+CHAMPS_AFFICHES = {'username', 'first_name'}
+
+
+@contextmanager
+def compteurs_suspendus():
+    """Pour archiver des inscriptions : les compteurs et les statistiques ne sont pas touchés"""
+    jeton = _compteurs_suspendus.set(True)
+    try:
+        yield
+    finally:
+        _compteurs_suspendus.reset(jeton)
+
+
+@receiver(post_delete, sender=Inscription)
+def liberer_place_inscription_supprimee(sender, instance, **kwargs):
+    """
+    Une inscription supprimée (admin, suppression d'utilisateur...) libère sa
+    place, la donne au premier de la liste d'attente et sort des statistiques.
+    """
+    if _compteurs_suspendus.get():
+        return
+    if not instance.annulee:
+        CreneauHoraire.objects.filter(
+            pk=instance.creneau_id,
+            nb_inscrits__gt=0
+        ).update(nb_inscrits=F('nb_inscrits') - 1, modifie_le=timezone.now())
+    creneau = CreneauHoraire.objects.filter(pk=instance.creneau_id).first()
+    if creneau is None:
+        return
+    enregistrer_changement(
+        instance.utilisateur_id, creneau, (instance.annulee, instance.date_annulation)
+    )
+    if not instance.annulee:
+        # Place libérée : attribuée au premier de la liste d'attente, dans la
+        # transaction de la suppression. La section critique n'est pas prise
+        # (les services la prennent avant leur transaction) : la mise à jour
+        # conditionnelle du compteur suffit. Les demandes d'un membre supprimé
+        # sont effacées avant ses inscriptions (suppression directe, sans signal).
+        _promouvoir(creneau.pk)
+        transaction.on_commit(partial(diffusion.publier, creneau.date))
+
+
+@receiver([post_save, post_delete], sender=HoraireRecurrent)
+@receiver([post_save, post_delete], sender=FermetureExceptionnelle)
+def planning_modifie(sender, **kwargs):
+    """Les semaines déjà matérialisées devront être réexaminées"""
+    invalider_planning()
+
+
+@receiver(post_save, sender=User)
+def membre_modifie(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Le nom des inscrits est mis en cache avec les créneaux : ceux où le membre
+    est inscrit changent de version. Les enregistrements partiels qui ne
+    touchent pas ces champs (last_login à la connexion) sont ignorés.
+    """
+    if created or (update_fields is not None and not CHAMPS_AFFICHES & set(update_fields)):
+        return
+    CreneauHoraire.objects.filter(
+        inscriptions__utilisateur=instance,
+        inscriptions__annulee=False
+    ).update(modifie_le=timezone.now())
+
+
+@receiver(user_logged_in)
+def session_ouverte(sender, request, **kwargs):
+    """La session vient d'être enregistrée : inutile de la prolonger avant la fraction"""
+    if request is not None and hasattr(request, 'session'):
+        marquer_session(request.session)
+
+
+@receiver(place_attribuee)
+def prevenir_place_attribuee(sender, inscription, **kwargs):
+    """Prévient par email le membre de la liste d'attente inscrit sur une place libérée (LISTE_ATTENTE_EMAIL)"""
+    membre = inscription.utilisateur
+    if not settings.LISTE_ATTENTE_EMAIL or not membre.email:
+        return
+    creneau = inscription.creneau
+    send_mail(
+        "Une place s'est libérée : vous êtes inscrit",
+        f"Bonjour {membre.first_name or membre.username},\n\n"
+        f"Une place s'est libérée et vous êtes désormais inscrit à la permanence du "
+        f"{creneau.date:%d/%m/%Y} de {creneau.heure_debut:%H:%M} à {creneau.heure_fin:%H:%M}.\n"
+        f"Si vous n'êtes plus disponible, pensez à annuler votre inscription.",
+        None,
+        [membre.email],
+        fail_silently=True
+    )
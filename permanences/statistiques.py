@@ -0,0 +1,176 @@
+"""
+Statistiques d'activité des membres, par mois.
+
+StatistiqueMensuelle est tenue à jour au fil des inscriptions, annulations
+et suppressions (enregistrer_changement) : le profil et le classement lisent
+des lignes précalculées au lieu de parcourir la table des inscriptions.
+recalculer_statistiques reconstruit la table depuis les inscriptions et les
+archives mensuelles.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ArchiveMensuelle, Inscription, StatistiqueMensuelle
+
+
+CHAMPS = ('creneaux', 'minutes', 'annulations', 'annulations_tardives')
+
+TAILLE_LOT = 2000
+
+
+def duree_minutes(heure_debut, heure_fin):
+    """Durée d'un créneau en minutes"""
+    jour = datetime.min.date()
+    return int((datetime.combine(jour, heure_fin) - datetime.combine(jour, heure_debut)).total_seconds() // 60)
+
+
+def est_tardive(date, heure_debut, date_annulation):
+    """Annulation faite moins de ANNULATION_TARDIVE_HEURES avant le début du créneau"""
+    if date_annulation is None:
+        return False
+    debut = timezone.make_aware(datetime.combine(date, heure_debut))
+    return debut - date_annulation < timedelta(hours=settings.ANNULATION_TARDIVE_HEURES)
+
+
+def contribution(creneau, annulee, date_annulation):
+    """Compteurs apportés par une inscription dans cet état : {champ: valeur}"""
+    if annulee:
+        return {
+            'annulations': 1,
+            'annulations_tardives': int(est_tardive(creneau.date, creneau.heure_debut, date_annulation)),
+        }
+    return {'creneaux': 1, 'minutes': duree_minutes(creneau.heure_debut, creneau.heure_fin)}
+
+
+def enregistrer_changement(utilisateur_id, creneau, avant=None, apres=None):
+    """
+    Reporte le passage d'une inscription de l'état `avant` à `apres`.
+
+    Un état est un tuple (annulee, date_annulation) ; None pour une inscription
+    inexistante (création, suppression).
+    """
+    enregistrer_changements(utilisateur_id, [(creneau, avant, apres)])
+
+
+def enregistrer_changements(utilisateur_id, changements):
+    """Comme enregistrer_changement pour une liste de (creneau, avant, apres) : une mise à jour par mois"""
+    par_mois = defaultdict(lambda: dict.fromkeys(CHAMPS, 0))
+    for creneau, avant, apres in changements:
+        ecarts = par_mois[creneau.date.replace(day=1)]
+        for etat, signe in ((avant, -1), (apres, 1)):
+            if etat is not None:
+                for champ, valeur in contribution(creneau, *etat).items():
+                    ecarts[champ] += signe * valeur
+    for mois, ecarts in par_mois.items():
+        _appliquer(utilisateur_id, mois, {champ: ecart for champ, ecart in ecarts.items() if ecart})
+
+
+def _appliquer(utilisateur_id, mois, ecarts):
+    if not ecarts:
+        return
+    lignes = StatistiqueMensuelle.objects.filter(utilisateur_id=utilisateur_id, mois=mois)
+    # Greatest : une table pas encore recalculée ne doit pas passer sous zéro
+    if lignes.update(**{champ: Greatest(F(champ) + ecart, 0) for champ, ecart in ecarts.items()}):
+        return
+    if all(ecart < 0 for ecart in ecarts.values()):
+        # Rien à retirer (suppression d'un membre en cours, table pas encore recalculée)
+        return
+    try:
+        with transaction.atomic():
+            StatistiqueMensuelle.objects.create(
+                utilisateur_id=utilisateur_id, mois=mois,
+                **{champ: max(ecart, 0) for champ, ecart in ecarts.items()}
+            )
+    except IntegrityError:
+        # Ligne créée entre-temps par une autre requête
+        lignes.update(**{champ: Greatest(F(champ) + ecart, 0) for champ, ecart in ecarts.items()})
+
+
+def calculer_statistiques(utilisateurs=None):
+    """
+    Statistiques attendues d'après les inscriptions et les archives mensuelles :
+    {(utilisateur_id, mois): {champ: valeur}}, pour tous les membres ou les IDs `utilisateurs`.
+    """
+    totaux = defaultdict(lambda: dict.fromkeys(CHAMPS, 0))
+
+    inscriptions = Inscription.objects.order_by().values_list(
+        'utilisateur_id', 'creneau__date', 'creneau__heure_debut', 'creneau__heure_fin',
+        'annulee', 'date_annulation'
+    )
+    archives = ArchiveMensuelle.objects.all()
+    if utilisateurs is not None:
+        inscriptions = inscriptions.filter(utilisateur_id__in=utilisateurs)
+        archives = archives.filter(utilisateur_id__in=utilisateurs)
+
+    for utilisateur_id, date, heure_debut, heure_fin, annulee, date_annulation in inscriptions.iterator(TAILLE_LOT):
+        ligne = totaux[utilisateur_id, date.replace(day=1)]
+        if annulee:
+            ligne['annulations'] += 1
+            ligne['annulations_tardives'] += est_tardive(date, heure_debut, date_annulation)
+        else:
+            ligne['creneaux'] += 1
+            ligne['minutes'] += duree_minutes(heure_debut, heure_fin)
+    for archive in archives:
+        ligne = totaux[archive.utilisateur_id, archive.mois]
+        ligne['creneaux'] += archive.inscriptions - archive.annulations
+        ligne['minutes'] += archive.minutes
+        ligne['annulations'] += archive.annulations
+        ligne['annulations_tardives'] += archive.annulations_tardives
+    return totaux
+
+
+def recalculer_statistiques(utilisateurs=None):
+    """
+    Reconstruit les statistiques (de tous les membres, ou des IDs `utilisateurs`).
+    Retourne le nombre de lignes.
+    """
+    totaux = calculer_statistiques(utilisateurs)
+    with transaction.atomic():
+        existantes = StatistiqueMensuelle.objects.all()
+        if utilisateurs is not None:
+            existantes = existantes.filter(utilisateur_id__in=utilisateurs)
+        existantes.delete()
+        StatistiqueMensuelle.objects.bulk_create(
+            [
+                StatistiqueMensuelle(utilisateur_id=utilisateur_id, mois=mois, **compteurs)
+                for (utilisateur_id, mois), compteurs in totaux.items()
+            ],
+            batch_size=TAILLE_LOT
+        )
+    return len(totaux)
+
+
+def totaux_membre(utilisateur):
+    """Inscriptions d'un membre, archives comprises : {'totales', 'actives', 'minutes'}"""
+    totaux = utilisateur.statistiques_mensuelles.aggregate(
+        creneaux=Sum('creneaux', default=0),
+        annulations=Sum('annulations', default=0),
+        minutes=Sum('minutes', default=0)
+    )
+    return {
+        'totales': totaux['creneaux'] + totaux['annulations'],
+        'actives': totaux['creneaux'],
+        'minutes': totaux['minutes'],
+    }
+
+
+def classement(debut, fin, limite=50):
+    """Membres classés par temps de présence sur les mois de [debut, fin]"""
+    return list(
+        StatistiqueMensuelle.objects
+        .filter(mois__range=(debut.replace(day=1), fin))
+        .values('utilisateur_id', 'utilisateur__username', 'utilisateur__first_name', 'utilisateur__last_name')
+        .annotate(
+            creneaux=Sum('creneaux'),
+            minutes=Sum('minutes'),
+            annulations=Sum('annulations'),
+            annulations_tardives=Sum('annulations_tardives')
+        )
+        .order_by('-minutes', '-creneaux', 'utilisateur__username')[:limite]
+    )
@@ -1,3 +1,1437 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, time, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmark, diffusion, ics, perf, rappels, services
+from .archivage import archiver
+from .cache_calendrier import statistiques_cache
+from .donnees_charge import generer_donnees
+from .generation import generer_creneaux, materialiser_creneaux
+from .import_membres import importer_membres
+from .middleware import CLE_RAFRAICHISSEMENT
+from .models import (
+    ArchiveMensuelle, Attente, CreneauHoraire, FermetureExceptionnelle, HoraireRecurrent, Inscription,
+    JetonCalendrier, StatistiqueMensuelle
+)
+from .statistiques import calculer_statistiques, recalculer_statistiques, totaux_membre
+
+
+def lundi_prochain():
+    today = timezone.localdate()
+    return today - timedelta(days=today.weekday()) + timedelta(days=7)
+
+
+def creer_creneaux(week_start, nombre, max_personnes=3):
+    """Crée `nombre` créneaux répartis sur la semaine (pas de 10 minutes)"""
+    creneaux = []
+    for i in range(nombre):
+        jour = week_start + timedelta(days=i % 7)
+        rang = i // 7
+        debut = time(8 + rang // 6, (rang % 6) * 10)
+        fin = (datetime.combine(jour, debut) + timedelta(hours=1)).time()
+        creneaux.append(CreneauHoraire.objects.create(
+            date=jour, heure_debut=debut, heure_fin=fin, max_personnes=max_personnes
+        ))
+    return creneaux
+
+
+class CalendrierRequetesTests(TestCase):
+    """Le calendrier doit se construire en un nombre fixe de requêtes"""
+
+    def setUp(self):
+        cache.clear()
+        self.membres = [
+            User.objects.create_user(username=f'membre{i}', password='motdepasse123')
+            for i in range(3)
+        ]
+        self.user = self.membres[0]
+
+    def _nb_requetes(self, nombre_creneaux, week_start):
+        creneaux = creer_creneaux(week_start, nombre_creneaux)
+        for creneau in creneaux:
+            for membre in self.membres[:2]:
+                services.inscrire(membre, creneau)
+            Inscription.objects.create(
+                utilisateur=self.membres[2], creneau=creneau,
+                annulee=True, date_annulation=timezone.now()
+            )
+        self.client.force_login(self.user)
+        url = reverse('permanences:calendrier') + f'?week={week_start:%Y-%m-%d}'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_nombre_requetes_constant(self):
+        semaine = lundi_prochain()
+        petit, _ = self._nb_requetes(10, semaine)
+        grand, response = self._nb_requetes(200, semaine + timedelta(days=7))
+        self.assertEqual(petit, grand)
+        self.assertContains(response, '2/3 inscrits')
+
+    def test_inscription_utilisateur_depuis_prefetch(self):
+        semaine = lundi_prochain()
+        creneau = creer_creneaux(semaine, 1)[0]
+        inscription, _ = services.inscrire(self.user, creneau)
+        creneau = CreneauHoraire.objects.prefetch_related('inscriptions').get(pk=creneau.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(creneau.get_user_inscription(self.user), inscription)
+            self.assertEqual(creneau.nb_inscrits_actifs, 1)
+            self.assertEqual(creneau.places_disponibles, 2)
+            self.assertFalse(creneau.complet)
+
+
+class GestionInscriptionsTests(TestCase):
+    """La page de gestion ne doit pas répéter la liste des utilisateurs par créneau"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        User.objects.bulk_create([User(username=f'membre{i:03d}') for i in range(100)])
+        self.semaine = lundi_prochain()
+        creneaux = creer_creneaux(self.semaine, 30)
+        membre = User.objects.get(username='membre000')
+        services.inscrire(membre, creneaux[0])
+
+    def test_liste_utilisateurs_rendue_une_fois(self):
+        self.client.force_login(self.admin)
+        url = reverse('permanences:gestion') + f'?week={self.semaine:%Y-%m-%d}'
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertLessEqual(len(ctx.captured_queries), 9)
+        contenu = response.content.decode()
+        self.assertEqual(contenu.count('"username": "membre042"'), 1)
+        self.assertNotIn('<option value="%d"' % User.objects.get(username='membre042').pk, contenu)
+        self.assertIn('data-inscrits="%d"' % User.objects.get(username='membre000').pk, contenu)
+
+
+class ServiceInscriptionTests(TestCase):
+
+    def setUp(self):
+        self.creneau = creer_creneaux(lundi_prochain(), 1, max_personnes=2)[0]
+        self.membres = [User.objects.create_user(username=f'membre{i}') for i in range(3)]
+
+    def test_capacite_et_compteur(self):
+        services.inscrire(self.membres[0], self.creneau)
+        services.inscrire(self.membres[1], self.creneau)
+        with self.assertRaisesMessage(ValidationError, 'complet'):
+            services.inscrire(self.membres[2], self.creneau)
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 2)
+
+    def test_annulation_puis_reactivation(self):
+        inscription, creee = services.inscrire(self.membres[0], self.creneau)
+        self.assertTrue(creee)
+        inscription.annuler()
+        inscription.annuler()
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 0)
+        reactivee, creee = services.inscrire(self.membres[0], self.creneau)
+        self.assertFalse(creee)
+        self.assertEqual(reactivee.pk, inscription.pk)
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+
+    def test_double_inscription_refusee(self):
+        services.inscrire(self.membres[0], self.creneau)
+        with self.assertRaisesMessage(ValidationError, 'déjà inscrit'):
+            services.inscrire(self.membres[0], self.creneau)
+
+    def test_creneau_passe_refuse(self):
+        hier = timezone.localdate() - timedelta(days=1)
+        passe = CreneauHoraire.objects.create(date=hier, heure_debut=time(9), heure_fin=time(10))
+        with self.assertRaisesMessage(ValidationError, 'passé'):
+            services.inscrire(self.membres[0], passe)
+
+
+class InscriptionsConcurrentesTests(TransactionTestCase):
+    """Des inscriptions simultanées ne doivent jamais dépasser la capacité"""
+
+    def test_capacite_jamais_depassee(self):
+        creneau = creer_creneaux(lundi_prochain(), 1, max_personnes=3)[0]
+        membres = User.objects.bulk_create([User(username=f'membre{i}') for i in range(20)])
+        depart = threading.Barrier(len(membres))
+        resultats = []
+
+        def inscrire(membre):
+            try:
+                depart.wait()
+                services.inscrire(membre, creneau)
+                resultats.append('ok')
+            except ValidationError:
+                resultats.append('refus')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=inscrire, args=(membre,)) for membre in membres]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        creneau.refresh_from_db()
+        actives = Inscription.objects.filter(creneau=creneau, annulee=False).count()
+        self.assertEqual(resultats.count('ok'), 3)
+        self.assertEqual(resultats.count('refus'), len(membres) - 3)
+        self.assertEqual(actives, 3)
+        self.assertEqual(creneau.nb_inscrits, 3)
+
+
+class CompteurInscritsTests(TestCase):
+
+    def setUp(self):
+        self.creneau = creer_creneaux(lundi_prochain(), 1)[0]
+        self.membre = User.objects.create_user(username='membre')
+
+    def test_suppression_libere_la_place(self):
+        inscription, _ = services.inscrire(self.membre, self.creneau)
+        inscription.delete()
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 0)
+
+    def test_commande_recalcul(self):
+        Inscription.objects.create(utilisateur=self.membre, creneau=self.creneau)
+        with self.assertRaises(CommandError):
+            call_command('recalculer_compteurs', '--verifier', stdout=StringIO())
+        call_command('recalculer_compteurs', stdout=StringIO())
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+        call_command('recalculer_compteurs', '--verifier', stdout=StringIO())
+
+
+class AdminChangelistTests(TestCase):
+    """Les listes de l'admin se chargent en un nombre constant de requêtes"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.membres = [User.objects.create_user(username=f'membre{i}') for i in range(2)]
+
+    def _nb_requetes(self, url):
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def _peupler(self, semaine, nombre):
+        for creneau in creer_creneaux(semaine, nombre):
+            for membre in self.membres:
+                services.inscrire(membre, creneau)
+
+    def test_changelists_constantes(self):
+        urls = [
+            reverse('admin:permanences_creneauhoraire_changelist'),
+            reverse('admin:permanences_inscription_changelist'),
+        ]
+        semaine = lundi_prochain()
+        self._peupler(semaine, 5)
+        petits = [self._nb_requetes(url) for url in urls]
+        self._peupler(semaine + timedelta(days=7), 60)
+        self.assertEqual(petits, [self._nb_requetes(url) for url in urls])
+
+    def test_tri_sur_occupation(self):
+        creneaux = creer_creneaux(lundi_prochain(), 2)
+        services.inscrire(self.membres[0], creneaux[1])
+        self.client.force_login(self.admin)
+        url = reverse('admin:permanences_creneauhoraire_changelist')
+        for colonne in (7, 8):
+            response = self.client.get(url, {'o': str(colonne)})
+            self.assertEqual(response.status_code, 200)
+
+
+class AdminInscriptionTests(TestCase):
+    """Les inscriptions saisies dans l'admin passent par le service d'inscription"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.membres = [User.objects.create_user(username=f'membre{i}') for i in range(2)]
+        self.creneau = creer_creneaux(lundi_prochain(), 1, max_personnes=1)[0]
+        self.client.force_login(self.admin)
+
+    def _modifier(self, inscription, **champs):
+        donnees = {'utilisateur': inscription.utilisateur_id, 'creneau': inscription.creneau_id, 'commentaire': ''}
+        donnees.update(champs)
+        url = reverse('admin:permanences_inscription_change', args=[inscription.pk])
+        return self.client.post(url, donnees, follow=True)
+
+    def test_reactivation(self):
+        inscription, _ = services.inscrire(self.membres[0], self.creneau)
+        services.desinscrire(inscription)
+        self._modifier(inscription, commentaire='de retour', annulee='on')
+        inscription.refresh_from_db()
+        self.assertTrue(inscription.annulee)
+
+        self._modifier(inscription, commentaire='de retour')
+        inscription.refresh_from_db()
+        self.assertEqual((inscription.annulee, inscription.commentaire), (False, 'de retour'))
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+        self.assertEqual(totaux_membre(self.membres[0])['actives'], 1)
+
+    def test_reactivation_refusee_par_le_service(self):
+        inscription, _ = services.inscrire(self.membres[0], self.creneau)
+        services.desinscrire(inscription)
+        # Créneau fermé : seul le service d'inscription le refuse
+        CreneauHoraire.objects.filter(pk=self.creneau.pk).update(actif=False)
+        self._modifier(inscription)
+        inscription.refresh_from_db()
+        self.assertTrue(inscription.annulee)
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 0)
+
+    def test_changement_vers_un_creneau_complet(self):
+        autre = creer_creneaux(lundi_prochain() + timedelta(days=7), 1, max_personnes=1)[0]
+        inscription, _ = services.inscrire(self.membres[0], self.creneau)
+        # Place réservée par un autre worker dont l'inscription n'est pas encore visible
+        CreneauHoraire.objects.filter(pk=autre.pk).update(nb_inscrits=1)
+        url = reverse('admin:permanences_inscription_change', args=[inscription.pk])
+        donnees = {'utilisateur': self.membres[0].pk, 'creneau': autre.pk, 'commentaire': ''}
+        response = self.client.post(url, donnees)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Ce créneau est complet')
+        # Place encore libre à la validation du formulaire : le service refuse
+        with mock.patch.object(services, 'verifier_inscription'):
+            self.client.post(url, donnees)
+        inscription.refresh_from_db()
+        self.assertEqual((inscription.creneau, inscription.annulee), (self.creneau, False))
+        autre.refresh_from_db()
+        self.assertEqual(autre.nb_inscrits, 1)
+
+    def test_ajout_refuse_dans_le_formulaire(self):
+        services.inscrire(self.membres[0], self.creneau)
+        url = reverse('admin:permanences_inscription_add')
+        response = self.client.post(url, {'utilisateur': self.membres[1].pk, 'creneau': self.creneau.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Ce créneau est complet')
+        self.assertFalse(Inscription.objects.filter(utilisateur=self.membres[1]).exists())
+
+    def test_ajout_sur_place_prise_entre_temps(self):
+        # Place réservée par un autre worker dont l'inscription n'est pas encore visible
+        CreneauHoraire.objects.filter(pk=self.creneau.pk).update(nb_inscrits=1)
+        url = reverse('admin:permanences_inscription_add')
+        # Place encore libre à la validation du formulaire
+        with mock.patch.object(services, 'verifier_inscription'):
+            response = self.client.post(url, {'utilisateur': self.membres[1].pk, 'creneau': self.creneau.pk})
+        self.assertRedirects(response, url)
+        self.assertFalse(Inscription.objects.filter(utilisateur=self.membres[1]).exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+
+class GenerationCreneauxTests(TestCase):
+
+    def test_plage_hebdomadaire_et_doublons(self):
+        debut = lundi_prochain()
+        CreneauHoraire.objects.create(date=debut, heure_debut=time(9), heure_fin=time(10))
+        crees, ignores = generer_creneaux(
+            debut, debut + timedelta(weeks=4), time(9), time(12), jours=[0, 5]
+        )
+        # 5 lundis et 4 samedis, 3 créneaux par jour, dont un déjà existant
+        self.assertEqual((crees, ignores), (26, 1))
+        self.assertEqual(CreneauHoraire.objects.count(), 27)
+        self.assertEqual(generer_creneaux(debut, debut + timedelta(weeks=4), time(9), time(12), jours=[0, 5]), (0, 27))
+
+    def test_duree_configurable(self):
+        jour = lundi_prochain()
+        crees, _ = generer_creneaux(jour, jour, time(9), time(14), duree=timedelta(hours=2))
+        self.assertEqual(crees, 2)
+        self.assertEqual(
+            list(CreneauHoraire.objects.values_list('heure_debut', 'heure_fin')),
+            [(time(9), time(11)), (time(11), time(13))]
+        )
+
+    def test_vue_admin_ajouter_plage(self):
+        admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.client.force_login(admin)
+        url = reverse('admin:permanences_creneauhoraire_ajouter_plage')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        jour = lundi_prochain()
+        response = self.client.post(url, {
+            'date_debut': jour, 'heure_debut': '09:00', 'heure_fin': '12:00',
+            'duree': 60, 'max_personnes': 2, 'repeter': 'on',
+            'date_fin': jour + timedelta(weeks=1), 'jours': ['0', '2'],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CreneauHoraire.objects.filter(max_personnes=2).count(), 9)
+
+
+class HorairesRecurrentsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.semaine = lundi_prochain()
+        HoraireRecurrent.objects.create(
+            jour_semaine=5, heure_ouverture=time(9), heure_fermeture=time(12),
+            max_personnes=4, date_debut=self.semaine
+        )
+        FermetureExceptionnelle.objects.create(date=self.semaine + timedelta(days=12), motif='Férié')
+
+    def test_materialisation_avec_fermeture(self):
+        crees, ignores = materialiser_creneaux(self.semaine, self.semaine + timedelta(days=20))
+        self.assertEqual((crees, ignores), (6, 0))
+        self.assertFalse(CreneauHoraire.objects.filter(date=self.semaine + timedelta(days=12)).exists())
+        self.assertEqual(set(CreneauHoraire.objects.values_list('max_personnes', flat=True)), {4})
+
+    def test_premiere_consultation_de_la_semaine(self):
+        self.client.force_login(User.objects.create_user(username='membre'))
+        url = reverse('permanences:calendrier') + f'?week={self.semaine:%Y-%m-%d}'
+        self.assertContains(self.client.get(url), '0/4 inscrits', count=3)
+        with CaptureQueriesContext(connection) as deuxieme:
+            self.client.get(url)
+        self.assertFalse(any('horairerecurrent' in q['sql'] for q in deuxieme.captured_queries))
+        self.assertEqual(CreneauHoraire.objects.count(), 3)
+        horaire = HoraireRecurrent.objects.get()
+        horaire.heure_fermeture = time(13)
+        horaire.save()
+        self.client.get(url)
+        self.assertEqual(CreneauHoraire.objects.count(), 4)
+
+    def test_creneau_supprime_non_recree(self):
+        url = reverse('permanences:calendrier') + f'?week={self.semaine:%Y-%m-%d}'
+        self.client.force_login(User.objects.create_user(username='membre'))
+        self.client.get(url)
+        CreneauHoraire.objects.filter(heure_debut=time(9)).delete()
+        # Cache de la semaine expiré, ou horaire modifié
+        cache.clear()
+        HoraireRecurrent.objects.update(heure_fermeture=time(13))
+        self.client.get(url)
+        self.assertEqual(
+            sorted(CreneauHoraire.objects.values_list('heure_debut', flat=True)), [time(10), time(11), time(12)]
+        )
+
+    def test_gestion_materialise_la_periode(self):
+        # Trois samedis, dont un fermé
+        self.client.force_login(User.objects.create_superuser(username='admin', password='motdepasse123'))
+        response = self.client.get(
+            reverse('permanences:gestion'), {'week': self.semaine.isoformat(), 'semaines': 3}
+        )
+        self.assertEqual(sum(len(jour) for jour in response.context['creneaux_par_jour'].values()), 6)
+
+    def test_commande_init_demo_data(self):
+        call_command('init_demo_data', stdout=StringIO())
+        self.assertTrue(HoraireRecurrent.objects.filter(jour_semaine=1).exists())
+        self.assertTrue(CreneauHoraire.objects.exists())
+
+
+class CacheCalendrierTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.semaine = lundi_prochain()
+        self.creneau = creer_creneaux(self.semaine, 3)[0]
+        self.membre = User.objects.create_user(username='membre')
+        self.autre = User.objects.create_user(username='autre')
+        self.url = reverse('permanences:calendrier') + f'?week={self.semaine:%Y-%m-%d}'
+        self.client.force_login(self.membre)
+
+    def test_semaine_servie_depuis_le_cache(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertFalse(any('permanences_inscription' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(statistiques_cache(), {'succes': 1, 'echecs': 1})
+
+    def test_inscription_invalide_la_semaine(self):
+        self.client.get(self.url)
+        services.inscrire(self.autre, self.creneau)
+        self.assertContains(self.client.get(self.url), '1/3 inscrits')
+        self.client.post(reverse('permanences:auto_inscription', args=[self.creneau.pk]))
+        response = self.client.get(self.url)
+        self.assertContains(response, '2/3 inscrits')
+        self.assertContains(response, 'fa-check"></i> Inscrit')
+        self.assertEqual(statistiques_cache()['echecs'], 3)
+
+    def test_membre_renomme(self):
+        services.inscrire(self.autre, self.creneau)
+        self.client.get(self.url)
+        self.autre.username = 'camille'
+        self.autre.save()
+        self.assertContains(self.client.get(self.url), 'camille')
+
+    def test_version_sur_les_creneaux_affiches(self):
+        self.client.get(self.url)
+        # Créneau inactif : ni dans la page ni dans la version
+        CreneauHoraire.objects.create(
+            date=self.semaine + timedelta(days=3), heure_debut=time(8), heure_fin=time(9), actif=False
+        )
+        self.client.get(self.url)
+        self.assertEqual(statistiques_cache(), {'succes': 1, 'echecs': 1})
+
+
+class GetConditionnelTests(TestCase):
+
+    def setUp(self):
+        self.semaine = lundi_prochain()
+        self.creneau = creer_creneaux(self.semaine, 3)[0]
+        self.membre = User.objects.create_user(username='membre')
+        self.client.force_login(self.membre)
+
+    def _revalider(self, url, **entetes):
+        premiere = self.client.get(url)
+        self.assertEqual(premiere.status_code, 200)
+        return premiere, self.client.get(url, HTTP_IF_NONE_MATCH=premiere['ETag'], **entetes)
+
+    def test_calendrier_304_puis_200_apres_inscription(self):
+        url = reverse('permanences:calendrier') + f'?week={self.semaine:%Y-%m-%d}'
+        premiere, seconde = self._revalider(url)
+        self.assertEqual(seconde.status_code, 304)
+        services.inscrire(User.objects.create_user(username='autre'), self.creneau)
+        troisieme = self.client.get(url, HTTP_IF_NONE_MATCH=premiere['ETag'])
+        self.assertEqual(troisieme.status_code, 200)
+        self.assertNotEqual(troisieme['ETag'], premiere['ETag'])
+
+    def test_etag_propre_a_l_utilisateur(self):
+        url = reverse('permanences:calendrier') + f'?week={self.semaine:%Y-%m-%d}'
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(User.objects.create_user(username='autre'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_mes_inscriptions(self):
+        url = reverse('permanences:mes_inscriptions')
+        services.inscrire(self.membre, self.creneau)
+        premiere, seconde = self._revalider(url)
+        self.assertEqual(seconde.status_code, 304)
+        services.desinscrire(Inscription.objects.get())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=premiere['ETag']).status_code, 200)
+
+    def test_ajax_places_last_modified(self):
+        url = reverse('permanences:ajax_places', args=[self.creneau.pk])
+        premiere = self.client.get(url)
+        self.assertEqual(premiere.json()['places_disponibles'], 3)
+        seconde = self.client.get(url, HTTP_IF_MODIFIED_SINCE=premiere['Last-Modified'])
+        self.assertEqual(seconde.status_code, 304)
+
+
+class PlacesLotTests(TestCase):
+
+    def setUp(self):
+        self.semaine = lundi_prochain()
+        self.creneaux = creer_creneaux(self.semaine, 20)
+        self.url = reverse('permanences:ajax_places_lot')
+
+    def test_semaine_en_une_requete(self):
+        with CaptureQueriesContext(connection) as ctx:
+            donnees = self.client.get(self.url, {'week': f'{self.semaine:%Y-%m-%d}'}).json()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(len(donnees['creneaux']), 20)
+        self.assertEqual(donnees['creneaux'][0], {
+            'id': self.creneaux[0].pk, 'inscrits': 0, 'max': 3, 'complet': False, 'passe': False,
+        })
+
+    def test_liste_d_ids_et_deltas(self):
+        ids = ','.join(str(c.pk) for c in self.creneaux[:5])
+        donnees = self.client.get(self.url, {'ids': ids}).json()
+        self.assertEqual(len(donnees['creneaux']), 5)
+
+        version = donnees['version'] + 60
+        CreneauHoraire.objects.filter(pk=self.creneaux[0].pk).update(modifie_le=timezone.now() + timedelta(minutes=5))
+        CreneauHoraire.objects.filter(pk=self.creneaux[1].pk).update(actif=False, modifie_le=timezone.now() + timedelta(minutes=5))
+        deltas = self.client.get(self.url, {'ids': ids, 'depuis': version}).json()
+        self.assertEqual([c['id'] for c in deltas['creneaux']], [self.creneaux[0].pk])
+        self.assertEqual(deltas['retires'], [self.creneaux[1].pk])
+
+    def test_parametres_invalides(self):
+        self.assertEqual(self.client.get(self.url, {'ids': 'a,b'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'depuis': 'hier'}).status_code, 400)
+
+
+class FluxPlacesTests(TestCase):
+
+    def setUp(self):
+        self.semaine = lundi_prochain()
+        self.creneau = creer_creneaux(self.semaine, 1)[0]
+        self.membre = User.objects.create_user(username='membre')
+        self.url = reverse('permanences:flux_places') + f'?week={self.semaine:%Y-%m-%d}'
+
+    def test_wsgi_renvoie_au_polling(self):
+        self.client.force_login(self.membre)
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+
+    async def test_changement_pousse_dans_le_flux(self):
+        await self.async_client.aforce_login(self.membre)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        flux = aiter(response.streaming_content)
+        self.assertEqual(await anext(flux), b'retry: 5000\n\n')
+
+        autre = await User.objects.acreate(username='autre')
+        await sync_to_async(services.inscrire)(autre, self.creneau)
+        diffusion.publier(self.semaine)
+        evenement = (await asyncio.wait_for(anext(flux), 5)).decode()
+
+        self.assertTrue(evenement.startswith('event: places\n'))
+        donnees = json.loads(evenement.split('data: ', 1)[1])
+        self.assertEqual(donnees['creneaux'][0]['inscrits'], 1)
+
+
+class ImportMembresTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='AlineL', password='ancien', first_name='Aline')
+        self.dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dossier.cleanup)
+        self.fichier = os.path.join(self.dossier.name, 'membres.csv')
+        with open(self.fichier, 'w', encoding='utf-8') as fichier:
+            fichier.write(
+                'NomPrenom;ID;Password\n'
+                'ADESHINA Magalie;MagalieA;secret01\n'
+                'LEJEUNE Aline;AlineL;secret02\n'
+                'DE LA TOUR Jean Marc;JeanD;secret03\n'
+                'DOUBLON Magalie;MagalieA;secret04\n'
+                'SANS Motdepasse;Vide;\n'
+            )
+
+    def test_import_et_mise_a_jour(self):
+        sortie = StringIO()
+        call_command('import_users', self.fichier, '--processus', '2', stdout=sortie)
+
+        magalie = User.objects.get(username='MagalieA')
+        self.assertTrue(magalie.check_password('secret01'))
+        self.assertEqual((magalie.first_name, magalie.last_name), ('Magalie', 'ADESHINA'))
+        self.assertEqual(User.objects.get(username='JeanD').last_name, 'DE LA TOUR')
+        aline = User.objects.get(username='AlineL')
+        self.assertEqual(aline.last_name, 'LEJEUNE')
+        self.assertTrue(aline.check_password('ancien'))
+        self.assertFalse(User.objects.filter(username='Vide').exists())
+        self.assertIn('2 créé(s), 1 mis à jour, 0 inchangé(s), 2 ligne(s) ignorée(s)', sortie.getvalue())
+        self.assertIn('hachage', sortie.getvalue())
+
+        # Un second import ne change plus rien
+        rapport = importer_membres(self.fichier, processus=1)
+        self.assertEqual((rapport['crees'], rapport['mis_a_jour']), ([], []))
+
+    def test_dry_run_n_ecrit_rien(self):
+        rapport = importer_membres(self.fichier, dry_run=True)
+        self.assertEqual(rapport['crees'], ['MagalieA', 'JeanD'])
+        self.assertEqual(rapport['mis_a_jour'], ['AlineL'])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(User.objects.get().last_name, '')
+
+
+class SessionsTests(TestCase):
+
+    def setUp(self):
+        self.membre = User.objects.create_user(username='membre')
+        self.client.force_login(self.membre)
+
+    def _ecritures_session(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('permanences:calendrier'))
+        return [
+            requete['sql'] for requete in ctx.captured_queries
+            if 'django_session' in requete['sql'] and not requete['sql'].startswith('SELECT')
+        ]
+
+    def test_lecture_sans_ecriture_de_session(self):
+        self.assertEqual(self._ecritures_session(), [])
+        self.assertEqual(self._ecritures_session(), [])
+
+    def test_rafraichissement_apres_la_fraction(self):
+        self._ecritures_session()
+        session = self.client.session
+        session[CLE_RAFRAICHISSEMENT] -= settings.SESSION_COOKIE_AGE
+        session.save()
+        self.assertNotEqual(self._ecritures_session(), [])
+        self.assertEqual(self._ecritures_session(), [])
+
+    def test_purge_par_lots(self):
+        expiree = timezone.now() - timedelta(days=1)
+        Session.objects.bulk_create(
+            Session(session_key=f'expiree{i}', session_data='', expire_date=expiree)
+            for i in range(5)
+        )
+        sortie = StringIO()
+        call_command('purger_sessions', '--lot', '2', stdout=sortie)
+        self.assertIn('5 session(s)', sortie.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class IndexRequetesTests(TestCase):
+
+    def test_plans_avant_apres_sans_trace(self):
+        sortie = StringIO()
+        call_command('expliquer_requetes', '--annees', '0', '--membres', '5', stdout=sortie)
+        self.assertIn('== mes_inscriptions', sortie.getvalue())
+        self.assertIn('USING COVERING INDEX inscription_membre_statut_idx', sortie.getvalue())
+        self.assertIn('SCAN permanences_inscription USING INDEX inscription_tri_admin_idx', sortie.getvalue())
+        # Données et suppression des index annulées
+        self.assertFalse(User.objects.exists())
+        with connection.cursor() as cursor:
+            index = connection.introspection.get_constraints(cursor, Inscription._meta.db_table)
+        self.assertIn('inscription_tri_admin_idx', index)
+
+    def test_hotes_de_production(self):
+        # Le lanceur de tests autorise 'testserver' : la commande doit l'autoriser elle-même
+        with self.settings(ALLOWED_HOSTS=['tpl-creil.fr']):
+            sortie = StringIO()
+            call_command('expliquer_requetes', '--annees', '0', '--membres', '5', stdout=sortie)
+        self.assertIn('== mes_inscriptions', sortie.getvalue())
+
+
+class DonneesChargeTests(TestCase):
+
+    def test_generation_coherente_et_reproductible(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_load_data', stdout=StringIO())
+
+        resultat = generer_donnees(nb_membres=30, annees=1, semaines_a_venir=2, graine=7)
+        self.assertEqual(resultat['membres'], 30)
+        self.assertEqual(Inscription.objects.count(), resultat['inscriptions'])
+        self.assertFalse(CreneauHoraire.objects.filter(nb_inscrits__gt=F('max_personnes')).exists())
+        self.assertTrue(Inscription.objects.filter(annulee=True).exists())
+        call_command('recalculer_compteurs', '--verifier', stdout=StringIO())
+        tirage = list(Inscription.objects.order_by('creneau__date', 'creneau__heure_debut', 'utilisateur__username')
+                      .values_list('creneau_id', 'utilisateur__username', 'annulee'))
+
+        # Relancer ne remplit pas à nouveau les créneaux déjà servis
+        self.assertLess(generer_donnees(nb_membres=30, annees=1, semaines_a_venir=2, graine=7)['inscriptions'],
+                        resultat['inscriptions'] / 10)
+
+        # Même graine, même tirage
+        Inscription.objects.all().delete()
+        CreneauHoraire.objects.update(nb_inscrits=0)
+        generer_donnees(nb_membres=30, annees=1, semaines_a_venir=2, graine=7)
+        self.assertEqual(tirage, list(
+            Inscription.objects.order_by('creneau__date', 'creneau__heure_debut', 'utilisateur__username')
+            .values_list('creneau_id', 'utilisateur__username', 'annulee')
+        ))
+
+
+class BenchmarkTests(TestCase):
+
+    def test_mesure_et_budgets(self):
+        sortie = os.path.join(tempfile.mkdtemp(), 'resultats.json')
+        self.addCleanup(os.remove, sortie)
+        call_command(
+            'benchmark_vues', '--membres', '10', '--annees', '0', '--iterations', '2',
+            '--facteur-latence', '100', '--sortie', sortie, stdout=StringIO()
+        )
+        with open(sortie, encoding='utf-8') as fichier:
+            vues = json.load(fichier)['vues']
+        self.assertEqual(set(vues), set(benchmark.BUDGETS))
+        self.assertTrue(all(mesure['statut'] == 200 for mesure in vues.values()))
+        # Données générées annulées
+        self.assertFalse(User.objects.exists())
+
+        budgets = {'mes_inscriptions': {'requetes': 1, 'p95_ms': 1000}}
+        self.assertEqual(
+            benchmark.depassements({'mes_inscriptions': vues['mes_inscriptions']}, budgets),
+            [f"mes_inscriptions : {vues['mes_inscriptions']['requetes']} requêtes (budget 1)"]
+        )
+
+
+@override_settings(
+    PERF_MESURE=True,
+    TEMPLATES=[{**settings.TEMPLATES[0], 'BACKEND': 'permanences.perf.TemplatesMesures'}]
+)
+class PerformanceTests(TestCase):
+
+    def setUp(self):
+        perf.vider()
+        self.admin = User.objects.create_superuser(username='admin', password='x')
+        self.url = reverse('permanences:performance')
+
+    def test_tableau_reserve_aux_super_utilisateurs(self):
+        self.client.force_login(User.objects.create_user(username='membre'))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_mesures_par_vue(self):
+        creer_creneaux(lundi_prochain(), 3)
+        self.client.force_login(self.admin)
+        for _ in range(3):
+            self.client.get(reverse('permanences:calendrier'))
+
+        lignes = {ligne['vue']: ligne for ligne in perf.statistiques()}
+        calendrier = lignes['permanences:calendrier']
+        self.assertEqual(calendrier['appels'], 3)
+        self.assertGreater(calendrier['sql_nombre'], 0)
+        self.assertGreater(calendrier['gabarits_ms'], 0)
+        self.assertGreater(calendrier['octets'], 0)
+        self.assertTrue(perf.pires_requetes())
+
+        response = self.client.get(self.url)
+        self.assertContains(response, 'permanences:calendrier')
+        self.client.post(self.url)
+        self.assertEqual([ligne['vue'] for ligne in perf.statistiques()], ['permanences:performance'])
+
+    @override_settings(PERF_MESURE=False)
+    def test_desactive(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('permanences:calendrier'))
+        self.assertEqual(perf.statistiques(), [])
+
+
+class ArchivageTests(TestCase):
+
+    def setUp(self):
+        self.dossier = tempfile.mkdtemp()
+        self.membres = [User.objects.create_user(username=f'membre{i}') for i in range(2)]
+        self.aujourd_hui = timezone.localdate()
+        lundi = self.aujourd_hui - timedelta(days=self.aujourd_hui.weekday())
+        # Deux mois de créneaux anciens, une semaine récente
+        self.anciens = creer_creneaux(lundi - timedelta(weeks=60), 3) + creer_creneaux(lundi - timedelta(weeks=55), 2)
+        self.recents = creer_creneaux(lundi, 2)
+        for creneau in self.anciens[:3] + self.recents:
+            for membre in self.membres:
+                Inscription.objects.create(utilisateur=membre, creneau=creneau)
+        Inscription.objects.filter(utilisateur=self.membres[0], creneau=self.anciens[0]).update(
+            annulee=True, date_annulation=timezone.now()
+        )
+        services.recalculer_compteurs(CreneauHoraire.objects.all())
+        recalculer_statistiques()
+
+    def tearDown(self):
+        for nom in os.listdir(self.dossier):
+            os.remove(os.path.join(self.dossier, nom))
+        os.rmdir(self.dossier)
+
+    def test_archivage(self):
+        totaux = [totaux_membre(membre) for membre in self.membres]
+        limite = self.aujourd_hui - timedelta(weeks=26)
+
+        resultat = archiver(limite, self.dossier)
+        self.assertEqual(resultat['creneaux'], 5)
+        self.assertEqual(resultat['inscriptions'], 6)
+
+        with gzip.open(resultat['fichier'], 'rt', encoding='utf-8', newline='') as fichier:
+            lignes = list(csv.DictReader(fichier))
+        # Une ligne par inscription, une ligne vide par créneau sans inscrit
+        self.assertEqual(len(lignes), 8)
+        self.assertEqual(sum(ligne['annulee'] == 'True' for ligne in lignes), 1)
+        self.assertEqual(sum(ligne['utilisateur'] == '' for ligne in lignes), 2)
+
+        self.assertFalse(CreneauHoraire.objects.filter(date__lt=limite).exists())
+        self.assertEqual(Inscription.objects.count(), 4)
+        for creneau in self.recents:
+            creneau.refresh_from_db()
+            self.assertEqual(creneau.nb_inscrits, 2)
+        self.assertEqual(
+            ArchiveMensuelle.objects.get(utilisateur=self.membres[0]).annulations, 1
+        )
+        self.assertEqual([totaux_membre(membre) for membre in self.membres], totaux)
+        self.assertEqual(totaux[0], {'totales': 5, 'actives': 4, 'minutes': 240})
+        # Les archives suffisent à reconstruire les statistiques des mois archivés
+        attendues = calculer_statistiques()
+        recalculer_statistiques()
+        self.assertEqual(calculer_statistiques(), attendues)
+        self.assertEqual([totaux_membre(membre) for membre in self.membres], totaux)
+
+        # Relance : plus rien à archiver
+        self.assertEqual(archiver(limite, self.dossier)['creneaux'], 0)
+
+    def test_dry_run(self):
+        sortie = StringIO()
+        call_command('archiver_creneaux', '--jours', '182', '--dossier', self.dossier, '--dry-run', stdout=sortie)
+        self.assertIn('5 créneau(x) et 6 inscription(s)', sortie.getvalue())
+        self.assertEqual(CreneauHoraire.objects.count(), 7)
+        self.assertFalse(ArchiveMensuelle.objects.exists())
+        self.assertEqual(os.listdir(self.dossier), [])
+
+    def test_profil(self):
+        archiver(self.aujourd_hui - timedelta(weeks=26), self.dossier)
+        self.client.force_login(self.membres[1])
+        response = self.client.get(reverse('accounts:profil'))
+        self.assertEqual(response.context['inscriptions_actives'], 5)
+        self.assertEqual(response.context['inscriptions_totales'], 5)
+
+
+class StatistiquesTests(TestCase):
+
+    def setUp(self):
+        self.membre = User.objects.create_user(username='membre')
+        # Premier lundi d'un mois à venir : les trois créneaux sont dans le même mois
+        self.mois = (timezone.localdate().replace(day=1) + timedelta(days=62)).replace(day=1)
+        self.creneaux = creer_creneaux(self.mois + timedelta(days=-self.mois.weekday() % 7), 3)
+
+    def statistiques(self):
+        return {
+            (ligne.mois, ligne.creneaux, ligne.minutes, ligne.annulations, ligne.annulations_tardives)
+            for ligne in StatistiqueMensuelle.objects.filter(utilisateur=self.membre)
+        }
+
+    def verifier_coherence(self):
+        stockees = {
+            (ligne.utilisateur_id, ligne.mois): {
+                champ: getattr(ligne, champ)
+                for champ in ('creneaux', 'minutes', 'annulations', 'annulations_tardives')
+            }
+            for ligne in StatistiqueMensuelle.objects.all()
+        }
+        self.assertEqual(stockees, dict(calculer_statistiques()))
+
+    def test_tenues_a_jour_par_le_service(self):
+        inscriptions = [services.inscrire(self.membre, creneau)[0] for creneau in self.creneaux]
+        self.assertEqual(self.statistiques(), {(self.mois, 3, 180, 0, 0)})
+
+        with self.settings(ANNULATION_TARDIVE_HEURES=0):
+            services.desinscrire(Inscription.objects.get(pk=inscriptions[1].pk))
+        # Le créneau commence dans moins de 120 jours : annulation tardive
+        with self.settings(ANNULATION_TARDIVE_HEURES=24 * 120):
+            services.desinscrire(Inscription.objects.get(pk=inscriptions[0].pk))
+        self.assertEqual(self.statistiques(), {(self.mois, 1, 60, 2, 1)})
+
+        services.inscrire(self.membre, self.creneaux[1])
+        inscriptions[2].delete()
+        self.assertEqual(self.statistiques(), {(self.mois, 1, 60, 1, 1)})
+        with self.settings(ANNULATION_TARDIVE_HEURES=24 * 120):
+            self.verifier_coherence()
+        self.assertEqual(totaux_membre(self.membre)['totales'], 2)
+
+    def test_recalcul_et_verification(self):
+        for creneau in self.creneaux:
+            services.inscrire(self.membre, creneau)
+        StatistiqueMensuelle.objects.update(creneaux=0)
+        with self.assertRaises(CommandError):
+            call_command('recalculer_statistiques', '--verifier', stdout=StringIO())
+        call_command('recalculer_statistiques', stdout=StringIO())
+        call_command('recalculer_statistiques', '--verifier', stdout=StringIO())
+        self.assertEqual(self.statistiques(), {(self.mois, 3, 180, 0, 0)})
+
+    def test_suppression_du_membre(self):
+        services.inscrire(self.membre, self.creneaux[0])
+        self.membre.delete()
+        self.assertFalse(StatistiqueMensuelle.objects.exists())
+
+    def test_profil_et_classement(self):
+        autre = User.objects.create_user(username='autre')
+        for creneau in self.creneaux:
+            services.inscrire(self.membre, creneau)
+        services.inscrire(autre, self.creneaux[0])
+
+        self.client.force_login(self.membre)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('accounts:profil'))
+        self.assertFalse(any('permanences_inscription' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(response.context['inscriptions_actives'], 3)
+        self.assertEqual(response.context['heures_assurees'], 3)
+
+        self.client.force_login(User.objects.create_superuser(username='admin', password='x'))
+        response = self.client.get(reverse('permanences:classement'), {'mois': f'{self.mois:%Y-%m}'})
+        self.assertEqual(
+            [membre['utilisateur__username'] for membre in response.context['membres']],
+            ['membre', 'autre']
+        )
+        response = self.client.get(reverse('permanences:classement'), {'annee': 'x'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='x')
+        self.membres = [User.objects.create_user(username=f'membre{i}', first_name=f'Prénom{i}') for i in range(3)]
+        self.creneaux = creer_creneaux(lundi_prochain(), 4)
+        for creneau in self.creneaux[:2]:
+            for membre in self.membres:
+                services.inscrire(membre, creneau)
+        services.desinscrire(Inscription.objects.get(utilisateur=self.membres[0], creneau=self.creneaux[0]))
+        self.client.force_login(self.admin)
+        self.params = {'debut': self.creneaux[0].date.isoformat(), 'fin': self.creneaux[-1].date.isoformat()}
+
+    def test_csv_en_flux(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('permanences:export'), self.params)
+            self.assertTrue(response.streaming)
+            contenu = b''.join(response.streaming_content).decode('utf-8')
+        # Session, utilisateur, puis une seule requête pour toutes les inscriptions
+        self.assertEqual(sum('permanences_inscription' in q['sql'] for q in ctx.captured_queries), 1)
+        self.assertTrue(contenu.startswith('\ufeffDate;'))
+        lignes = list(csv.reader(contenu.lstrip('\ufeff').splitlines(), delimiter=';'))
+        self.assertEqual(len(lignes), 6)
+        self.assertEqual(lignes[1][3], 'membre1')
+        self.assertEqual(lignes[1][4], 'Prénom1')
+
+        response = self.client.get(reverse('permanences:export'), {**self.params, 'annulees': '1'})
+        contenu = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(contenu.count(';Annulée;'), 1)
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+        response = self.client.get(reverse('permanences:export'), {**self.params, 'format': 'xlsx'})
+        self.assertIn('.xlsx', response['Content-Disposition'])
+        with tempfile.TemporaryFile() as fichier:
+            fichier.write(b''.join(response.streaming_content))
+            lignes = list(load_workbook(fichier, read_only=True).active.iter_rows(values_only=True))
+        self.assertEqual(len(lignes), 6)
+        self.assertEqual(lignes[1][0], datetime.combine(self.creneaux[0].date, time()))
+
+    def test_action_admin(self):
+        response = self.client.post(reverse('admin:permanences_inscription_changelist'), {
+            'action': 'exporter_csv',
+            '_selected_action': list(Inscription.objects.filter(annulee=False).values_list('pk', flat=True)[:2]),
+        })
+        contenu = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(contenu.splitlines()), 3)
+
+    def test_reserve_aux_super_utilisateurs(self):
+        self.client.force_login(self.membres[0])
+        self.assertEqual(self.client.get(reverse('permanences:export')).status_code, 302)
+
+
+class CalendrierIcsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.membre = User.objects.create_user(username='membre', first_name='Alice')
+        self.autre = User.objects.create_user(username='autre')
+        self.creneaux = creer_creneaux(lundi_prochain(), 3)
+        services.inscrire(self.membre, self.creneaux[0], commentaire='Clés; caisse, fond')
+        services.inscrire(self.membre, self.creneaux[1])
+        services.inscrire(self.autre, self.creneaux[1])
+        self.jeton = JetonCalendrier.objects.create(utilisateur=self.membre)
+        self.url = reverse('permanences:ics_membre', args=[self.jeton.jeton])
+
+    def test_flux_membre_sans_connexion(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        texte = response.content.decode('utf-8')
+        self.assertEqual(texte.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:creneau-{self.creneaux[0].pk}@permanences', texte)
+        self.assertIn('DESCRIPTION:Clés\\; caisse\\, fond', texte)
+        self.assertTrue(all(len(ligne.encode()) <= 75 for ligne in texte.split('\r\n')))
+
+        # Même version : 304 après une requête de version (et celle du jeton)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Annulation : nouvelle version, un événement en moins
+        etag = response['ETag']
+        services.desinscrire(Inscription.objects.get(utilisateur=self.membre, creneau=self.creneaux[0]))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 1)
+
+    def test_jeton(self):
+        self.assertEqual(self.client.get(reverse('permanences:ics_membre', args=['inconnu'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('permanences:ics_stand', args=['inconnu'])).status_code, 404)
+
+        self.client.force_login(self.membre)
+        response = self.client.get(reverse('permanences:mes_inscriptions'))
+        self.assertContains(response, self.url)
+        self.client.post(reverse('permanences:ics_renouveler'))
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.jeton.refresh_from_db()
+        self.assertEqual(self.client.get(reverse('permanences:ics_membre', args=[self.jeton.jeton])).status_code, 200)
+
+    def test_flux_stand(self):
+        url = reverse('permanences:ics_stand', args=[ics.jeton_stand()])
+        texte = self.client.get(url).content.decode('utf-8')
+        # Seuls les créneaux pourvus, avec leurs inscrits
+        self.assertEqual(texte.count('BEGIN:VEVENT'), 2)
+        self.assertIn('SUMMARY:Permanence (2/3)', texte)
+        self.assertIn('DESCRIPTION:autre\\, Alice', texte)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).content.decode('utf-8'), texte)
+        # Version seulement, le flux vient du cache
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_revocation_du_flux_stand(self):
+        ancienne = reverse('permanences:ics_stand', args=[ics.jeton_stand()])
+        with self.settings(ICS_STAND_VERSION='2'):
+            nouvelle = reverse('permanences:ics_stand', args=[ics.jeton_stand()])
+            self.assertEqual(self.client.get(ancienne).status_code, 404)
+            self.assertEqual(self.client.get(nouvelle).status_code, 200)
+        self.assertEqual(self.client.get(nouvelle).status_code, 404)
+
+
+class ListeAttenteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.membres = [
+            User.objects.create_user(username=f'membre{i}', email=f'membre{i}@example.org')
+            for i in range(4)
+        ]
+        self.creneau = creer_creneaux(lundi_prochain(), 1, max_personnes=1)[0]
+        self.inscription, _ = services.inscrire(self.membres[0], self.creneau)
+
+    def test_promotion_a_l_annulation(self):
+        self.assertEqual(services.rejoindre_attente(self.membres[1], self.creneau), 1)
+        self.assertEqual(services.rejoindre_attente(self.membres[2], self.creneau), 2)
+
+        recues = []
+        services.place_attribuee.connect(lambda inscription, **kwargs: recues.append(inscription), weak=False)
+        with self.settings(LISTE_ATTENTE_EMAIL=True), self.captureOnCommitCallbacks(execute=True):
+            services.desinscrire(self.inscription)
+
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membres[1], creneau=self.creneau, annulee=False).exists())
+        self.assertEqual([inscription.utilisateur for inscription in recues], [self.membres[1]])
+        self.assertEqual(mail.outbox[0].to, ['membre1@example.org'])
+        attente = services.avec_position(Attente.objects.filter(creneau=self.creneau)).get()
+        self.assertEqual((attente.utilisateur, attente.position), (self.membres[2], 1))
+
+    def test_rejoindre_refuse(self):
+        with self.assertRaises(ValidationError):
+            services.rejoindre_attente(self.membres[0], self.creneau)
+        services.desinscrire(self.inscription)
+        with self.assertRaises(ValidationError):
+            services.rejoindre_attente(self.membres[1], self.creneau)
+
+    def test_membre_deja_inscrit_saute(self):
+        services.rejoindre_attente(self.membres[1], self.creneau)
+        services.rejoindre_attente(self.membres[2], self.creneau)
+        # Inscrit entre-temps par ailleurs (admin)
+        Inscription.objects.create(utilisateur=self.membres[1], creneau=self.creneau)
+
+        services.desinscrire(self.inscription)
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membres[2], annulee=False).exists())
+        self.assertFalse(Attente.objects.exists())
+
+    def test_pages(self):
+        self.client.force_login(self.membres[1])
+        url = reverse('permanences:calendrier') + f'?week={lundi_prochain():%Y-%m-%d}'
+        self.assertContains(self.client.get(url), reverse('permanences:rejoindre_attente', args=[self.creneau.pk]))
+
+        self.client.post(reverse('permanences:rejoindre_attente', args=[self.creneau.pk]))
+        response = self.client.get(url)
+        self.assertContains(response, "Vous êtes n° 1 sur la liste")
+        self.assertContains(response, reverse('permanences:quitter_attente', args=[self.creneau.pk]))
+        self.assertContains(self.client.get(reverse('permanences:mes_inscriptions')), 'n° 1')
+
+        self.client.post(reverse('permanences:quitter_attente', args=[self.creneau.pk]) + '?next=mes_inscriptions')
+        self.assertFalse(Attente.objects.exists())
+
+    def test_annulation_dans_l_admin(self):
+        services.rejoindre_attente(self.membres[1], self.creneau)
+        admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.client.force_login(admin)
+        url = reverse('admin:permanences_inscription_change', args=[self.inscription.pk])
+        with self.captureOnCommitCallbacks(execute=True) as rappels:
+            self.client.post(url, {
+                'utilisateur': self.membres[0].pk, 'creneau': self.creneau.pk, 'commentaire': '', 'annulee': 'on',
+            })
+        self.assertTrue(Inscription.objects.get(pk=self.inscription.pk).annulee)
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membres[1], annulee=False).exists())
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+        self.assertTrue(rappels)
+
+    def test_changement_de_creneau_dans_l_admin(self):
+        services.rejoindre_attente(self.membres[1], self.creneau)
+        autre = creer_creneaux(lundi_prochain() + timedelta(days=7), 1, max_personnes=1)[0]
+        admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.client.force_login(admin)
+        url = reverse('admin:permanences_inscription_change', args=[self.inscription.pk])
+        with self.captureOnCommitCallbacks(execute=True) as rappels:
+            self.client.post(url, {'utilisateur': self.membres[0].pk, 'creneau': autre.pk, 'commentaire': ''})
+        self.assertEqual(
+            set(Inscription.objects.filter(annulee=False).values_list('utilisateur', 'creneau')),
+            {(self.membres[0].pk, autre.pk), (self.membres[1].pk, self.creneau.pk)}
+        )
+        self.assertFalse(Attente.objects.exists())
+        self.creneau.refresh_from_db()
+        autre.refresh_from_db()
+        self.assertEqual((self.creneau.nb_inscrits, autre.nb_inscrits), (1, 1))
+        self.assertEqual(totaux_membre(self.membres[0])['actives'], 1)
+        self.assertTrue(rappels)
+
+    def test_suppression_promeut(self):
+        services.rejoindre_attente(self.membres[1], self.creneau)
+        with self.captureOnCommitCallbacks() as rappels:
+            Inscription.objects.filter(pk=self.inscription.pk).delete()
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membres[1], annulee=False).exists())
+        self.creneau.refresh_from_db()
+        self.assertEqual(self.creneau.nb_inscrits, 1)
+        self.assertTrue(rappels)
+
+    def test_suppression_du_membre_en_attente(self):
+        # Le membre supprimé, inscrit et premier de la file, ne récupère pas sa propre place
+        autre = creer_creneaux(lundi_prochain() + timedelta(days=7), 1, max_personnes=1)[0]
+        services.inscrire(self.membres[1], autre)
+        services.rejoindre_attente(self.membres[2], autre)
+        services.rejoindre_attente(self.membres[1], self.creneau)
+        services.rejoindre_attente(self.membres[2], self.creneau)
+        services.desinscrire(self.inscription)
+        self.membres[1].delete()
+        self.assertEqual(
+            set(Inscription.objects.filter(annulee=False).values_list('utilisateur', 'creneau')),
+            {(self.membres[2].pk, self.creneau.pk), (self.membres[2].pk, autre.pk)}
+        )
+
+
+class InscriptionSerieTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        self.membre = User.objects.create_user(username='membre')
+        self.autre = User.objects.create_user(username='autre')
+        samedi = lundi_prochain() + timedelta(days=5)
+        # Quatre samedis, 9h-10h et 10h-11h, plus un créneau l'après-midi hors série
+        self.creneaux = [
+            CreneauHoraire.objects.create(
+                date=samedi + timedelta(weeks=semaine), heure_debut=time(heure), heure_fin=time(heure + 1),
+                max_personnes=1 if (semaine, heure) == (0, 9) else 3
+            )
+            for semaine in range(4) for heure in (9, 10)
+        ]
+        CreneauHoraire.objects.create(date=samedi, heure_debut=time(14), heure_fin=time(15))
+        services.inscrire(self.autre, self.creneaux[0])
+        services.inscrire(self.membre, self.creneaux[1])
+        services.desinscrire(services.inscrire(self.membre, self.creneaux[2])[0])
+        self.creneaux[3].actif = False
+        self.creneaux[3].save()
+        self.samedi = samedi
+
+    def test_inscription_en_serie(self):
+        resultats = services.inscrire_en_serie(
+            self.membre, self.samedi, self.samedi + timedelta(weeks=3), [5], time(9), time(11)
+        )
+        self.assertEqual([resultat for _, resultat in resultats], [
+            services.COMPLET, services.DEJA_INSCRIT, services.REACTIVE, services.INACTIF,
+            services.INSCRIT, services.INSCRIT, services.INSCRIT, services.INSCRIT,
+        ])
+        self.assertEqual(
+            Inscription.objects.filter(utilisateur=self.membre, annulee=False).count(), 6
+        )
+        self.assertFalse(CreneauHoraire.objects.filter(
+            nb_inscrits__gt=F('max_personnes')
+        ).exists())
+        for creneau in CreneauHoraire.objects.all():
+            self.assertEqual(creneau.nb_inscrits, creneau.inscriptions.filter(annulee=False).count())
+        stockees = {
+            (ligne.utilisateur_id, ligne.mois): {
+                champ: getattr(ligne, champ)
+                for champ in ('creneaux', 'minutes', 'annulations', 'annulations_tardives')
+            }
+            for ligne in StatistiqueMensuelle.objects.all()
+        }
+        self.assertEqual(stockees, dict(calculer_statistiques()))
+
+    def test_requetes_constantes(self):
+        jour = self.samedi + timedelta(weeks=5)
+        for minute in range(0, 600, 15):
+            debut = (datetime.combine(jour, time(8)) + timedelta(minutes=minute)).time()
+            CreneauHoraire.objects.create(date=jour, heure_debut=debut, heure_fin=time(19))
+
+        def nb_requetes(utilisateur, nombre):
+            creneaux = CreneauHoraire.objects.filter(date=jour).order_by('heure_debut')[:nombre]
+            with CaptureQueriesContext(connection) as ctx:
+                resultats = services.inscrire_plusieurs(utilisateur, CreneauHoraire.objects.filter(pk__in=creneaux))
+            self.assertEqual({resultat for _, resultat in resultats}, {services.INSCRIT})
+            return len(ctx.captured_queries)
+
+        # Premier mois pour chacun : même nombre de requêtes pour 2 ou 40 créneaux
+        self.assertEqual(nb_requetes(self.membre, 2), nb_requetes(self.autre, 40))
+
+    def test_place_prise_par_un_autre_worker(self):
+        # Complet en base, mais lu libre (inscription d'un autre worker entre la lecture et la mise à jour)
+        complet = self.creneaux[0]
+        with mock.patch.object(CreneauHoraire, 'complet', new_callable=mock.PropertyMock, return_value=False):
+            resultats = services.inscrire_plusieurs(
+                self.membre, CreneauHoraire.objects.filter(pk__in=[complet.pk, self.creneaux[4].pk])
+            )
+        self.assertEqual([resultat for _, resultat in resultats], [services.COMPLET, services.INSCRIT])
+        complet.refresh_from_db()
+        self.assertEqual(complet.nb_inscrits, complet.max_personnes)
+        self.assertFalse(Inscription.objects.filter(utilisateur=self.membre, creneau=complet).exists())
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membre, creneau=self.creneaux[4]).exists())
+
+    def test_vue_rapport(self):
+        self.client.force_login(self.admin)
+        url = reverse('permanences:inscription_serie')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.post(url, {
+            'utilisateur': self.membre.pk, 'jours': ['5'], 'heure_debut': '09:00', 'heure_fin': '11:00',
+            'date_debut': self.samedi.isoformat(), 'date_fin': (self.samedi + timedelta(weeks=3)).isoformat(),
+        })
+        self.assertEqual(response.context['rapport']['totaux'], {
+            'Complet': 1, 'Déjà inscrit': 1, 'Inscription réactivée': 1, 'Créneau fermé': 1, 'Inscrit': 4,
+        })
+
+        self.client.force_login(self.membre)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_action_admin(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:permanences_creneauhoraire_changelist')
+        selection = [self.creneaux[0].pk, self.creneaux[4].pk]
+        donnees = {'action': 'inscrire_membre', '_selected_action': selection}
+        self.assertContains(self.client.post(url, donnees), 'name="appliquer"')
+
+        response = self.client.post(url, {**donnees, 'appliquer': '1', 'utilisateur': self.membre.pk}, follow=True)
+        self.assertContains(response, '1 inscription(s) sur 2 créneau(x).')
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membre, creneau=self.creneaux[4]).exists())
+
+
+class RappelsTests(TestCase):
+
+    def setUp(self):
+        self.demain = timezone.localdate() + timedelta(days=1)
+        self.membres = [
+            User.objects.create_user(username=f'membre{i}', email=f'membre{i}@example.org', first_name=f'Membre {i}')
+            for i in range(5)
+        ]
+        self.creneaux = [
+            CreneauHoraire.objects.create(date=self.demain, heure_debut=time(heure), heure_fin=time(heure + 1))
+            for heure in (9, 10)
+        ]
+        for i, membre in enumerate(self.membres):
+            Inscription.objects.create(utilisateur=membre, creneau=self.creneaux[i % 2])
+        # Ni les annulations, ni les membres sans email, ni les autres jours
+        Inscription.objects.filter(utilisateur=self.membres[4]).update(annulee=True)
+        sans_email = User.objects.create_user(username='sans_email')
+        Inscription.objects.create(utilisateur=sans_email, creneau=self.creneaux[0])
+        autre_jour = CreneauHoraire.objects.create(
+            date=self.demain + timedelta(days=1), heure_debut=time(9), heure_fin=time(10)
+        )
+        Inscription.objects.create(utilisateur=self.membres[0], creneau=autre_jour)
+
+    def test_envoi_par_lots_et_idempotence(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resultat = rappels.envoyer_rappels(self.demain, taille_lot=3)
+        self.assertEqual(resultat, {'envoyes': 4, 'lots': 2})
+        # Une lecture, puis une mise à jour par lot
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            f'membre{i}@example.org' for i in range(4)
+        ])
+        self.assertIn('Membre 0', mail.outbox[0].body)
+        self.assertIn(reverse('permanences:mes_inscriptions'), mail.outbox[0].body)
+
+        self.assertEqual(rappels.envoyer_rappels(self.demain), {'envoyes': 0, 'lots': 0})
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_une_connexion_backend_fichier(self):
+        with tempfile.TemporaryDirectory() as dossier:
+            with self.settings(
+                EMAIL_BACKEND='django.core.mail.backends.filebased.EmailBackend', EMAIL_FILE_PATH=dossier
+            ):
+                sortie = StringIO()
+                call_command('envoyer_rappels', '--taille-lot', '1', stdout=sortie)
+            # Le backend fichier écrit un fichier par connexion ouverte
+            fichiers = os.listdir(dossier)
+            self.assertEqual(len(fichiers), 1)
+            with open(os.path.join(dossier, fichiers[0]), encoding='utf-8') as fichier:
+                self.assertEqual(fichier.read().count('\nTo: membre'), 4)
+        self.assertIn('4 rappel(s) envoyé(s)', sortie.getvalue())
+        self.assertEqual(Inscription.objects.filter(rappel_envoye_le__isnull=False).count(), 4)
+
+    def test_dry_run(self):
+        sortie = StringIO()
+        call_command('envoyer_rappels', '--dry-run', stdout=sortie)
+        self.assertIn('4 rappel(s)', sortie.getvalue())
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(Inscription.objects.filter(rappel_envoye_le__isnull=False).exists())
+
+    def test_rappel_apres_reinscription(self):
+        rappels.envoyer_rappels(self.demain)
+        inscription = Inscription.objects.get(utilisateur=self.membres[0], creneau=self.creneaux[0])
+        services.desinscrire(inscription)
+        services.inscrire(self.membres[0], self.creneaux[0])
+        inscription = Inscription.objects.get(utilisateur=self.membres[2], creneau=self.creneaux[0])
+        services.desinscrire(inscription)
+        services.inscrire_plusieurs(self.membres[2], CreneauHoraire.objects.filter(pk=self.creneaux[0].pk))
+        mail.outbox = []
+        self.assertEqual(rappels.envoyer_rappels(self.demain)['envoyes'], 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'membre0@example.org', 'membre2@example.org'
+        ])
+
+
+class CalendrierPeriodeTests(TestCase):
+    """Vues de plusieurs semaines et du mois : une requête pour toute la période"""
+
+    def setUp(self):
+        cache.clear()
+        self.membre = User.objects.create_user(username='membre')
+        self.autre = User.objects.create_user(username='autre')
+        # Mois à venir : ses créneaux peuvent recevoir des inscriptions
+        self.mois = (timezone.localdate().replace(day=1) + timedelta(days=62)).replace(day=1)
+
+    def test_grille_requetes_constantes(self):
+        def nb_requetes(semaine, nombre):
+            for creneau in creer_creneaux(semaine, nombre):
+                services.inscrire(self.autre, creneau)
+            url = reverse('permanences:calendrier') + f'?week={semaine:%Y-%m-%d}&semaines=4'
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries), response
+
+        self.client.force_login(self.membre)
+        semaine = lundi_prochain()
+        petit, _ = nb_requetes(semaine, 5)
+        grand, response = nb_requetes(semaine + timedelta(weeks=4), 200)
+        self.assertEqual(petit, grand)
+        grille = response.context['grille']
+        self.assertEqual(len(grille), 4)
+        self.assertEqual(sum(jour['creneaux'] for semaine in grille for jour in semaine), 200)
+        self.assertEqual(grille[0][0]['libres'], sum(
+            creneau.places_disponibles for creneau in CreneauHoraire.objects.filter(date=grille[0][0]['date'])
+        ))
+
+    def test_mois(self):
+        debut = self.mois - timedelta(days=self.mois.weekday())
+        creneaux = creer_creneaux(self.mois, 3)
+        services.inscrire(self.membre, creneaux[0])
+        self.client.force_login(self.membre)
+        response = self.client.get(reverse('permanences:calendrier'), {'mois': f'{self.mois:%Y-%m}'})
+
+        grille = response.context['grille']
+        self.assertEqual(grille[0][0]['date'], debut)
+        self.assertEqual(grille[-1][-1]['date'].weekday(), 6)
+        jours = {jour['date']: jour for semaine in grille for jour in semaine}
+        self.assertTrue(jours[self.mois]['inscrit'])
+        self.assertEqual(jours[self.mois]['creneaux'], 1)
+        self.assertEqual(jours[debut]['hors_mois'], debut != self.mois)
+        suivant = (self.mois + timedelta(days=32)).replace(day=1)
+        self.assertContains(response, f'?mois={suivant:%Y-%m}')
+
+    def test_jour_deplie(self):
+        creneau = creer_creneaux(self.mois, 1)[0]
+        self.client.force_login(self.membre)
+        url = reverse('permanences:calendrier_jour', args=[self.mois.isoformat()])
+        response = self.client.get(url, {'mois': f'{self.mois:%Y-%m}'})
+        self.assertContains(response, creneau.heure_debut.strftime('%H:%M'))
+        action = reverse('permanences:auto_inscription', args=[creneau.pk]) + f'?mois={self.mois:%Y-%m}'
+        self.assertContains(response, f'action="{action}"')
+        self.assertEqual(self.client.get(reverse('permanences:calendrier_jour', args=['demain'])).status_code, 404)
+
+        # Après l'inscription, retour au mois affiché
+        response = self.client.post(action)
+        self.assertRedirects(
+            response, reverse('permanences:calendrier') + f'?mois={self.mois:%Y-%m}', fetch_redirect_response=False
+        )
+        self.assertTrue(Inscription.objects.filter(utilisateur=self.membre, creneau=creneau).exists())
+
+    def test_gestion_plusieurs_semaines(self):
+        admin = User.objects.create_superuser(username='admin', password='motdepasse123')
+        semaine = lundi_prochain()
+        creer_creneaux(semaine, 1)
+        lointain = creer_creneaux(semaine + timedelta(weeks=2), 1)[0]
+        self.client.force_login(admin)
+        url = reverse('permanences:gestion')
+        self.assertNotIn(lointain.date, self.client.get(url, {'week': semaine.isoformat()}).context['creneaux_par_jour'])
+        response = self.client.get(url, {'week': semaine.isoformat(), 'semaines': 3})
+        self.assertIn(lointain.date, response.context['creneaux_par_jour'])
+        self.assertContains(response, f'?week={semaine + timedelta(weeks=3):%Y-%m-%d}&amp;semaines=3')
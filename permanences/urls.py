@@ -5,11 +5,23 @@ app_name = 'permanences'
 
 urlpatterns = [
     path('', views.calendrier_permanences, name='calendrier'),
+    path('jour/<str:jour>/', views.calendrier_jour, name='calendrier_jour'),
     path('gestion/', views.gestion_inscriptions, name='gestion'),
+    path('gestion/performance/', views.tableau_performance, name='performance'),
+    path('gestion/classement/', views.classement_membres, name='classement'),
+    path('gestion/export/', views.export_inscriptions, name='export'),
+    path('gestion/serie/', views.inscription_serie, name='inscription_serie'),
     path('inscrire/<int:creneau_id>/', views.inscrire_creneau, name='inscrire'),
     path('annuler/<int:inscription_id>/', views.annuler_inscription, name='annuler'),
     path('auto-inscription/<int:creneau_id>/', views.auto_inscription, name='auto_inscription'),
     path('auto-desinscription/<int:inscription_id>/', views.auto_desinscription, name='auto_desinscription'),
+    path('attente/<int:creneau_id>/', views.rejoindre_liste_attente, name='rejoindre_attente'),
+    path('attente/<int:creneau_id>/quitter/', views.quitter_liste_attente, name='quitter_attente'),
     path('mes-inscriptions/', views.mes_inscriptions, name='mes_inscriptions'),
     path('ajax/places/<int:creneau_id>/', views.ajax_places_disponibles, name='ajax_places'),
+    path('ajax/places/', views.ajax_places_lot, name='ajax_places_lot'),
+    path('flux/places/', views.flux_places, name='flux_places'),
+    path('ics/stand/<str:jeton>.ics', views.ics_stand, name='ics_stand'),
+    path('ics/renouveler/', views.renouveler_jeton_calendrier, name='ics_renouveler'),
+    path('ics/<str:jeton>.ics', views.ics_membre, name='ics_membre'),
 ]
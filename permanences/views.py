@@ -1,12 +1,28 @@
+import asyncio
+import hashlib
+import json
+import os
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.middleware.csrf import get_token
 from django.utils import timezone
 from django.db import models
-from datetime import datetime, timedelta
-from .models import CreneauHoraire, Inscription
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.core.exceptions import ValidationError
+from .models import Attente, CreneauHoraire, Inscription, JetonCalendrier
+from . import diffusion, export, ics, perf, services
+from .forms import InscriptionSerieForm
+from .cache_calendrier import creneaux_periode, statistiques_cache, version_periode
+from .generation import materialiser_semaine
+from .statistiques import classement
 from django.urls import reverse
 from urllib.parse import urlencode
 
@@ -15,10 +31,9 @@ def is_superuser(user):
     """Vérifie si l'utilisateur est un super utilisateur"""
     return user.is_superuser
 
-@login_required
-def calendrier_permanences(request):
-    """Vue principale affichant le calendrier des permanences"""
-    # Récupérer la semaine courante ou celle spécifiée
+
+def _semaine_demandee(request):
+    """Retourne (aujourd'hui, lundi de la semaine demandée par ?week=, sinon de la semaine courante)"""
     today = timezone.now().date()
     week_start = request.GET.get('week')
     
@@ -29,44 +44,224 @@ def calendrier_permanences(request):
             week_start = today - timedelta(days=today.weekday())
     else:
         week_start = today - timedelta(days=today.weekday())
-    
-    week_end = week_start + timedelta(days=6)
-    
-    # Récupérer les créneaux de la semaine
-    creneaux = CreneauHoraire.objects.filter(
-        date__range=[week_start, week_end],
-        actif=True
-    ).prefetch_related('inscriptions__utilisateur').order_by('date', 'heure_debut')
+    return today, week_start
+
+
+# Nombre maximum de semaines affichées ensemble (?semaines=)
+MAX_SEMAINES = 6
+
+
+def _periode_demandee(request):
+    """
+    Période affichée : une ou plusieurs semaines (?week= et ?semaines=N) ou
+    les semaines entières d'un mois (?mois=AAAA-MM).
+
+    Retourne un dict : today, debut (lundi), fin (dimanche), semaines, mois
+    (premier jour du mois ou None), precedente et suivante (paramètres de
+    navigation) et retour (paramètres de la page courante).
+    """
+    today, week_start = _semaine_demandee(request)
+    mois = None
+    if request.GET.get('mois'):
+        try:
+            mois = datetime.strptime(request.GET['mois'], '%Y-%m').date()
+        except ValueError:
+            pass
+
+    if mois:
+        dernier = (mois + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        debut = mois - timedelta(days=mois.weekday())
+        fin = dernier + timedelta(days=6 - dernier.weekday())
+        semaines = ((fin - debut).days + 1) // 7
+        precedent = (mois - timedelta(days=1)).replace(day=1)
+        precedente = {'mois': f'{precedent:%Y-%m}'}
+        suivante = {'mois': f'{dernier + timedelta(days=1):%Y-%m}'}
+        retour = {'mois': f'{mois:%Y-%m}'}
+    else:
+        try:
+            semaines = min(max(int(request.GET.get('semaines', 1)), 1), MAX_SEMAINES)
+        except ValueError:
+            semaines = 1
+        debut = week_start
+        fin = week_start + timedelta(weeks=semaines, days=-1)
+        precedente = {'week': f'{debut - timedelta(weeks=semaines):%Y-%m-%d}'}
+        suivante = {'week': f'{debut + timedelta(weeks=semaines):%Y-%m-%d}'}
+        retour = {'week': f'{debut:%Y-%m-%d}'}
+        if semaines > 1:
+            for parametres in (precedente, suivante, retour):
+                parametres['semaines'] = semaines
+
+    return {
+        'today': today,
+        'debut': debut,
+        'fin': fin,
+        'semaines': semaines,
+        'mois': mois,
+        'precedente': urlencode(precedente),
+        'suivante': urlencode(suivante),
+        'retour': urlencode(retour),
+    }
+
+
+def _etag(request, *elements, par_utilisateur=True):
+    """
+    ETag calculé à partir des versions de données affichées.
+
+    Pour une page propre à l'utilisateur, l'ETag dépend aussi de son compte et
+    du cookie CSRF (les formulaires de la page en dépendent) ; aucun ETag n'est
+    produit s'il reste des messages à afficher, la page doit alors être rendue.
+    """
+    if par_utilisateur:
+        if len(messages.get_messages(request)):
+            return None
+        get_token(request)
+        elements = (
+            request.user.pk,
+            request.user.is_superuser,
+            request.META.get('CSRF_COOKIE', ''),
+        ) + elements
+    empreinte = hashlib.md5('|'.join(str(e) for e in elements).encode()).hexdigest()
+    return quote_etag(empreinte)
+
+
+def _non_modifie(request, etag, last_modified=None):
+    """Réponse 304 si le client possède déjà cette version, sinon None"""
+    if etag is None:
+        return None
+    reponse = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if reponse is not None:
+        reponse['ETag'] = etag
+        patch_cache_control(reponse, private=True, no_cache=True)
+    return reponse
 
+
+def _marquer_version(reponse, etag, last_modified=None):
+    if etag is not None:
+        reponse['ETag'] = etag
+    if last_modified is not None:
+        reponse['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(reponse, private=True, no_cache=True)
+    return reponse
+
+
+def _preparer_creneaux(creneaux, utilisateur):
+    """Inscription et liste d'attente de l'utilisateur sur chaque créneau (au plus une requête)"""
     for creneau in creneaux:
-        creneau.user_inscription = creneau.get_user_inscription(request.user)
-    
-    # Organiser les créneaux par jour
-    creneaux_par_jour = {}
+        creneau.user_inscription = creneau.get_user_inscription(utilisateur)
+    # Listes d'attente de l'utilisateur : seuls les créneaux complets en ont
+    complets = [creneau.pk for creneau in creneaux if creneau.complet and not creneau.user_inscription]
+    attentes = set(
+        Attente.objects.filter(utilisateur=utilisateur, creneau_id__in=complets)
+        .values_list('creneau_id', flat=True)
+    ) if complets else set()
     for creneau in creneaux:
-        creneau.user_inscription = creneau.get_user_inscription(request.user)
-        if creneau.date not in creneaux_par_jour:
-            creneaux_par_jour[creneau.date] = []
-        
-        # Ajouter les informations d'inscription de l'utilisateur
-        creneau.user_inscription = creneau.get_user_inscription(request.user)
-        
-        creneaux_par_jour[creneau.date].append(creneau)
-    
-    # Naviguation semaine précédente/suivante
-    prev_week = week_start - timedelta(days=7)
-    next_week = week_start + timedelta(days=7)
-    
+        creneau.user_attente = creneau.pk in attentes
+
+
+def _grille(creneaux, periode, utilisateur):
+    """
+    Semaines de la période, jour par jour, en une seule passe sur les créneaux
+    (triés par date) : [[{date, creneaux, libres, inscrit, hors_mois}, ...], ...]
+    """
+    jours = []
+    index = {}
+    jour = periode['debut']
+    while jour <= periode['fin']:
+        index[jour] = len(jours)
+        jours.append({
+            'date': jour,
+            'creneaux': 0,
+            'libres': 0,
+            'inscrit': False,
+            'hors_mois': periode['mois'] is not None and jour.month != periode['mois'].month,
+        })
+        jour += timedelta(days=1)
+
+    for creneau in creneaux:
+        cellule = jours[index[creneau.date]]
+        cellule['creneaux'] += 1
+        if not creneau.est_passe:
+            cellule['libres'] += creneau.places_disponibles
+        if not cellule['inscrit'] and creneau.get_user_inscription(utilisateur):
+            cellule['inscrit'] = True
+    return [jours[rang:rang + 7] for rang in range(0, len(jours), 7)]
+
+
+@login_required
+def calendrier_permanences(request):
+    """
+    Vue principale affichant le calendrier des permanences.
+
+    Une semaine est affichée en détail ; plusieurs semaines (?semaines=N) ou
+    un mois (?mois=AAAA-MM) sont affichés en grille compacte, dont chaque jour
+    se déplie à la demande (calendrier_jour).
+    """
+    periode = _periode_demandee(request)
+    today, week_start, week_end = periode['today'], periode['debut'], periode['fin']
+    compacte = periode['semaines'] > 1
+
+    # Créer à la demande les créneaux des horaires récurrents
+    for rang in range(periode['semaines']):
+        materialiser_semaine(week_start + timedelta(weeks=rang))
+
+    # Page inchangée depuis la dernière visite : 304 sans rendu
+    version = version_periode(week_start, week_end)
+    etag = _etag(
+        request, 'calendrier', week_start, week_end, periode['mois'], today,
+        version['derniere'], version['total'], version['passes']
+    )
+    non_modifie = _non_modifie(request, etag)
+    if non_modifie is not None:
+        return non_modifie
+
+    # Créneaux de la période en une requête (partie commune, mise en cache)
+    creneaux = creneaux_periode(week_start, week_end, version)
+
     context = {
-        'creneaux_par_jour': creneaux_par_jour,
         'week_start': week_start,
         'week_end': week_end,
-        'prev_week': prev_week,
-        'next_week': next_week,
         'today': today,
+        'periode': periode,
+        'retour': periode['retour'],
     }
-    
-    return render(request, 'permanences/calendrier.html', context)
+    if compacte:
+        context['grille'] = _grille(creneaux, periode, request.user)
+        return _marquer_version(render(request, 'permanences/calendrier_grille.html', context), etag)
+
+    # Organiser les créneaux par jour (une seule passe, tout est lu depuis le prefetch)
+    _preparer_creneaux(creneaux, request.user)
+    creneaux_par_jour = {}
+    for creneau in creneaux:
+        creneaux_par_jour.setdefault(creneau.date, []).append(creneau)
+
+    context['creneaux_par_jour'] = creneaux_par_jour
+    return _marquer_version(render(request, 'permanences/calendrier.html', context), etag)
+
+
+@login_required
+def calendrier_jour(request, jour):
+    """Créneaux d'un jour de la grille compacte, dépliés à la demande (fragment HTML)"""
+    try:
+        jour = datetime.strptime(jour, '%Y-%m-%d').date()
+    except ValueError:
+        raise Http404
+    version = version_periode(jour, jour)
+    etag = _etag(
+        request, 'calendrier_jour', jour, timezone.localdate(), request.GET.urlencode(),
+        version['derniere'], version['total'], version['passes']
+    )
+    non_modifie = _non_modifie(request, etag)
+    if non_modifie is not None:
+        return non_modifie
+
+    creneaux = creneaux_periode(jour, jour, version)
+    _preparer_creneaux(creneaux, request.user)
+    retour = {cle: request.GET[cle] for cle in ('week', 'semaines', 'mois') if request.GET.get(cle)}
+    return _marquer_version(render(request, 'permanences/_jour.html', {
+        'creneaux': creneaux,
+        'week_start': jour - timedelta(days=jour.weekday()),
+        'retour': urlencode(retour),
+    }), etag)
 
 
 @user_passes_test(is_superuser)
@@ -88,36 +283,16 @@ def inscrire_creneau(request, creneau_id):
         messages.error(request, "Utilisateur introuvable.")
         return redirect('permanences:calendrier')
     
-    # Vérifications
-    if creneau.est_passe:
-        messages.error(request, "Impossible d'inscrire à un créneau passé.")
-        return redirect('permanences:calendrier')
-    
-    if creneau.complet:
-        messages.error(request, "Ce créneau est complet.")
-        return redirect('permanences:calendrier')
-    
-    # Vérifier si l'utilisateur n'est pas déjà inscrit
-    inscription_existante = Inscription.objects.filter(
-        utilisateur=utilisateur,
-        creneau=creneau,
-        annulee=False
-    ).first()
-    
-    if inscription_existante:
-        messages.warning(request, f"{utilisateur.username} est déjà inscrit à ce créneau.")
-        return redirect('permanences:calendrier')
-    
-    # Créer l'inscription
+    # Vérification de capacité et création atomiques
     try:
-        inscription = Inscription.objects.create(
-            utilisateur=utilisateur,
-            creneau=creneau,
+        services.inscrire(
+            utilisateur,
+            creneau,
             commentaire=request.POST.get('commentaire', '')
         )
         messages.success(request, f"Inscription de {utilisateur.username} confirmée pour le {creneau.date} de {creneau.heure_debut} à {creneau.heure_fin}.")
-    except Exception as e:
-        messages.error(request, f"Erreur lors de l'inscription : {str(e)}")
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
     
     return redirect('permanences:calendrier')
 
@@ -154,79 +329,232 @@ def mes_inscriptions(request):
             models.Q(creneau__date=now.date(), creneau__heure_fin__gt=now.time())
         )
         .order_by('creneau__date', 'creneau__heure_debut'))
-    return render(request, 'permanences/mes_inscriptions.html', {
+
+    # Toute inscription ou annulation modifie le créneau concerné (modifie_le)
+    version = inscriptions_a_venir.aggregate(
+        total=models.Count('id'),
+        derniere=models.Max('creneau__modifie_le')
+    )
+    # Les demandes en attente et leurs positions font partie de la version
+    attentes = list(services.avec_position(
+        Attente.objects.filter(utilisateur=request.user, creneau__date__gte=now.date())
+        .select_related('creneau')
+        .order_by('creneau__date', 'creneau__heure_debut')
+    ))
+    etag = _etag(
+        request, 'mes_inscriptions', version['total'], version['derniere'],
+        [(attente.pk, attente.position) for attente in attentes]
+    )
+    non_modifie = _non_modifie(request, etag)
+    if non_modifie is not None:
+        return non_modifie
+
+    jeton, _ = JetonCalendrier.objects.get_or_create(utilisateur=request.user)
+    return _marquer_version(render(request, 'permanences/mes_inscriptions.html', {
         'inscriptions_a_venir': inscriptions_a_venir,
-    })
+        'attentes': [attente for attente in attentes if not attente.creneau.est_passe],
+        'url_ics': request.build_absolute_uri(reverse('permanences:ics_membre', args=[jeton.jeton])),
+        'url_ics_stand': request.build_absolute_uri(reverse('permanences:ics_stand', args=[ics.jeton_stand()])),
+    }), etag)
 
 def ajax_places_disponibles(request, creneau_id):
     """Retourne le nombre de places disponibles pour un créneau (AJAX)"""
     creneau = get_object_or_404(CreneauHoraire, id=creneau_id)
     
-    return JsonResponse({
+    # Le créneau change à chaque inscription/annulation, puis une dernière fois
+    # quand il se termine
+    derniere = creneau.modifie_le
+    if creneau.est_passe:
+        fin = timezone.make_aware(datetime.combine(creneau.date, creneau.heure_fin))
+        derniere = max(derniere, fin)
+    last_modified = int(derniere.timestamp())
+    etag = _etag(request, creneau.pk, last_modified, creneau.nb_inscrits, creneau.max_personnes, par_utilisateur=False)
+    non_modifie = _non_modifie(request, etag, last_modified)
+    if non_modifie is not None:
+        return non_modifie
+    
+    return _marquer_version(JsonResponse({
         'places_disponibles': creneau.places_disponibles,
         'complet': creneau.complet,
         'est_passe': creneau.est_passe,
-    })
+    }), etag, last_modified)
 
 
-@user_passes_test(is_superuser)
-def gestion_inscriptions(request):
-    """Vue de gestion des inscriptions pour les super utilisateurs"""
-    # Récupérer la semaine courante ou celle spécifiée
-    today = timezone.now().date()
-    week_start = request.GET.get('week')
+# Nombre maximum de créneaux demandés par ?ids=
+MAX_CRENEAUX_LOT = 500
+
+# La version rendue au client est antérieure à l'instant de la requête : une
+# inscription en cours de validation pendant la lecture sera renvoyée au
+# prochain appel (au pire en double, ce qui est sans effet côté client)
+MARGE_VERSION = timedelta(seconds=10)
+
+
+def ajax_places_lot(request):
+    """
+    Occupation d'une semaine (?week=) ou d'une liste de créneaux (?ids=1,2,3),
+    lue en une seule requête (AJAX).
+
+    Avec ?depuis=<version>, seuls les créneaux modifiés ou terminés depuis
+    cette version sont renvoyés ; les créneaux désactivés entre-temps sont
+    listés dans `retires`.
+    """
+    maintenant = timezone.now()
+    creneaux = CreneauHoraire.objects.all()
     
-    if week_start:
+    ids = request.GET.get('ids')
+    if ids:
         try:
-            week_start = datetime.strptime(week_start, '%Y-%m-%d').date()
+            ids = [int(i) for i in ids.split(',') if i]
         except ValueError:
-            week_start = today - timedelta(days=today.weekday())
+            return JsonResponse({'erreur': "Paramètre ids invalide"}, status=400)
+        creneaux = creneaux.filter(pk__in=ids[:MAX_CRENEAUX_LOT])
     else:
-        week_start = today - timedelta(days=today.weekday())
+        _, week_start = _semaine_demandee(request)
+        creneaux = creneaux.filter(date__range=[week_start, week_start + timedelta(days=6)])
     
+    depuis = request.GET.get('depuis')
+    if depuis:
+        try:
+            depuis = datetime.fromtimestamp(int(depuis), tz=dt_timezone.utc)
+        except (ValueError, OverflowError):
+            return JsonResponse({'erreur': "Paramètre depuis invalide"}, status=400)
+    
+    return JsonResponse(_occupation(creneaux, depuis, maintenant))
+
+
+def _occupation(creneaux, depuis, maintenant):
+    """Occupation des créneaux du queryset (une requête), limitée aux changements après `depuis`"""
+    resultats = []
+    retires = []
+    lignes = creneaux.order_by('date', 'heure_debut').values_list(
+        'id', 'date', 'heure_fin', 'max_personnes', 'nb_inscrits', 'actif', 'modifie_le'
+    )
+    for pk, jour, heure_fin, max_personnes, nb_inscrits, actif, modifie_le in lignes:
+        fin = timezone.make_aware(datetime.combine(jour, heure_fin))
+        passe = fin <= maintenant
+        if depuis and modifie_le <= depuis and (not passe or fin <= depuis):
+            continue
+        if not actif:
+            if depuis:
+                retires.append(pk)
+            continue
+        resultats.append({
+            'id': pk,
+            'inscrits': nb_inscrits,
+            'max': max_personnes,
+            'complet': nb_inscrits >= max_personnes,
+            'passe': passe,
+        })
+    return {
+        'version': int((maintenant - MARGE_VERSION).timestamp()),
+        'creneaux': resultats,
+        'retires': retires,
+    }
+
+
+# Relecture de la base par chaque flux SSE, pour les changements faits par
+# les autres workers (secondes)
+INTERVALLE_FLUX = 15
+
+# Un flux est refermé après cette durée ; le navigateur se reconnecte seul
+DUREE_MAX_FLUX = 300
+
+
+async def flux_places(request):
+    """
+    Flux Server-Sent Events des changements d'occupation d'une semaine (?week=).
+
+    Nécessite le serveur ASGI (inscription.asgi) : sous WSGI un flux bloquerait
+    un worker, la vue répond alors 204 et la page revient au polling de
+    ajax_places_lot.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=403)
+    
+    _, week_start = _semaine_demandee(request)
     week_end = week_start + timedelta(days=6)
+    return StreamingHttpResponse(
+        _evenements_places(week_start, week_end),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def _evenements_places(week_start, week_end):
+    creneaux = CreneauHoraire.objects.filter(date__range=[week_start, week_end])
+    lire = sync_to_async(_occupation)
+    abonnement = diffusion.abonner()
+    boucle = asyncio.get_running_loop()
+    echeance = boucle.time() + DUREE_MAX_FLUX
+    depuis = timezone.now() - MARGE_VERSION
+    try:
+        yield 'retry: 5000\n\n'
+        while boucle.time() < echeance:
+            date = await abonnement.attendre(INTERVALLE_FLUX)
+            if date and not week_start <= date <= week_end:
+                continue
+            maintenant = timezone.now()
+            changements = await lire(creneaux, depuis, maintenant)
+            depuis = maintenant - MARGE_VERSION
+            if changements['creneaux'] or changements['retires']:
+                yield f"event: places\ndata: {json.dumps(changements)}\n\n"
+            else:
+                yield ': ping\n\n'
+    finally:
+        abonnement.fermer()
+
+
+@user_passes_test(is_superuser)
+def gestion_inscriptions(request):
+    """Vue de gestion des inscriptions pour les super utilisateurs"""
+    # Semaine courante ou période spécifiée (?week=, ?semaines=N, ?mois=AAAA-MM)
+    periode = _periode_demandee(request)
+    today, week_start, week_end = periode['today'], periode['debut'], periode['fin']
     
-    # Récupérer tous les utilisateurs actifs
+    # Liste partagée des utilisateurs actifs, rendue une seule fois dans la page :
+    # chaque liste déroulante est remplie côté client à partir de cette liste
     from django.contrib.auth.models import User
-    utilisateurs = User.objects.filter(is_active=True).order_by('username')
+    utilisateurs = list(
+        User.objects.filter(is_active=True)
+        .order_by('username')
+        .values('id', 'username', 'first_name')
+    )
     
-    # Récupérer les créneaux de la semaine avec leurs inscriptions
+    # Créer à la demande les créneaux des horaires récurrents, comme le calendrier
+    for rang in range(periode['semaines']):
+        materialiser_semaine(week_start + timedelta(weeks=rang))
+
+    # Récupérer les créneaux de la période avec leurs inscriptions (une requête
+    # par table, quelle que soit la durée de la période)
     creneaux = CreneauHoraire.objects.filter(
         date__range=[week_start, week_end],
         actif=True
     ).prefetch_related('inscriptions__utilisateur').order_by('date', 'heure_debut')
     
-    # Organiser les créneaux par jour et ajouter les utilisateurs disponibles
+    # Organiser les créneaux par jour ; seuls les IDs des inscrits (au plus
+    # max_personnes par créneau) sont transmis, les disponibles s'en déduisent
     creneaux_par_jour = {}
     for creneau in creneaux:
         if creneau.date not in creneaux_par_jour:
             creneaux_par_jour[creneau.date] = []
         
-        # Récupérer les IDs des utilisateurs déjà inscrits (non annulés)
-        utilisateurs_inscrits_ids = set(
-            inscription.utilisateur.id 
-            for inscription in creneau.inscriptions.filter(annulee=False)
+        creneau.inscrits_ids = ','.join(
+            str(inscription.utilisateur_id)
+            for inscription in creneau.liste_inscriptions_actives
         )
         
-        # Filtrer les utilisateurs disponibles pour ce créneau
-        creneau.utilisateurs_disponibles = [
-            utilisateur for utilisateur in utilisateurs 
-            if utilisateur.id not in utilisateurs_inscrits_ids
-        ]
-        
         creneaux_par_jour[creneau.date].append(creneau)
     
-    # Naviguation semaine précédente/suivante
-    prev_week = week_start - timedelta(days=7)
-    next_week = week_start + timedelta(days=7)
-    
     context = {
         'creneaux_par_jour': creneaux_par_jour,
         'utilisateurs': utilisateurs,
+        'statistiques_cache': statistiques_cache(),
         'week_start': week_start,
         'week_end': week_end,
-        'prev_week': prev_week,
-        'next_week': next_week,
+        'periode': periode,
         'today': today,
     }
     
@@ -237,27 +565,19 @@ def gestion_inscriptions(request):
 @require_POST
 def auto_inscription(request, creneau_id):
     creneau = get_object_or_404(CreneauHoraire, pk=creneau_id)
-    inscription = Inscription.objects.filter(
-        utilisateur=request.user,
-        creneau=creneau
-    ).first()
-    if inscription:
-        if inscription.annulee:
-            inscription.annulee = False
-            inscription.date_annulation = None
-            inscription.save()
-            messages.success(request, "Votre inscription a été réactivée.")
-        else:
-            messages.info(request, "Vous êtes déjà inscrit à ce créneau.")
+    if creneau.get_user_inscription(request.user):
+        messages.info(request, "Vous êtes déjà inscrit à ce créneau.")
     else:
-        Inscription.objects.create(utilisateur=request.user, creneau=creneau)
-        messages.success(request, "Vous êtes inscrit à ce créneau.")
-    # Redirection avec la semaine courante
-    week = request.GET.get('week')
-    url = reverse('permanences:calendrier')
-    if week:
-        url += f'?week={week}'
-    return redirect(url)
+        try:
+            _, creee = services.inscrire(request.user, creneau)
+            if creee:
+                messages.success(request, "Vous êtes inscrit à ce créneau.")
+            else:
+                messages.success(request, "Votre inscription a été réactivée.")
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+    # Redirection vers la période affichée
+    return _retour_calendrier(request)
 
 
 
@@ -273,16 +593,205 @@ def auto_desinscription(request, inscription_id):
     if inscription.creneau.est_passe:
         messages.error(request, "Impossible d'annuler une inscription pour un créneau passé.")
         return redirect('permanences:calendrier')
-    inscription.annulee = True
-    inscription.date_annulation = timezone.now()
-    inscription.save()
+    inscription.annuler()
     messages.success(request, "Votre inscription a bien été annulée.")
-    next_page = request.GET.get('next')
-    if next_page == "mes_inscriptions":
+    return _retour_calendrier(request)
+
+
+@user_passes_test(is_superuser)
+def tableau_performance(request):
+    """Vues les plus lentes et pires requêtes SQL mesurées par ce processus"""
+    if request.method == 'POST':
+        perf.vider()
+        messages.success(request, "Mesures de performance réinitialisées.")
+        return redirect('permanences:performance')
+
+    return render(request, 'permanences/performance.html', {
+        'statistiques': perf.statistiques(),
+        'pires_requetes': perf.pires_requetes(),
+        'mesure_active': settings.PERF_MESURE,
+        'taille_tampon': settings.PERF_TAILLE_TAMPON,
+        'pid': os.getpid(),
+    })
+
+
+@user_passes_test(is_superuser)
+def classement_membres(request):
+    """Membres classés par heures de permanence sur un mois (?mois=AAAA-MM) ou une année (?annee=AAAA)"""
+    aujourd_hui = timezone.localdate()
+    try:
+        if request.GET.get('annee'):
+            debut = date(int(request.GET['annee']), 1, 1)
+        elif request.GET.get('mois'):
+            debut = datetime.strptime(request.GET['mois'], '%Y-%m').date()
+        else:
+            debut = aujourd_hui.replace(day=1)
+    except ValueError:
+        debut = aujourd_hui.replace(day=1)
+
+    if request.GET.get('annee'):
+        fin = debut.replace(month=12, day=31)
+        precedent = {'annee': debut.year - 1}
+        suivant = {'annee': debut.year + 1}
+    else:
+        fin = (debut + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        precedent = {'mois': f'{(debut - timedelta(days=1)):%Y-%m}'}
+        suivant = {'mois': f'{(fin + timedelta(days=1)):%Y-%m}'}
+
+    membres = classement(debut, fin)
+    for membre in membres:
+        membre['heures'] = membre['minutes'] / 60
+    return render(request, 'permanences/classement.html', {
+        'membres': membres,
+        'debut': debut,
+        'annuel': bool(request.GET.get('annee')),
+        'url_precedent': '?' + urlencode(precedent),
+        'url_suivant': '?' + urlencode(suivant),
+    })
+
+
+@user_passes_test(is_superuser)
+def export_inscriptions(request):
+    """Export CSV ou XLSX des inscriptions d'une période (?debut=&fin=AAAA-MM-JJ&format=&annulees=1)"""
+    aujourd_hui = timezone.localdate()
+    try:
+        debut = datetime.strptime(request.GET.get('debut', ''), '%Y-%m-%d').date()
+    except ValueError:
+        debut = aujourd_hui.replace(day=1)
+    try:
+        fin = datetime.strptime(request.GET.get('fin', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fin = (debut + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+    inscriptions = export.inscriptions_periode(debut, fin, annulees=request.GET.get('annulees') == '1')
+    return export.reponse_export(
+        inscriptions,
+        f'inscriptions_{debut:%Y%m%d}_{fin:%Y%m%d}',
+        format=request.GET.get('format', 'csv')
+    )
+
+
+def _reponse_ics(texte, etag):
+    reponse = HttpResponse(texte, content_type='text/calendar; charset=utf-8')
+    reponse['Content-Disposition'] = 'inline; filename="permanences.ics"'
+    return _marquer_version(reponse, etag)
+
+
+def ics_membre(request, jeton):
+    """Flux iCalendar des inscriptions d'un membre (sans connexion, jeton secret)"""
+    jeton_calendrier = get_object_or_404(
+        JetonCalendrier.objects.select_related('utilisateur'),
+        jeton=jeton,
+        utilisateur__is_active=True
+    )
+    utilisateur = jeton_calendrier.utilisateur
+    version = ics.version(ics.inscriptions_membre(utilisateur.pk))
+    etag = _etag(
+        request, 'ics', jeton, ics.periode()[0], version['derniere'], version['total'],
+        par_utilisateur=False
+    )
+    non_modifie = _non_modifie(request, etag)
+    if non_modifie is not None:
+        return non_modifie
+    return _reponse_ics(ics.flux_membre(utilisateur, version), etag)
+
+
+def ics_stand(request, jeton):
+    """Flux iCalendar des créneaux pourvus du stand (sans connexion, jeton secret)"""
+    if not ics.jeton_stand_valide(jeton):
+        raise Http404
+    version = ics.version(ics.inscriptions_stand())
+    etag = _etag(
+        request, 'ics_stand', ics.periode()[0], version['derniere'], version['total'],
+        par_utilisateur=False
+    )
+    non_modifie = _non_modifie(request, etag)
+    if non_modifie is not None:
+        return non_modifie
+    return _reponse_ics(ics.flux_stand(version), etag)
+
+
+@login_required
+@require_POST
+def renouveler_jeton_calendrier(request):
+    """Invalide l'URL d'abonnement du membre et en crée une nouvelle"""
+    jeton, _ = JetonCalendrier.objects.get_or_create(utilisateur=request.user)
+    jeton.renouveler()
+    messages.success(request, "Nouvelle adresse d'abonnement créée ; l'ancienne ne fonctionne plus.")
+    return redirect('permanences:mes_inscriptions')
+
+
+def _retour_calendrier(request):
+    """Redirige vers la page d'origine (?next=mes_inscriptions) ou la période affichée du calendrier"""
+    if request.GET.get('next') == 'mes_inscriptions':
         return redirect('permanences:mes_inscriptions')
-    week = request.GET.get('week')
     url = reverse('permanences:calendrier')
-    if week:
-        url += f'?week={week}'
+    parametres = {cle: request.GET[cle] for cle in ('week', 'semaines', 'mois') if request.GET.get(cle)}
+    if parametres:
+        url += '?' + urlencode(parametres)
     return redirect(url)
 
+
+@login_required
+@require_POST
+def rejoindre_liste_attente(request, creneau_id):
+    creneau = get_object_or_404(CreneauHoraire, pk=creneau_id)
+    try:
+        position = services.rejoindre_attente(request.user, creneau)
+        messages.success(
+            request,
+            f"Vous êtes n° {position} sur la liste d'attente : vous serez inscrit automatiquement si une place se libère."
+        )
+    except ValidationError as e:
+        messages.error(request, e.messages[0])
+    return _retour_calendrier(request)
+
+
+@login_required
+@require_POST
+def quitter_liste_attente(request, creneau_id):
+    creneau = get_object_or_404(CreneauHoraire, pk=creneau_id)
+    if services.quitter_attente(request.user, creneau):
+        messages.success(request, "Vous avez quitté la liste d'attente.")
+    return _retour_calendrier(request)
+
+
+def _rapport_serie(resultats):
+    """Synthèse d'une inscription en série : (nombre par résultat, lignes du rapport)"""
+    totaux = {}
+    for _, resultat in resultats:
+        libelle = services.LIBELLES_RESULTAT[resultat]
+        totaux[libelle] = totaux.get(libelle, 0) + 1
+    lignes = [
+        {
+            'creneau': creneau,
+            'libelle': services.LIBELLES_RESULTAT[resultat],
+            'succes': resultat in (services.INSCRIT, services.REACTIVE),
+        }
+        for creneau, resultat in resultats
+    ]
+    return totaux, lignes
+
+
+@user_passes_test(is_superuser)
+def inscription_serie(request):
+    """Inscrit un membre à des créneaux réguliers sur une période, en une opération"""
+    rapport = None
+    if request.method == 'POST':
+        form = InscriptionSerieForm(request.POST)
+        if form.is_valid():
+            donnees = form.cleaned_data
+            resultats = services.inscrire_en_serie(
+                donnees['utilisateur'], donnees['date_debut'], donnees['date_fin'],
+                donnees['jours'], donnees['heure_debut'], donnees['heure_fin'],
+                commentaire=donnees['commentaire']
+            )
+            totaux, lignes = _rapport_serie(resultats)
+            rapport = {'utilisateur': donnees['utilisateur'], 'totaux': totaux, 'lignes': lignes}
+    else:
+        today, week_start = _semaine_demandee(request)
+        form = InscriptionSerieForm(initial={
+            'date_debut': week_start,
+            'date_fin': week_start + timedelta(weeks=12, days=6),
+        })
+    return render(request, 'permanences/inscription_serie.html', {'form': form, 'rapport': rapport})